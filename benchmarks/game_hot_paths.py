@@ -0,0 +1,255 @@
+# Micro-benchmarks for the Game cog's hot paths, run against fake Discord objects and a temporary copy of the
+# game database. Reports latency percentiles and SQL statements per call (counted with the sqlite3 trace callback),
+# and compares them against a saved baseline.
+#
+# Run from the repository root:
+#   python benchmarks/game_hot_paths.py                    # run and compare with benchmarks/baseline.json
+#   python benchmarks/game_hot_paths.py --save-baseline    # run and save the results as the new baseline
+#   python benchmarks/game_hot_paths.py --only open_card_pack get_inventory
+# Exits with status 1 if any operation regressed past the threshold or has no baseline to compare with; the
+# committed baseline was measured on one machine, so save a fresh one before comparing on another.
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, ".")
+sys.path.append("./utils")
+import discord
+from discord.ext import pages
+import numpy as np
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from attachments import AttachmentCache, MemoryAttachmentStore
+from cooldowns import Cooldowns
+from collection_cache import CollectionCache
+from database import Database
+from metrics import Metrics
+import lib.cogs.game as game
+import tools
+
+
+BASELINE_PATH = "./benchmarks/baseline.json"
+DATABASE_PATH = "./data/trading_cards.sqlite"
+SERIES = "1990-Impel-Marvel-Universe"
+NUM_MEMBERS = 50
+
+
+class Fake(object):
+    # Attribute bag standing in for discord objects
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeContext(Fake):
+    # Just enough of ApplicationContext for the commands: responses are collected instead of sent
+    def __init__(self, author, guild):
+        super().__init__(author=author, guild=guild, interaction=Fake(), responses=[])
+
+    async def defer(self, *args, **kwargs):
+        pass
+
+    async def respond(self, *args, **kwargs):
+        self.responses.append((args, kwargs))
+        return Fake(embeds=[], attachments=[])
+
+
+class CountingDatabase(Database):
+    # Counts the SQL statements run on every pooled connection
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.num_statements = 0
+
+    def connect(self):
+        connection = super().connect()
+        connection.set_trace_callback(self.count)
+        return connection
+
+    def count(self, statement):
+        self.num_statements += 1
+
+
+class FakeBot(Fake):
+    def __init__(self, database):
+        super().__init__(db=database, ready=False, game_database=database.path, shutdown_hooks=[],
+                         scheduler=AsyncIOScheduler(), cogs_ready=Fake(ready_up=lambda cog: None),
+                         attachments=AttachmentCache(MemoryAttachmentStore()), cooldowns=Cooldowns(database),
+                         collections=CollectionCache(database), metrics=Metrics())
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q/100*(len(ordered) - 1))))]
+
+
+async def measure(database, func, iterations, warmup=3):
+    # Returns {"p50", "p90", "p99", "max" (ms), "statements" (SQL statements run per call, counting each executemany row)}
+    for _ in range(warmup):
+        await func()
+    samples = []
+    num_statements = database.num_statements
+    for _ in range(iterations):
+        start = perf_counter()
+        await func()
+        samples.append((perf_counter() - start)*1000)
+    return {"p50": percentile(samples, 50), "p90": percentile(samples, 90), "p99": percentile(samples, 99),
+            "max": max(samples), "statements": (database.num_statements - num_statements)/iterations}
+
+
+async def setup(directory):
+    shutil.copy(DATABASE_PATH, f"{directory}/db.sqlite")
+    database = CountingDatabase(f"{directory}/db.sqlite")
+    bot = FakeBot(database)
+    cog = game.Game(bot)
+    await game.Game.on_ready(cog)
+    cog.rng = np.random.default_rng(0)  # Same draws, and so the same collections, on every run
+    bot.scheduler.remove_all_jobs()
+
+    members = [Fake(id=n, display_name=f"member{n}", colour=discord.Colour.blue(), bot=False, mention=f"<@{n}>")
+               for n in range(1, NUM_MEMBERS + 1)]
+    guild = Fake(members=members)
+    player, partner = members[0], members[1]
+
+    # Give both players a collection to look at and trade from
+    for member in (player, partner):
+        await database.get_player(member.id, cog.pack_cost, 0)
+        await database.execute("UPDATE players SET packs = 1000000 WHERE player_id = ?;", (member.id,))
+        for _ in range(20):
+            await cog.open_card_pack(FakeContext(member, guild), series=SERIES)
+    return database, bot, cog, guild, player, partner
+
+
+async def operations(bot, cog, guild, player, partner):
+    # {name: (iterations, coroutine function)}
+    # Trade offers made of cards each side owns
+    offers = []
+    for member, num_cards in [(player, 4), (partner, 3)]:
+        owned = [card_id for (series, card_id, _, _) in await bot.db.get_inventory(member.id) if series == SERIES]
+        offers.append(", ".join(owned[:num_cards]))
+    thumbnails = [card.thumbnail_path for card in cog.catalog.series_cards[SERIES][:12]]
+    card = cog.catalog.series_cards[SERIES][0]
+    autocomplete = Fake(options={"series": cog.catalog.series_text[SERIES]}, value="spider")
+
+    async def choose_random_card():
+        cog.choose_random_card(num=12)
+
+    async def render_pack_image_atlas():
+        cog.render_pack_image(SERIES, thumbnails)
+
+    async def render_pack_image_files():
+        # Without the series' atlas, as when it couldn't be loaded or built
+        atlases, cog.thumbnail_atlases = cog.thumbnail_atlases, {}
+        try:
+            cog.render_pack_image(SERIES, thumbnails)
+        finally:
+            cog.thumbnail_atlases = atlases
+
+    async def open_card_pack():
+        await cog.open_card_pack(FakeContext(player, guild), series=SERIES)
+
+    async def get_inventory():
+        await cog.get_inventory.callback(cog, FakeContext(player, guild))
+
+    async def setup_trade():
+        # Parse both sides, check and reserve them, then release the reservation (the trade as far as the confirm wait)
+        give, _ = cog.parse_trade_cards(offers[0], SERIES)
+        take, _ = cog.parse_trade_cards(offers[1], SERIES)
+        trade_id, _ = await bot.db.reserve_trade(player.id, partner.id, give, take, 0, 1)
+        await bot.db.cancel_trade(trade_id)
+
+    async def list_all_cards():
+        await cog.list_all_cards(autocomplete)
+
+    member_ids = [member.id for member in guild.members]
+
+    async def missing_cards():
+        cog.holdings.missing(player.id, member_ids)
+
+    async def trade_matches():
+        cog.holdings.matches(player.id, member_ids)
+
+    async def trading_card_embed_standard():
+        embed, image = tools.trading_card_embed_standard(card, 3)
+        if image:
+            image.close()
+
+    return {"choose_random_card": (2000, choose_random_card),
+            "render_pack_image_atlas": (100, render_pack_image_atlas),
+            "render_pack_image_files": (20, render_pack_image_files),
+            "open_card_pack": (100, open_card_pack),
+            "get_inventory": (200, get_inventory),
+            "setup_trade": (200, setup_trade),
+            "list_all_cards": (2000, list_all_cards),
+            "missing_cards": (500, missing_cards),
+            "trade_matches": (500, trade_matches),
+            "trading_card_embed_standard": (2000, trading_card_embed_standard)}
+
+
+def compare(results, baseline, threshold):
+    # Returns the names of operations slower than baseline p50 by more than threshold, or running more SQL statements
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        slower = result["p50"] > baseline[name]["p50"]*(1 + threshold)
+        more_statements = result["statements"] > baseline[name]["statements"] + 1e-9
+        if slower or more_statements:
+            regressions.append(name)
+    return regressions
+
+
+async def main(args):
+    async def fake_respond(self, interaction, ephemeral=False):
+        pass
+    pages.Paginator.respond = fake_respond  # The paginator would otherwise talk to Discord
+
+    directory = tempfile.mkdtemp()
+    try:
+        database, bot, cog, guild, player, partner = await setup(directory)
+        results = {}
+        for name, (iterations, func) in (await operations(bot, cog, guild, player, partner)).items():
+            if args.only and name not in args.only:
+                continue
+            results[name] = await measure(database, func, max(1, int(iterations*args.scale)))
+        database.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    missing = [] if args.save_baseline else [name for name in results if name not in baseline]
+
+    print(f"{'operation':<30}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}{'sql':>10}{'baseline p50':>14}")
+    for name, result in results.items():
+        base = f"{baseline[name]['p50']:.3f}" if name in baseline else "-"
+        flag = "  REGRESSION" if name in regressions else "  NO BASELINE" if name in missing else ""
+        print(f"{name:<30}{result['p50']:>10.3f}{result['p90']:>10.3f}{result['p99']:>10.3f}{result['max']:>10.3f}"
+              f"{result['statements']:>10.1f}{base:>14}{flag}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(dict(baseline, **results), f, indent=1, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+    elif missing:
+        print(f"No baseline for {', '.join(missing)} in {args.baseline}; run with --save-baseline to record one")
+    return 1 if (regressions and not args.save_baseline) or missing else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Game cog's hot paths.")
+    parser.add_argument("--only", nargs="*", help="operations to run (default: all)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help=f"baseline file (default: {BASELINE_PATH})")
+    parser.add_argument("--save-baseline", action="store_true", help="save these results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed p50 slowdown before flagging (default: 0.25)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every operation's iteration count")
+    args = parser.parse_args()
+    if not args.save_baseline and not os.path.exists(args.baseline):
+        parser.error(f"no baseline at {args.baseline}; run with --save-baseline to record one")
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,73 @@
+# Messages/sec of Convert's temperature detection, before (the old per-message lowercase + re.findall + keyword search)
+# and after (Convert.scan_temperatures), over a synthetic corpus shaped like guild chat.
+# Run from the repository root: python benchmarks/temperature_scanner.py [number of messages]
+import random
+import re
+import sys
+from time import perf_counter
+
+sys.path.insert(0, ".")
+from lib.cogs.convert import Convert
+
+
+CHAT = ["lol", "good morning everyone", "did anyone watch the new episode last night?", "that's hilarious",
+        "I can't believe they cancelled it", "brb getting coffee", "Wolverine is the best and I will not be taking questions",
+        "anyone want to trade? I have too many Cyclops cards", "ok that's fair", "same", "wait what happened",
+        "honestly the 90s cartoon holds up", "this channel is chaos today", "who has the holographic Magneto"]
+NUMBERS = ["I'll be on at 8pm", "got 3 duplicates of Storm again", "only 12 cards left to complete the set",
+           "meeting moved to 10:30", "it took me 45 minutes to get home", "card #161 is so rare", "2 for 1 deal at the store"]
+TEMPERATURES = ["it's 30C here today", "ugh 95 degrees F and humid", "-5 celsius this morning", "oven at 350°F",
+                "a balmy 21 deg c", "it was 100f yesterday and 60f today"]
+LINKS = ["https://example.com/news/2023/heatwave-40c", "look at this https://cdn.example.com/img/card_12.png",
+         "check out my pull lol card.gif 10/10"]
+
+
+def make_corpus(n, seed=0):
+    rng = random.Random(seed)
+    groups = [(CHAT, 0.70), (NUMBERS, 0.18), (TEMPERATURES, 0.05), (LINKS, 0.07)]
+    return [rng.choice(rng.choices([g for g, _ in groups], weights=[w for _, w in groups])[0]) for _ in range(n)]
+
+
+def legacy_scan(convert, content):
+    # The scan on_message used to do, kept here for comparison. The pattern was a string built once in __init__
+    # and passed to re.findall on every message.
+    keywords = convert.keywords
+    temperature_pattern = LEGACY_PATTERN
+    temperatures = []
+    msg = content.lower()
+    if not any([m in msg for m in ['http://', 'https://', '.jpg', '.gif', '.png']]):
+        for match in re.findall(temperature_pattern, content.lower()):
+            temperature = float(match[0])
+            for key, value in keywords.items():
+                for val in value:
+                    if match[1] in val:
+                        temperatures.append((temperature, key))
+                        break
+    return temperatures
+
+
+LEGACY_PATTERN = r"([-+]?[.\d]+)\s*(%s)" % ('|'.join(sum(Convert(None).keywords.values(), [])))
+
+
+def rate(scan, corpus, repeats=5):
+    # Best of several runs, in messages per second
+    best = float("inf")
+    for _ in range(repeats):
+        start = perf_counter()
+        for content in corpus:
+            scan(content)
+        best = min(best, perf_counter() - start)
+    return len(corpus)/best
+
+
+if __name__ == "__main__":
+    corpus = make_corpus(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
+    convert = Convert(None)
+    mismatches = [content for content in corpus if legacy_scan(convert, content) != convert.scan_temperatures(content)]
+    assert not mismatches, f"scanners disagree on: {sorted(set(mismatches))}"
+
+    before = rate(lambda content: legacy_scan(convert, content), corpus)
+    after = rate(convert.scan_temperatures, corpus)
+    print(f"{len(corpus)} messages, both scanners agree on every one")
+    print(f"before: {before:12,.0f} messages/sec")
+    print(f"after:  {after:12,.0f} messages/sec ({after/before:.1f}x)")
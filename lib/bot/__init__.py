@@ -5,6 +5,14 @@ from discord.ext.commands import Bot as BotBase
 from dotenv import load_dotenv
 from glob import glob
 import os
+import sys
+sys.path.append("./utils")
+from database import Database
+from attachments import AttachmentCache, DatabaseAttachmentStore
+from cooldowns import Cooldowns
+from collection_cache import CollectionCache
+from metrics import Metrics
+from sqltrace import SqlTracer
 
 
 OWNER_IDS = [268862253326008322]  # Change to personal Discord user ID
@@ -28,8 +36,14 @@ class Bot(BotBase):
     def __init__(self):
         self.test = False  # testing mode, True or False (sets messages to ephemeral)
         self.command_prefix = "!"
+        self.sql_trace = False  # SQL tracing, True or False (logs slow queries and full scans; see /sqltrace)
 
         self.game_database = "./data/trading_cards.sqlite"
+        self.sql_tracer = SqlTracer() if self.sql_trace else None
+        self.db = Database(self.game_database, tracer=self.sql_tracer)  # Shared connection pool for the game database
+        self.attachments = AttachmentCache(DatabaseAttachmentStore(self.db))  # URLs of card images already uploaded
+        self.cooldowns = Cooldowns(self.db)  # Persistent cooldowns and rate limits, usable by any cog
+        self.collections = CollectionCache(self.db)  # Players' card counts, kept up to date by every write
 
         # Environment variables
         self.BOT_TOKEN = None
@@ -40,6 +54,14 @@ class Bot(BotBase):
         self.cogs_ready = Ready()
 
         self.scheduler = AsyncIOScheduler()
+        self.shutdown_hooks = []  # Coroutine functions run on close, before the database is closed
+
+        # Latency, error and database metrics for commands, view callbacks, listeners and renders.
+        # See them with /metrics (owners only) or scrape the Prometheus text file, rewritten every metrics_interval seconds.
+        self.metrics = Metrics()
+        self.metrics_path = "./data/metrics.prom"
+        self.metrics_interval = 60
+        self.scheduler.add_job(self.write_metrics, "interval", seconds=self.metrics_interval)
 
         super().__init__(command_prefix=self.command_prefix,
                          owner_ids=OWNER_IDS,
@@ -61,6 +83,36 @@ class Bot(BotBase):
         print("running bot...")
         super().run(self.BOT_TOKEN, reconnect=True)
 
+    async def close(self):
+        await super().close()
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        for hook in self.shutdown_hooks:
+            await hook()
+        self.db.close()
+        await self.write_metrics()
+
+    async def write_metrics(self):
+        await asyncio.to_thread(self.metrics.write_prometheus, self.metrics_path)
+
+    async def invoke_application_command(self, ctx):
+        with self.metrics.track("command", ctx.command.qualified_name):
+            await super().invoke_application_command(ctx)
+
+    async def on_application_command_error(self, ctx, error):
+        # Command errors are handled inside invoke_application_command, so they are counted here
+        self.metrics.count_error("command", ctx.command.qualified_name)
+        await super().on_application_command_error(ctx, error)
+
+    async def _run_event(self, coro, event_name, *args, **kwargs):
+        # Every event listener (including the cogs' and autocomplete) is run through here
+        name = getattr(coro, "__qualname__", event_name)
+
+        async def tracked(*args, **kwargs):
+            with self.metrics.track("listener", name):
+                await coro(*args, **kwargs)
+        await super()._run_event(tracked, event_name, *args, **kwargs)
+
     async def on_ready(self):
         if not self.ready:
             # FIXME: Set start-up variables, load data, etc.
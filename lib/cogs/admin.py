@@ -0,0 +1,71 @@
+import discord
+import asyncio
+import io
+import os
+from discord.ext.commands import Cog
+from discord.commands import slash_command, Option
+
+import sys
+sys.path.append("./utils")
+import snapshot
+
+
+class Admin(Cog):
+    # Commands for the bot's owners (OWNER_IDS in lib/bot)
+    def __init__(self, bot):
+        self.bot = bot
+
+    @slash_command(description="Show command latency and database metrics (bot owners only).", name="metrics")
+    async def show_metrics(self, ctx,
+                           kind: Option(str, "Only show one kind of metric.", required=False, default=None,
+                                        choices=["command", "view", "listener", "render"])):
+        if not await self.bot.is_owner(ctx.author):
+            await ctx.respond("Only the bot's owners can see its metrics.", ephemeral=True)
+            return
+        embed = discord.Embed(title="Bot metrics", description=f"```\n{self.bot.metrics.summary(kind)}\n```",
+                              colour=discord.Colour.blurple())
+        stats = self.bot.collections.stats()
+        embed.add_field(name="Collection cache",
+                        value=f"{stats['hit_rate']:.0%} hits ({stats['hits']}/{stats['hits'] + stats['misses']}), "
+                              f"{stats['evictions']} evictions, {stats['players']} players in "
+                              f"~{stats['bytes']/2**20:.1f} of {stats['max_bytes']/2**20:.0f} MB")
+        for name, (_, source) in sorted(self.bot.metrics.summaries.items()):
+            (count, total, longest) = source()
+            embed.add_field(name=name, value=f"{count} calls, {total/count*1000 if count else 0:.2f} ms mean, {longest*1000:.2f} ms max")
+        embed.set_footer(text="mean and db ms are per call; p95 is a histogram bucket bound in ms; sql/call needs SQL tracing")
+        await ctx.respond(embed=embed, ephemeral=True)
+
+    @slash_command(description="Show the slowest SQL statements and their query plans (bot owners only).", name="sqltrace")
+    async def show_sql_trace(self, ctx,
+                             limit: Option(int, "Number of statement shapes to show.", required=False, default=10,
+                                           min_value=1, max_value=100)):
+        if not await self.bot.is_owner(ctx.author):
+            await ctx.respond("Only the bot's owners can see the SQL trace.", ephemeral=True)
+            return
+        if self.bot.sql_tracer is None:
+            await ctx.respond("SQL tracing is off; set sql_trace = True in lib/bot and restart to turn it on.", ephemeral=True)
+            return
+        report = self.bot.sql_tracer.report(limit, self.bot.metrics)
+        await ctx.respond(file=discord.File(io.BytesIO(report.encode()), filename="sqltrace.txt"), ephemeral=True)
+
+    @slash_command(description="Write a snapshot of the game database to the backups folder (bot owners only).", name="backup")
+    async def backup(self, ctx):
+        if not await self.bot.is_owner(ctx.author):
+            await ctx.respond("Only the bot's owners can back up the database.", ephemeral=True)
+            return
+        await ctx.defer(ephemeral=True)
+        # Streams the tables out on its own connection in one read transaction, so the game keeps writing meanwhile
+        path = snapshot.backup_path()
+        manifest = await asyncio.to_thread(snapshot.export_snapshot, self.bot.db.path, path)
+        rows = ", ".join([f"{info['rows']} {table}" for table, info in manifest["tables"].items()])
+        await ctx.respond(f"Wrote `{path}` ({os.path.getsize(path)/2**20:.1f} MB) in {manifest['seconds']} s: {rows}.\n"
+                          f"Restore with `python utils/snapshot.py restore {path} <new database file>`.", ephemeral=True)
+
+    @Cog.listener()
+    async def on_ready(self):
+        if not self.bot.ready:
+            self.bot.cogs_ready.ready_up('admin')
+
+
+def setup(bot):
+    bot.add_cog(Admin(bot))
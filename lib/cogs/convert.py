@@ -2,10 +2,13 @@ import discord
 from discord.ext.commands import Cog
 from discord.commands import slash_command, Option, SlashCommandGroup
 import re
-from datetime import datetime, timedelta, time
+from datetime import datetime
 import pytz
 from dateutil import parser
-import dateutil.tz
+
+import sys
+sys.path.append("./utils")
+from timezones import TimezoneService
 
 
 def convert_temp(value, unit):
@@ -22,10 +25,15 @@ class Convert(Cog):
         # Temperature
         self.keywords = {"F": ['degrees f', 'deg f', 'deg. f', 'fahrenheit', '°f', 'f\\b'],
                          "C": ['degrees c', 'deg c', 'deg. c', 'celsius', '°c', 'c\\b']}
-        self.temperature_pattern = r"([-+]?[.\d]+)\s*(%s)" % ('|'.join(sum(self.keywords.values(), [])))
+        # Compiled once: a number followed by a unit, with one named group per unit so a match says which unit it is
+        units = '|'.join([f"(?P<{unit}>{'|'.join(words)})" for unit, words in self.keywords.items()])
+        self.temperature_scanner = re.compile(r"([-+]?[.\d]+)\s*(?:%s)" % units, re.IGNORECASE)
+        self.digit_pattern = re.compile(r"\d")  # Messages without a digit can't mention a temperature
+        self.link_pattern = re.compile(r"https?://|\.(?:jpg|gif|png)", re.IGNORECASE)  # Don't search links or images
         self.time_pattern = r"\b\d{1,2}(?::\d{2})?\s*[ap]m\b"
 
         self.fmt = "%a %b %-d, %Y, %H:%M %Z%z"
+        self.short_fmt = "%a %b %-d, %H:%M %Z"
 
         # Timezone
         self.timezones = {"UTC-10 (Hawaii, Tahiti)": "Pacific/Honolulu",
@@ -50,30 +58,23 @@ class Convert(Cog):
                           "UTC+10 (Melbourne, Sydney)": "Australia/Sydney",
                           "UTC+12 (New Zealand)": "Pacific/Auckland"}
 
+        self.timezone_service = TimezoneService(self.timezones)
+
     def possible_timezones(self, tz_offset, common_only=True):
-        # pick one of the timezone collections
-        if common_only:
-            timezones = list(self.timezones.values())
-        else:
-            timezones = pytz.all_timezones
-
-        # convert the float hours offset to a timedelta
-        offset_days, offset_seconds = 0, int(tz_offset * 3600)
-        if offset_seconds < 0:
-            offset_days = -1
-            offset_seconds += 24 * 3600
-        desired_delta = timedelta(offset_days, offset_seconds)
-
-        # Loop through the timezones and find any with matching offsets
-        null_delta = timedelta(0, 0)
-        results = []
-        for tz_name in timezones:
-            tz = pytz.timezone(tz_name)
-            non_dst_offset = getattr(tz, '_transition_info', [[null_delta]])[-1]
-            if desired_delta == non_dst_offset[0]:
-                results.append(tz_name)
-
-        return results
+        # Zones using a UTC offset (in hours), from the configured zones or from all zones
+        return self.timezone_service.possible_timezones(tz_offset, common_only)
+
+    def scan_temperatures(self, content):
+        # Returns [(temperature, unit)] for each temperature mentioned in a message, e.g. "It's 30C" -> [(30.0, 'C')]
+        if not self.digit_pattern.search(content) or self.link_pattern.search(content):
+            return []
+        temperatures = []
+        for match in self.temperature_scanner.finditer(content):
+            try:
+                temperatures.append((float(match.group(1)), match.lastgroup))
+            except ValueError:  # e.g. "1.2.3"
+                continue
+        return temperatures
 
     time = SlashCommandGroup("time", "Convert or get time in different timezones.")
 
@@ -81,52 +82,56 @@ class Convert(Cog):
         timezones = [tz for tz in self.timezones.keys()]
         return [tz for tz in timezones if ctx.value.lower() in tz.lower()]
 
+    def format_times(self, converted):
+        # One line per zone; a single zone is shown by its offset, several by their labels
+        if len(converted) == 1:
+            (_, dt), = converted
+            return f"**{dt.strftime('UTC%z (%Z)')}:** {dt.strftime(self.fmt)}"
+        return '\n'.join([f"**{label}:** {dt.strftime(self.short_fmt)}" for label, dt in converted])
+
     @time.command(description="Convert date/time.", name="convert")
     async def convert_time(self, ctx,
                            date_time: Option(str, "The date/time to be converted (e.g. 'Jan 1 2021 3pm').", required=True),
                            timezone1: Option(str, "Timezone of date_time (default: UTC). Accounts for daylight savings.",
-                                            required=True, autocomplete=autocomplete_timezones, default='UTC'),
+                                            required=False, autocomplete=autocomplete_timezones, default='UTC'),
                            timezone2: Option(str, "Timezone to convert to (default: current players' timezones). Accounts for daylight savings.",
-                                             required=True, autocomplete=autocomplete_timezones, default=None)):
-        default_date = datetime.combine(datetime.now(), time(0, tzinfo=dateutil.tz.gettz(self.timezones[timezone1])))
+                                             required=False, autocomplete=autocomplete_timezones, default=None)):
+        unknown = [tz for tz in [timezone1, timezone2] if tz and self.timezone_service.get(tz) is None]
+        if unknown:
+            await ctx.respond(f"I don't know the timezone '{unknown[0]}'.")
+            return
         try:
-            datetime_obj = parser.parse(date_time, default=default_date)
-            time_converted = [datetime_obj.astimezone(pytz.timezone(self.timezones[timezone2]))]
-            output = '\n'.join([f"**{dt.strftime('UTC%z (%Z)')}:** {dt.strftime(self.fmt)}" for dt in time_converted])
-            await ctx.respond(f"**{datetime_obj.strftime(self.fmt)}**\n{output}")
+            # Parse relative to midnight today, then attach timezone1 with the DST offset for the parsed date
+            default_date = datetime.combine(datetime.now(), datetime.min.time())
+            datetime_obj = self.timezone_service.localize(parser.parse(date_time, default=default_date), timezone1)
+            time_converted = self.timezone_service.convert(datetime_obj, [timezone2] if timezone2 else None)
+            await ctx.respond(f"**{datetime_obj.strftime(self.fmt)}**\n{self.format_times(time_converted)}")
         except parser.ParserError:
             await ctx.respond(f"I don't understand this time: '{date_time}'.")
             raise ValueError(f"User inputted invalid time format: {date_time}.")
-        print(f"{datetime.now()}: /time convert called by {ctx.author.display_name}")
 
     @time.command(description="Get the current time of various locations.", name="now")
     async def get_time_now(self, ctx,
                            timezone: Option(str, "Desired timezone (default: current players' timezones). Accounts for daylight savings.",
-                                            required=True, autocomplete=autocomplete_timezones, default=None)):
+                                            required=False, autocomplete=autocomplete_timezones, default=None)):
+        if timezone and self.timezone_service.get(timezone) is None:
+            await ctx.respond(f"I don't know the timezone '{timezone}'.")
+            return
         now_utc = datetime.now(tz=pytz.UTC)
-        time_converted = now_utc.astimezone(pytz.timezone(self.timezones[timezone].replace(' ', '_')))
-        await ctx.respond(f"**{time_converted.strftime('UTC%z (%Z)')}:** {time_converted.strftime(self.fmt)}")
-        print(f"{datetime.now()}: /time now called by {ctx.author.display_name}")
+        await ctx.respond(self.format_times(self.timezone_service.convert(now_utc, [timezone] if timezone else None)))
 
     @Cog.listener()
     async def on_message(self, message):
         if not message.author.bot:
             if message.guild:
-                msg = message.content.lower()
-                if not any([m in msg for m in ['http://', 'https://', '.jpg', '.gif', '.png']]):  # Don't search for links or images
-                    temperature_matches = re.findall(self.temperature_pattern, message.content.lower())
-                    if temperature_matches:
-                        msgs = []
-                        for match in temperature_matches:
-                            temperature = float(match[0])
-                            for key, value in self.keywords.items():
-                                for val in value:
-                                    if match[1] in val:
-                                        converted_temperature = convert_temp(temperature, key)
-                                        converted_unit = 'F' if key == 'C' else 'C'
-                                        msgs.append(f"{temperature}°{key} = {converted_temperature}°{converted_unit}")
-                                        break
-                        await message.channel.send('\n'.join(msgs))
+                temperatures = self.scan_temperatures(message.content)
+                if temperatures:
+                    msgs = []
+                    for (temperature, unit) in temperatures:
+                        converted_temperature = convert_temp(temperature, unit)
+                        converted_unit = 'F' if unit == 'C' else 'C'
+                        msgs.append(f"{temperature}°{unit} = {converted_temperature}°{converted_unit}")
+                    await message.channel.send('\n'.join(msgs))
 
     @Cog.listener()
     async def on_ready(self):
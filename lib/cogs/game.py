@@ -3,74 +3,31 @@ from discord.ext.commands import Cog
 from discord.ext import commands, pages
 import discord
 from discord import Embed
-from dateutil import parser
 from collections import Counter
 from datetime import datetime
-from glob import glob
-from io import BytesIO
-import sqlite3
+from time import time
+import asyncio
 from random import choices
 import re
 from PIL import Image
-from math import floor
+from math import floor, ceil
 import numpy as np
 
 import sys
 sys.path.append("./utils")
 import views
 import tools
+import atlas
+import derivatives
+from catalog import CardCatalog, RARITY_TEXT
+from catalog_sync import CatalogSync
+from search import CardIndex
+from holdings import HoldingsIndex
+from sampler import AliasSampler
 
 
-def add_cards_to_db(cursor, series, card_directories, thumbnail_directories):
-    # Add card and card information to database
-    # series, card_directories, and thumbnail_directories are lists
-    for i in range(len(series)):
-        pattern = rf"{series[i].split('X-Men')[0].replace('-', '_')}X-Men_#(\d+|XH\d+|)_" if "X-Men" in series[i] else rf"{series[i].replace('-', '_')}_#(\d+|MH\d+)_"
-        all_images = sorted(glob(f"{card_directories[i]}/*"))
-        card_ids = [re.search(pattern, name).group(1) for name in all_images]
-        thumbnail_images = sorted(glob(f"{thumbnail_directories[i]}/*"))
-
-        input_list = [
-            (card_ids[n], series[i], all_images[n].split("/")[-1], thumbnail_images[n].split("/")[-1]) for n
-            in range(len(all_images))]
-
-        cursor.executemany("INSERT OR REPLACE INTO cards (card_id, series, image_path, thumbnail_path) "
-                           "VALUES (?, ?, ?, ?);", input_list)
-
-        print(f"Added {len(all_images)} cards to database.")
-
-
-def merge_thumbnail_images(images):
-    # Create 12-pack card preview
-    assert len(images) == 12, f"must have 12 images: {len(images)}"
-    im = np.array([ [None, None, None, None],
-                    [None, None, None, None],
-                    [None, None, None, None] ])
-    widths = np.zeros((3, 4))
-    heights = np.zeros((3, 4))
-    n = 0
-    for i in range(len(im)):  # row
-        for j in range(len(im[i])):  # column
-            image = Image.open(images[n])
-            im[i][j] = image
-            widths[i][j] = image.size[0]
-            heights[i][j] = image.size[1]
-            n += 1
-
-    max_width = int(max([sum(widths[i, :]) for i in range(len(im))]))
-    max_height = int(sum([max(heights[i, :]) for i in range(len(im))]))
-
-    image = Image.new("RGBA", (max_width, max_height))
-    y = 0
-    for i in range(len(im)):
-        x = 0
-        if i > 0:
-            y += int(max(heights[i]))
-        for j in range(len(im[i])):
-            image.paste(im[i][j], (x, y))
-            x += im[i][j].size[0]
-
-    return image
+# An entry in a trade offer: a card number with an optional set code, e.g. "12", "#MH4", "XM-12", "XM-#12" or "MU2-12"
+TRADE_CARD_PATTERN = re.compile(r"^(?:([a-z][a-z0-9]*)-)?#?(\d+|MH\d+|XH\d+)$", re.IGNORECASE)
 
 
 class Game(Cog):
@@ -91,13 +48,34 @@ class Game(Cog):
         # Directory of merged images (full sized front and back)
         self.card_directories = [f"./data/cards/{series}/merged" for series in self.card_series]
 
+        self.catalog = None  # In-memory CardCatalog of all cards and sets, loaded in on_ready
+        self.card_index = None  # Autocomplete index built from the catalog
+        self.holdings = None  # Every player's card counts, for /cards missing and /cards matches; built in on_ready
+        # Memory-mapped thumbnail atlases used to draw pack previews {series: ThumbnailAtlas}
+        self.thumbnail_atlases = {}
+        self.pack_image_format = "JPEG"  # JPEG, WEBP or PNG
+        self.pack_image_quality = 85
+        self.pack_image_background = (49, 51, 56)  # Fills the gaps between portrait and landscape cards
+        # Derivatives of the merged card images that may be sent in card embeds (the smallest one is used);
+        # build them with utils/derivatives.py, otherwise the originals are sent
+        self.card_image_variants = ("display", "webp", "jpg")
+
         self.rarity = {1: 0.70, 2: 0.2, 3: 0.08, 4: 0.012, 5: 0.008}
         self.rarity_symbols = {1: "🔹", 2: "🔹", 3: "🔹", 4: "🔸", 5: "♦️️"}
         self.rarity_weights = {}  # Dictionary for card weights {series: {rarity: rarity_prob/num_cards}}
+        self.card_samplers = {}  # Alias tables for card draws, built in on_ready {series: AliasSampler}
+        self.rng_seed = None  # Set to make card draws reproducible
+        self.rng = np.random.default_rng(self.rng_seed)
 
         self.pack_cost = 500  # Cost of one pack
         self.message_reward = 25  # Reward per message sent
+        self.reward_flush_interval = 30  # Seconds between writes of buffered message rewards
+        self.reward_flush_size = 1000  # Write early once this many players have buffered rewards
+        self.pending_rewards = Counter()  # Message rewards not yet written to the database {player_id: points}
+        self.reward_flush_task = None
         self.post_reward = 250  # Reward per post written
+        self.ledger_compact_interval = 24*3600  # Seconds between ledger compactions
+        self.ledger_retention = 30*24*3600  # Ledger entries older than this are compacted into one per player
 
         self.bub = "💰"  # Emoji
 
@@ -123,18 +101,29 @@ class Game(Cog):
                                "You're fresh out of change at the arcade after losing 20 straight rounds of Tekken. To soften the blow of your humiliating defeats, your six-year-old opponent hands you...",
                                '"Hey! Hey you!" A strange man beckons you. When you approach, he shoves something into your hand. "It\'s the key to everything!" he screams as he runs off. You look down at your hand.']
 
-        self.player_draws = {}  # Dictionary for freebie cooldown {player_id: last_drawn_time}
+        # Rate limits, kept by bot.cooldowns (saved state is loaded into them in on_ready)
+        self.freebie_limiter = bot.cooldowns.limiter("freebie", 3600)  # One free card per hour
+        # Chat rewards: up to 3 rewarded messages in a row, refilling one every 20 seconds; messages beyond that earn nothing
+        self.message_limiter = bot.cooldowns.limiter("message_reward", 20, burst=3)
+        self.cooldown_snapshot_interval = 60  # Seconds between saves of changed cooldowns
+        self.trade_timeout = 600  # Seconds a trade offer stays open (its cards are reserved meanwhile)
 
-    def choose_random_card(self, cursor, num=1, series=None):
+    def choose_random_card(self, num=1, series=None):
         # Function to randomly select cards
         # Used for getting freebies and opening packs
         if not series:  # If series not specified, choose one randomly
-            series = choices(self.card_series)[0]
-        # Retrieve all available cards
-        card_info = cursor.execute("SELECT card_id, rarity FROM cards WHERE series = ?;", (series,)).fetchall()
-        card_ids = [r[0] for r in card_info]
-        weights = [self.rarity_weights[series][int(r[1])] for r in card_info]
-        return choices(card_ids, weights=weights, k=num), series
+            series = self.card_series[self.rng.integers(len(self.card_series))]
+        # Draw from the series' precomputed alias table
+        return self.card_samplers[series].sample(num, self.rng), series
+
+    def build_card_samplers(self):
+        # Weight card draws by number of cards in each rarity and the probability of that rarity
+        for series in self.card_series:
+            series_cards = self.catalog.series_cards[series]
+            counter = Counter([card.rarity for card in series_cards])
+            self.rarity_weights[series] = {r: self.rarity[r] / counter[r] for r in counter.keys()}
+            self.card_samplers[series] = AliasSampler([card.card_id for card in series_cards],
+                                                      [self.rarity_weights[series][card.rarity] for card in series_cards])
 
     cards = SlashCommandGroup("cards", "Collect and trade vintage Marvel cards!")
 
@@ -159,145 +148,125 @@ class Game(Cog):
                                                "**/cards inventory**: Check your inventory and card collection\n"
                                                "**/cards open**: Open a card pack\n"
                                                "**/cards search**: Get information on a card\n"
+                                               "**/cards missing**: See the cards you're missing, and who has spares\n"
+                                               "**/cards matches**: Find members to trade with\n"
                                                "**/cards trade**: Trade cards with each other")
         image = discord.File(f"./data/cards/1990-Impel-Marvel-Universe/1990-Impel-Marvel-Universe-Trading-Cards-all.png", filename="card-pack.png")
         embed.set_image(url="attachment://card-pack.png")
         await ctx.respond(embed=embed, file=image, ephemeral=ephemeral)
-        print(f"{datetime.now()}: /cards help called by {ctx.author.display_name}")
 
     @cards.command(description="Find a free card! Available once every hour.", name="freebie")
     async def open_free_card(self, ctx):
         await ctx.defer()
-        # Check if player has drawn a card within the last hour
-        try:
-            date_time = parser.parse(self.player_draws[ctx.author.id])
-            time_elapsed = (datetime.now()-date_time).total_seconds()
-        except KeyError:
-            time_elapsed = 9000  # If player not in dictionary, automatically make larger than 3600 seconds
-        if time_elapsed >= 3600:
-            connection = sqlite3.connect(self.game_database)
-            cursor = connection.cursor()
+        # Check if player has drawn a card within the last hour (this also starts the next hour if they haven't)
+        time_left = self.freebie_limiter.hit(ctx.author.id)
+        if not time_left:
             # Return randomly selected card, where chosen_card, chosen_series are both lists of length 1
-            chosen_card, chosen_series = self.choose_random_card(cursor, num=1)
-            # Retrieve card information
-            (image_path, rarity, series_text) = cursor.execute("SELECT cards.image_path, cards.rarity, sets.prettify FROM cards JOIN sets ON (cards.series = sets.series) WHERE cards.card_id = ? AND sets.series = ?;", (chosen_card[0], chosen_series)).fetchone()
-            # Retrieve number of this card that player owned before drawing
-            (num_cards_player,) = cursor.execute("SELECT COUNT(*) FROM collection WHERE player_id = ? AND card_id = ? AND series = ?", (ctx.author.id, chosen_card[0], chosen_series)).fetchone()
-            # Retrieve number of this card owned by all players in the guild
-            num_cards = 0
-            for member in ctx.guild.members:
-                (count,) = cursor.execute("SELECT COUNT(*) FROM collection WHERE card_id = ? AND series = ? AND player_id = ?;", (chosen_card[0], chosen_series, member.id)).fetchone()
-                num_cards += count
-
-            date_time = datetime.now()  # Used to record into sqlite database and cooldown
-            cursor.execute("INSERT INTO collection (player_id, card_id, series, date_time) "
-                           "VALUES (?, ?, ?, ?);", (ctx.author.id, chosen_card[0], chosen_series, date_time))
-            connection.commit()
-            connection.close()
-
-            embed, image = tools.trading_card_embed_standard(chosen_series, image_path, rarity, num_cards + 1, series_text)
+            chosen_card, chosen_series = self.choose_random_card(num=1)
+            date_time = datetime.now()  # Used to record into sqlite database
+            card = self.catalog.get(chosen_series, chosen_card[0])
+            # Number of this card the player owned before drawing, and number owned by all players in the guild
+            try:
+                async with self.bot.collections.update(ctx.author.id) as collection:
+                    num_cards_player = collection.count(card.key)
+                    counts = await self.bot.db.add_free_card(ctx.author.id, card.card_id, card.series,
+                                                             {member.id for member in ctx.guild.members}, date_time)
+                    collection.add([card.key])
+            except Exception:
+                self.freebie_limiter.reset(ctx.author.id)  # They didn't get the card, so give the freebie back
+                raise
+            self.holdings.add(ctx.author.id, [card.key])
+            num_cards = counts["num_cards"]
+
+            embed, image = tools.trading_card_embed_standard(card, num_cards + 1, self.bot.attachments)
             embed.set_author(name=choices(self.freebie_blurbs)[0])
             if num_cards_player == 0:
                 embed.title = f"🆕 {embed.title}"
             embed.set_footer(text=f"You own {num_cards_player + 1} of this card.")
 
-            # Record drawing time for cooldown
-            self.player_draws[ctx.author.id] = date_time.strftime("%Y-%m-%d %H:%M:%S")
-
-            await ctx.respond(file=image, embed=embed)
+            message = await ctx.respond(embed=embed, **tools.file_kwargs(image))
+            if image:
+                await self.bot.attachments.remember(card.key, message)
         else:  # If last free card was drawn < 1 hour ago
-            time_left = 3600 - time_elapsed
             if time_left < 60:
                 await ctx.respond(f"You search and you search and you find... nothing. Try again in {round(time_left)} seconds.")
             else:
                 await ctx.respond(f"You search and you search and you find... nothing. Try again in {round(time_left/60)} minutes.")
-        print(f"{datetime.now()}: /cards freebie called by {ctx.author.display_name}")
 
-    async def buy_cards(self, connection, cursor, member_id, num_packs=1):
+    async def flush_message_rewards(self):
+        # Write all buffered message rewards in one transaction
+        if self.pending_rewards:
+            rewards, self.pending_rewards = self.pending_rewards, Counter()
+            try:
+                await self.bot.db.credit_many(rewards, "message rewards", self.pack_cost, time())
+            except Exception:
+                self.pending_rewards.update(rewards)  # Keep rewards for the next flush
+                raise
+
+    async def compact_ledger(self):
+        removed = await self.bot.db.compact_ledger(time() - self.ledger_retention)
+        mismatches = await self.bot.db.get_ledger_mismatches()
+        if mismatches:
+            print(f"Balances of {len(mismatches)} players don't match the ledger: {mismatches[:10]}")
+        return removed
+
+    async def get_player(self, member_id):
+        # Returns (points, packs), including message rewards that haven't been flushed yet
+        credit = self.pending_rewards.pop(member_id, 0)
+        try:
+            return await self.bot.db.get_player(member_id, self.pack_cost, time(), credit=credit)
+        except Exception:
+            self.pending_rewards[member_id] += credit
+            raise
+
+    async def buy_cards(self, member_id, num_packs=1):
+        # num_packs None buys as many packs as the player can afford. Returns (embed, image, points, packs).
+        credit = self.pending_rewards.pop(member_id, 0)
         try:
-            (points, packs) = cursor.execute("SELECT points, packs FROM players WHERE player_id = ?;", (member_id,)).fetchone()
-        except TypeError: # Add player if not in database
-            cursor.execute("INSERT INTO players (player_id, points, packs) VALUES (?, ?, ?);", (member_id, self.pack_cost, 0))
-            connection.commit()
-            (points, packs) = cursor.execute("SELECT points, packs FROM players WHERE player_id = ?;", (member_id,)).fetchone()
-        if points >= self.pack_cost*num_packs:
-            points -= self.pack_cost*num_packs
-            cursor.execute("UPDATE players SET points = ?, packs = ? WHERE player_id = ?",
-                           (points, packs + num_packs, member_id))
-            connection.commit()
-            embed = Embed(title="You bought a card pack!" if num_packs == 1 else f"You bought {num_packs} card packs!", description="Hope it's a good one!",
+            bought, points, packs = await self.bot.db.buy_packs(member_id, num_packs, self.pack_cost, self.pack_cost, time(), credit=credit)
+        except Exception:
+            self.pending_rewards[member_id] += credit
+            raise
+        if bought:
+            embed = Embed(title="You bought a card pack!" if bought == 1 else f"You bought {bought} card packs!", description="Hope it's a good one!",
                           colour=discord.Colour.gold())
             image = discord.File(
                 f"./data/cards/1990-Impel-Marvel-Universe/1990-Impel-Marvel-Universe-Trading-Cards-{choices(['blue', 'red', 'yellow'])[0]}.png",
                 filename="card-pack.png")
             embed.add_field(name=f"Remaining Bub Bucks", value=f"{points}{self.bub}")
-            embed.add_field(name="Card Packs in Inventory", value=f"{packs + num_packs}")
+            embed.add_field(name="Card Packs in Inventory", value=f"{packs}")
             embed.set_image(url="attachment://card-pack.png")
-            return embed, image, points
+            return embed, image, points, packs
         else:
-            return None, None, points
+            return None, None, points, packs
 
     @cards.command(description="See your inventory.", name="inventory")
     async def get_inventory(self, ctx):
         await ctx.defer()
-        connection = sqlite3.connect(self.game_database)
-        cursor = connection.cursor()
-        try:
-            (points, packs) = cursor.execute("SELECT points, packs FROM players WHERE player_id = ?;", (ctx.author.id,)).fetchone()
-        except TypeError:  # Add player if not in database
-            cursor.execute("INSERT INTO players (player_id, points, packs) VALUES (?, ?, ?);", (ctx.author.id, self.pack_cost, 0))
-            connection.commit()
-            (points, packs) = cursor.execute("SELECT points, packs FROM players WHERE player_id = ?;", (ctx.author.id,)).fetchone()
-        (num_cards,) = cursor.execute("SELECT COUNT(*) FROM collection WHERE player_id = ?;", (ctx.author.id,)).fetchone()
-        (num_traded,) = cursor.execute("SELECT COUNT(*) FROM collection WHERE player_id = ? AND trade IS NOT NULL;", (ctx.author.id,)).fetchone()
-        rows = cursor.execute("SELECT DISTINCT cards.thumbnail_path, cards.series, cards.rarity, cards.card_id, sets.shorthand FROM cards "
-                              "JOIN collection ON (cards.card_id = collection.card_id AND cards.series = collection.series) "
-                              "JOIN sets ON (cards.series = sets.series) "
-                              "WHERE collection.player_id = ? "
-                              "ORDER BY cards.series, LENGTH(cards.card_id), cards.card_id;", (ctx.author.id,)).fetchall()
-        if len(rows) > 0:
-            card_titles = []
-            page_text = []
-            text = ""
-            num_index = 0
-            dropdown_options = []
-            series = []
-            series_options = []
-            options = []
-            for row in rows:
-                (num_owned,) = cursor.execute("SELECT COUNT(*) FROM collection WHERE player_id = ? AND card_id = ? AND series = ?", (ctx.author.id, row[3], row[1])).fetchone()
-                pattern = rf"{row[1].split('X-Men')[0].replace('-', '_')}X-Men_#(\d+|XH\d+|)_(.+?)_thumbnail.jpg" if "X-Men" in row[1] else rf"{row[1].replace('-', '_')}_#(\d+|MH\d+)_(.+?)_thumbnail.jpg"
-                regex_result = re.search(pattern, row[0])
-                title = f"{row[2]}{self.rarity_symbols[row[2]]} {row[4]}-#{regex_result.group(1)}: {regex_result.group(2).replace('_', ' ')} ({num_owned})"
-                card_titles.append(title)
-                if num_index < 20:
-                    text += f"{title}\n"
-                    options.append(f"{regex_result.group(2).replace('_', ' ')} ({row[4]}-#{regex_result.group(1)})")
-                    series_options.append(row[1])
-                    num_index += 1
-                else:
-                    page_text.append(text)
-                    dropdown_options.append(options)
-                    series.append(series_options)
-                    text = f"{title}\n"
-                    num_index = 0
-                    options = [f"{regex_result.group(2).replace('_', ' ')} (#{regex_result.group(1)}, {row[1].split('-')[0]})"]
-                    series_options = [row[1]]
-            page_text.append(text)
-            dropdown_options.append(options)
-            series.append(series_options)
-
-            all_pages = []
-            for p, page in enumerate(page_text):
+        (points, packs) = await self.get_player(ctx.author.id)
+        collection = await self.bot.collections.get(ctx.author.id)
+        rows = collection.rows()
+        (num_cards, num_traded) = (collection.total, collection.total_traded)
+        cards = [(self.catalog.get(series, card_id), num_owned) for (series, card_id, num_owned, _) in rows
+                 if (series, card_id) in self.catalog]
+        if len(cards) > 0:
+            def build_page(p):
+                # Pages are only built when the user navigates to them
+                page_cards = cards[p*20:(p + 1)*20]  # 20 cards per page
+                page = '\n'.join([f"{card.rarity}{self.rarity_symbols[card.rarity]} {card.code}: {card.name} ({num_owned})"
+                                  for (card, num_owned) in page_cards])
                 embed = Embed(title=f"{ctx.author.display_name}'s Inventory", description="", colour=ctx.author.colour)
                 embed.add_field(name="Bub Bucks", value=f"{points}{self.bub}")
                 embed.add_field(name="Unopened Card Packs", value=f"{packs}")
                 embed.add_field(name="Cards in Collection", value=f"{num_cards}")
-                embed.add_field(name="Unique Cards", value=f"{len(rows)}")
+                embed.add_field(name="Unique Cards", value=f"{len(cards)}")
                 embed.add_field(name="Cards Obtained From Trades", value=f"{num_traded}")
                 embed.add_field(name="Card Collection (Rarity, Set, Name, # Owned)", value=f"{page}", inline=False)
-                all_pages.append(pages.Page(embeds=[embed], custom_view=views.CardsDropdownView(dropdown_options[p], series[p], self.game_database)))
+                return pages.Page(embeds=[embed], custom_view=views.CardsDropdownView([card for (card, _) in page_cards], self.bot.db,
+                                                                                    attachments=self.bot.attachments,
+                                                                                    collections=self.bot.collections))
 
+            all_pages = views.LazyPages(ceil(len(cards)/20), build_page)
             paginator = pages.Paginator(pages=all_pages, disable_on_timeout=True, timeout=600)
             await paginator.respond(ctx.interaction, ephemeral=False)
         else:
@@ -305,34 +274,41 @@ class Game(Cog):
             embed.add_field(name="Bub Bucks", value=f"{points}{self.bub}")
             embed.add_field(name="Unopened Card Packs", value=f"{packs}")
             embed.add_field(name="Cards in Collection", value=f"{num_cards}")
-            embed.add_field(name="Unique Cards", value=f"{len(rows)}")
+            embed.add_field(name="Unique Cards", value=f"{len(cards)}")
             embed.add_field(name="Card Collection (Rarity, Name)", value=f"0 cards")
             await ctx.respond(embed=embed)
-        print(f"{datetime.now()}: /cards inventory called by {ctx.author.display_name}")
 
     @cards.command(description="Open a card pack!", name="open")
     async def open_purchased_pack(self, ctx):
         await ctx.defer()
-        connection = sqlite3.connect(self.game_database)
-        cursor = connection.cursor()
-        packs = cursor.execute("SELECT packs FROM players WHERE player_id = ?;", (ctx.author.id,)).fetchone()
-        if packs:
-            num_packs = packs[0]
-            series_texts = [s for (s,) in cursor.execute("SELECT prettify FROM sets;").fetchall()]
-            if num_packs > 0:
-                embed = Embed(title=f"You have {num_packs} card pack(s).", description="Choose a set to open.", colour=ctx.author.colour)
-                card_series_text = '\n'.join([s for s in series_texts])
-                embed.add_field(name="Available Sets", value=f"{card_series_text}")
-                image = discord.File(f"./data/cards/1990-Impel-Marvel-Universe/1990-Impel-Marvel-Universe-Trading-Cards-all.png", filename="card-pack.png")
-                embed.set_image(url="attachment://card-pack.png")
-                view = views.OpenCardPack(ctx, self.bot, num_packs, self.card_series, series_texts)
-                await ctx.respond(embed=embed, view=view, file=image)
+        num_packs = await self.bot.db.get_packs(ctx.author.id)
+        if num_packs:
+            series_texts = [self.catalog.series_text[series] for series in self.card_series]
+            embed = Embed(title=f"You have {num_packs} card pack(s).", description="Choose a set to open.", colour=ctx.author.colour)
+            card_series_text = '\n'.join([s for s in series_texts])
+            embed.add_field(name="Available Sets", value=f"{card_series_text}")
+            image = discord.File(f"./data/cards/1990-Impel-Marvel-Universe/1990-Impel-Marvel-Universe-Trading-Cards-all.png", filename="card-pack.png")
+            embed.set_image(url="attachment://card-pack.png")
+            view = views.OpenCardPack(ctx, self.bot, num_packs, self.card_series, series_texts)
+            await ctx.respond(embed=embed, view=view, file=image)
         else:
-            (points,) = cursor.execute("SELECT points FROM players WHERE player_id = ?;", (ctx.author.id,)).fetchone()
+            (points, _) = await self.get_player(ctx.author.id)
             await ctx.respond(f"You don't have any card packs; you have enough bub bucks to buy {floor(points/self.pack_cost)}. "
                               f"Type **/cards buy** to purchase one.")
-        connection.close()
-        print(f"{datetime.now()}: /cards open called by {ctx.author.display_name}")
+
+    def render_pack_image(self, series, thumbnail_paths):
+        # Draw a pack preview (up to 3x4 cards) from the series' thumbnail atlas, falling back to the image files
+        with self.bot.metrics.track("render", "pack_image"):
+            thumbnail_atlas = self.thumbnail_atlases.get(series)
+            if thumbnail_atlas and all(path in thumbnail_atlas for path in thumbnail_paths):
+                images = [thumbnail_atlas.get(path) for path in thumbnail_paths]
+            else:
+                images = []
+                for path in thumbnail_paths:
+                    with Image.open(f"./data/cards/{series}/thumbnail/{path}") as image:
+                        images.append(np.asarray(image.convert("RGB")))
+            pixels = atlas.compose_grid(images, background=self.pack_image_background)
+            return atlas.encode_image(pixels, self.pack_image_format, self.pack_image_quality)
 
     async def list_num_packs_to_buy(self, ctx: discord.AutocompleteContext):
         num = ["1", "5", "10", "max"]
@@ -343,95 +319,94 @@ class Game(Cog):
                             number: Option(str, "Number of packs to buy.",
                                            default="1", autocomplete=list_num_packs_to_buy, required=True)):
         await ctx.defer()
-        connection = sqlite3.connect(self.game_database)
-        cursor = connection.cursor()
-        if number == "max":
-            (total_points,) = cursor.execute("SELECT points FROM players WHERE player_id = ?;", (ctx.author.id,)).fetchone()
-            number = floor(total_points/self.pack_cost)
-        embed, image, points = await self.buy_cards(connection, cursor, ctx.author.id, int(number))
-        (num_packs,) = cursor.execute("SELECT packs FROM players WHERE player_id = ?;", (ctx.author.id,)).fetchone()
-        series_text = [s for (s,) in cursor.execute("SELECT prettify FROM sets;").fetchall()]
-        connection.close()
+        embed, image, points, num_packs = await self.buy_cards(ctx.author.id, None if number == "max" else int(number))
+        series_text = [self.catalog.series_text[series] for series in self.card_series]
         if embed:
             view = views.OpenCardPack(ctx, self.bot, num_packs, self.card_series, series_text)
             await ctx.respond(file=image, embed=embed, view=view)
         else:
             await ctx.respond(f"Card packs cost {self.pack_cost}{self.bub} each; you currently have {points}{self.bub}. To earn bub bucks, chat on Discord or post on the site.")
-        print(f"{datetime.now()}: /cards buy called by {ctx.author.display_name}")
 
     async def open_card_pack(self, ctx, series=None):
-        connection = sqlite3.connect(self.game_database)
-        cursor = connection.cursor()
-
-        cards, _ = self.choose_random_card(cursor, num=12, series=series)
-        thumbnail_paths = []
-        image_series = []
-        for card in cards:
-            (thumbnail, series) = cursor.execute("SELECT thumbnail_path, series FROM cards WHERE card_id = ? AND series = ?;", (card, series)).fetchone()
-            thumbnail_paths.append(thumbnail)
-            image_series.append(series)
-
-        merged_image = merge_thumbnail_images([f"./data/cards/{image_series[i]}/thumbnail/{thumbnail_paths[i]}" for i in range(len(thumbnail_paths))])
+        cards, series = self.choose_random_card(num=12, series=series)
+        async with self.bot.collections.update(ctx.author.id) as collection:
+            owned = {card_id: collection.count((series, card_id)) for card_id in cards}  # Before opening
+            if not await self.bot.db.open_packs(ctx.author.id, series, cards, 1, datetime.now()):  # No packs left
+                return None, None, None
+            collection.add([(series, card_id) for card_id in cards])
+        self.holdings.add(ctx.author.id, [(series, card_id) for card_id in cards])
+        opened = [self.catalog.get(series, card_id) for card_id in cards]
 
         embed_open = Embed(title="You opened a card pack! 🎉", description="", colour=discord.Colour.blurple())
-        with BytesIO() as image_binary:
-            merged_image.save(image_binary, 'PNG')
-            image_binary.seek(0)
-            image_open = discord.File(fp=image_binary, filename="card-open.png")
-        embed_open.set_image(url="attachment://card-open.png")
+        image_binary, extension = await asyncio.to_thread(self.render_pack_image, series, [card.thumbnail_path for card in opened])
+        image_open = discord.File(fp=image_binary, filename=f"card-open.{extension}")
+        embed_open.set_image(url=f"attachment://card-open.{extension}")
 
         card_titles = []
-        card_series = []
-        date_time = datetime.now()
-        for n in range(len(thumbnail_paths)):
-            if "X-Men" in image_series[n]:
-                pattern = rf"{image_series[n].split('X-Men')[0].replace('-', '_')}X-Men_#(\d+|XH\d+|)_(.+?)_thumbnail.jpg"
-            else:
-                pattern = rf"{image_series[n].replace('-', '_')}_#(\d+|MH\d+)_(.+?)_thumbnail.jpg"
-            regex_result = re.search(pattern, thumbnail_paths[n])
-            (card_count,) = cursor.execute("SELECT COUNT (*) FROM collection WHERE player_id = ? AND card_id = ? AND series = ?;", (ctx.author.id, cards[n], image_series[n])).fetchone()
-            (set_code,) = cursor.execute("SELECT shorthand FROM sets WHERE series = ?;", (image_series[n],)).fetchone()
-            card_series.append(image_series[n])
-            if card_count > 0:
-                card_titles.append(f"{regex_result.group(2).replace('_', ' ')} ({set_code}-#{regex_result.group(1)})")
+        for card in opened:
+            if owned.get(card.card_id, 0) > 0:
+                card_titles.append(card.label)
             else:
-                card_titles.append(f"🆕 {regex_result.group(2).replace('_', ' ')} ({set_code}-#{regex_result.group(1)})")
-            cursor.execute("INSERT INTO collection (player_id, card_id, series, date_time) "
-                           "VALUES (?, ?, ?, ?);", (ctx.author.id, cards[n], image_series[n], date_time))
-
-        (packs,) = cursor.execute("SELECT packs FROM players WHERE player_id = ?;", (ctx.author.id,)).fetchone()
-        cursor.execute("UPDATE players SET packs = ? WHERE player_id = ?;", (packs - 1, ctx.author.id))
-        connection.commit()
-        connection.close()
+                card_titles.append(f"🆕 {card.label}")
+            owned[card.card_id] = owned.get(card.card_id, 0) + 1
 
         set_card_titles = []
-        set_card_series = []
+        set_cards = []
         embed_open.add_field(name=f"Cards Gained", value=f"{', '.join(card_titles)}")
         for i in range(len(card_titles)):
             if card_titles[i] not in set_card_titles:
                 set_card_titles.append(card_titles[i])
-                set_card_series.append(card_series[i])
-        view_dropdown = views.CardsDropdownView(set_card_titles, set_card_series, self.game_database)
+                set_cards.append(opened[i])
+        view_dropdown = views.CardsDropdownView(set_cards, self.bot.db, labels=set_card_titles, attachments=self.bot.attachments,
+                                                collections=self.bot.collections)
+        return image_open, embed_open, view_dropdown
+
+    async def open_card_packs(self, ctx, series, num_packs):
+        # Open several packs of one series at once: one bulk draw, one transaction, and one summary with one image
+        cards, series = self.choose_random_card(num=12*num_packs, series=series)
+        async with self.bot.collections.update(ctx.author.id) as collection:
+            owned = {card_id: collection.count((series, card_id)) for card_id in set(cards)}  # Before opening
+            if not await self.bot.db.open_packs(ctx.author.id, series, cards, num_packs, datetime.now()):  # Not enough packs left
+                return None, None, None
+            collection.add([(series, card_id) for card_id in cards])
+        self.holdings.add(ctx.author.id, [(series, card_id) for card_id in cards])
+
+        drawn = Counter(cards)
+        unique_cards = sorted([self.catalog.get(series, card_id) for card_id in drawn.keys()],
+                              key=lambda card: (-card.rarity, len(card.card_id), card.card_id))
+        new_cards = [card for card in unique_cards if owned.get(card.card_id, 0) == 0]
+        new_ids = {card.card_id for card in new_cards}
+        rarities = Counter([self.catalog.get(series, card_id).rarity for card_id in cards])
+
+        embed_open = Embed(title=f"You opened {num_packs} card packs! 🎉", description="", colour=discord.Colour.blurple())
+        embed_open.add_field(name="Cards Gained", value=f"{len(cards)}")
+        embed_open.add_field(name="New Cards", value=f"{len(new_cards)}")
+        embed_open.add_field(name="Duplicates", value=f"{len(cards) - len(new_cards)}")
+        embed_open.add_field(name="Rarity Breakdown",
+                             value='\n'.join([f"{RARITY_TEXT[r]}: {rarities[r]}" for r in sorted(rarities.keys(), reverse=True)]),
+                             inline=False)
+        if new_cards:
+            new_text = ', '.join([f"🆕 {card.label}" for card in new_cards])
+            if len(new_text) > 1024:  # Embed field limit
+                new_text = new_text[:new_text.rindex(', ', 0, 1000)] + ", ..."
+            embed_open.add_field(name="New Cards (rarest first)", value=new_text, inline=False)
+
+        # Show the rarest new cards first, then the rarest duplicates
+        highlights = (new_cards + [card for card in unique_cards if card.card_id not in new_ids])[:12]
+        image_binary, extension = await asyncio.to_thread(self.render_pack_image, series, [card.thumbnail_path for card in highlights])
+        image_open = discord.File(fp=image_binary, filename=f"card-open.{extension}")
+        embed_open.set_image(url=f"attachment://card-open.{extension}")
+
+        labels = [f"🆕 {card.label}" if card.card_id in new_ids else card.label for card in highlights]
+        view_dropdown = views.CardsDropdownView(highlights, self.bot.db, labels=labels, attachments=self.bot.attachments,
+                                                collections=self.bot.collections)
         return image_open, embed_open, view_dropdown
 
     async def list_all_cards(self, ctx: discord.AutocompleteContext):
-        connection = sqlite3.connect(self.game_database)
-        cursor = connection.cursor()
-        pattern = rf"_#(\d+|MH\d+|XH\d+)_(.+?).(png|gif)"
-        (series,) = cursor.execute("SELECT series FROM sets WHERE prettify = ?;", (ctx.options['series'],)).fetchone()
-        cards = []
-        for (image_path,) in cursor.execute("SELECT image_path FROM cards WHERE series = ? ORDER BY LENGTH(card_id), card_id;", (series,)).fetchall():
-            regex_result = re.search(pattern, image_path)
-            cards.append(f"#{regex_result.group(1)}: {regex_result.group(2).replace('_', ' ')}")
-        connection.close()
-        return [c for c in cards if ctx.value.lower() in c.lower()]
+        return self.card_index.search_cards(ctx.options['series'], ctx.value)
 
     async def get_all_series(self, ctx: discord.AutocompleteContext):
-        connection = sqlite3.connect(self.game_database)
-        cursor = connection.cursor()
-        series = [s for (s,) in cursor.execute("SELECT prettify FROM sets;").fetchall()]
-        connection.close()
-        return [s for s in sorted(series) if ctx.value.lower() in s.lower()]
+        return self.card_index.search_series_text(ctx.value)
 
     @cards.command(description="Look up a card.", name="search")
     async def search_cards(self, ctx,
@@ -439,155 +414,231 @@ class Game(Cog):
                            card: Option(str, "Card name.", required=True, autocomplete=list_all_cards)):
         await ctx.defer()
         card_id = re.search(rf"#(\d+|MH\d+|XH\d+):", card).group(1)
-        connection = sqlite3.connect(self.game_database)
-        cursor = connection.cursor()
-        (series,) = cursor.execute("SELECT series FROM sets WHERE prettify = ?;", (series,)).fetchone()
-        result = cursor.execute("SELECT image_path, series, rarity FROM cards WHERE card_id = ? AND series = ?;", (card_id, series)).fetchall()
-        (series_text,) = cursor.execute("SELECT prettify FROM sets WHERE series = ?;", (series,)).fetchone()
+        card = self.catalog.get(self.catalog.series_from_text(series), card_id)
         # Retrieve number of this card owned by all players in the guild
-        num_cards = 0
-        owned_by = []
-        for member in ctx.guild.members:
-            (count,) = cursor.execute("SELECT COUNT(*) FROM collection WHERE card_id = ? AND series = ? AND player_id = ?;", (card_id, series, member.id)).fetchone()
-            if count > 0:
-                num_cards += count
-                owned_by.append(member.id)
-        connection.close()
-        embed, image = tools.trading_card_embed_standard(result[0][1], result[0][0], result[0][2], num_cards, series_text)
+        counts = await self.bot.db.get_card_counts(card.card_id, card.series, member_ids={member.id for member in ctx.guild.members})
+        owned_by = counts["owned_by"]
+        embed, image = tools.trading_card_embed_standard(card, counts["num_cards"], self.bot.attachments)
         if len(owned_by) > 0:
-            counter = Counter(owned_by)
-            value = '\n'.join([f"<@{p}> ({counter[p]})" for p in counter.keys()])
+            value = '\n'.join([f"<@{p}> ({owned_by[p]})" for p in owned_by.keys()])
             embed.add_field(name="Owned by", value=f"{value}")
         else:
             embed.add_field(name="Owned by", value="No one")
-        await ctx.respond(file=image, embed=embed)
-        print(f"{datetime.now()}: /cards search called by {ctx.author.display_name}")
-
-    def setup_trade(self, cursor, card_id_list, member_id, series):
-        counter = Counter(card_id_list)
-        counter_all = {}
-        rowids = []
-        cards_dict = {}
-        for card in card_id_list:
-            rows = cursor.execute("SELECT cards.card_id, cards.image_path, collection.rowid FROM cards "
-                                  "JOIN collection ON (cards.card_id = collection.card_id AND cards.series = collection.series) "
-                                  "WHERE collection.player_id = ? AND collection.card_id = ? AND collection.series = ?;", (member_id, card, series)).fetchall()
-            counter_all[card] = len(rows)
-            num = 0
-            for row in rows:
-                if num < counter[card]:
-                    cards_dict[row[0]] = row[1]
-                    rowids.append(row[2])
-                    num += 1
-                else:
-                    break
-        card_names = []
-        if len(rowids) > 0:
-            pattern = rf"_#(\d+|MH\d+|XH\d+)_(.+?).(png|gif)"
-            for card_id in cards_dict.keys():
-                regex_result = re.search(pattern, cards_dict[card_id])
-                card_names.append(
-                    f"Card #{regex_result.group(1)}: {regex_result.group(2).replace('_', ' ')} ({counter_all[card_id]} owned)")
-            return [card_names, rowids]
-        else:
-            return None
-
-    async def get_all_series(self, ctx: discord.AutocompleteContext):
-        connection = sqlite3.connect(self.game_database)
-        cursor = connection.cursor()
-        series = [s for (s,) in cursor.execute("SELECT DISTINCT series FROM cards;").fetchall()]
-        connection.close()
-        return [s for s in sorted(series) if ctx.value.lower() in s.lower()]
+        message = await ctx.respond(embed=embed, **tools.file_kwargs(image))
+        if image:
+            await self.bot.attachments.remember(card.key, message)
+
+    @cards.command(description="See the cards you're missing, and who has spares of them.", name="missing")
+    async def show_missing_cards(self, ctx,
+                                 series: Option(str, "Trading card series (default: all).", required=False, default=None,
+                                                autocomplete=get_all_series)):
+        await ctx.defer()
+        series_name = self.catalog.find_series(series) if series else None
+        if series and not series_name:
+            await ctx.respond(f"Couldn't find the series {series}.")
+            return
+        member_ids = [member.id for member in ctx.guild.members if not member.bot]
+        missing = self.holdings.missing(ctx.author.id, member_ids, series_name)
+        # Cards someone can give first
+        missing = [entry for entry in missing if entry[1]] + [entry for entry in missing if not entry[1]]
+        num_available = sum([1 for (_, holders) in missing if holders])
+        title = f"{ctx.author.display_name} is missing {len(missing)} cards" + (f" from {self.catalog.series_text[series_name]}" if series_name else "")
+        if not missing:
+            await ctx.respond(embed=Embed(title=title, description="You have every card!", colour=ctx.author.colour))
+            return
+
+        def build_page(p):
+            lines = []
+            for (card, holders) in missing[p*20:(p + 1)*20]:  # 20 cards per page
+                spares = ', '.join([f"<@{member_id}> ({num})" for (member_id, num) in holders]) or "no spares"
+                lines.append(f"{card.rarity}{self.rarity_symbols[card.rarity]} {card.code}: {card.name} — {spares}")
+            embed = Embed(title=title, description='\n'.join(lines), colour=ctx.author.colour)
+            embed.set_footer(text=f"Other members have spares of {num_available} of these (number of spares in brackets).")
+            return pages.Page(embeds=[embed])
+
+        paginator = pages.Paginator(pages=views.LazyPages(ceil(len(missing)/20), build_page), disable_on_timeout=True, timeout=600)
+        await paginator.respond(ctx.interaction, ephemeral=False)
+
+    @cards.command(description="Find members to trade with: their spares for your missing cards, and yours for theirs.",
+                   name="matches")
+    async def show_trade_matches(self, ctx,
+                                 series: Option(str, "Trading card series (default: all).", required=False, default=None,
+                                                autocomplete=get_all_series)):
+        await ctx.defer()
+        series_name = self.catalog.find_series(series) if series else None
+        if series and not series_name:
+            await ctx.respond(f"Couldn't find the series {series}.")
+            return
+        names = {member.id: member.display_name for member in ctx.guild.members if not member.bot}
+        matches = self.holdings.matches(ctx.author.id, names.keys(), series_name)
+        await ctx.respond(embed=self.trade_matches_embed(ctx.author.display_name, ctx.author.colour, names, matches))
+
+    @staticmethod
+    def trade_matches_embed(player_name, colour, names, matches):
+        # Discord rejects embeds longer than 6000 characters in total (or with a field value over 1024), so each
+        # card list is cut short and partners that don't fit are left out, best matches first
+        embed = Embed(title=f"Trade matches for {player_name}",
+                      description="" if matches else "No one has spares of your missing cards, or is missing your spares.",
+                      colour=colour)
+        if not matches:
+            return embed
+
+        def card_list(cards, limit=480):
+            text = ', '.join([card.code for card in cards]) or "nothing"
+            return text if len(text) <= limit else text[:text.rindex(', ', 0, limit - 5)] + ", ..."
+
+        footer = "Ranked by the number of one-for-one swaps possible. Propose one with /cards trade."
+        more = " {} more matches not shown."
+        budget = 6000 - len(embed.title) - len(footer) - len(more) - 2
+        shown = 0
+        for (member_id, they_give, you_give) in matches:
+            name = f"{names[member_id]}: {len(they_give)} for you, {len(you_give)} for them"
+            value = f"They have spares of: {card_list(they_give)}\nYou have spares of: {card_list(you_give)}"
+            if len(name) + len(value) > budget:
+                break
+            budget -= len(name) + len(value)
+            embed.add_field(name=name, value=value, inline=False)
+            shown += 1
+        if shown < len(matches):
+            footer += more.format(len(matches) - shown)
+        embed.set_footer(text=footer)
+        return embed
+
+    def parse_trade_cards(self, text, default_series):
+        # Parses a comma-separated card list such as "1, 100, MH4, XM-#12" into {(series, card_id): quantity}.
+        # Cards may carry their set code (e.g. XM-12) to mix series in one offer; others are from default_series.
+        # Returns (offer, unrecognised entries)
+        offer = Counter()
+        unknown = []
+        default_series = self.catalog.find_series(default_series) if default_series else None
+        for entry in text.split(','):
+            match = TRADE_CARD_PATTERN.match(entry.strip())
+            series = None
+            if match:
+                series = self.catalog.find_series(match.group(1)) if match.group(1) else default_series
+            if series and (series, match.group(2).upper()) in self.catalog:
+                offer[(series, match.group(2).upper())] += 1
+            elif entry.strip():
+                unknown.append(entry.strip())
+        return offer, unknown
+
+    def describe_offer(self, owner_id, offer, owned):
+        # One line per card in the offer, with how many of it the owner has available to trade
+        lines = []
+        for (series, card_id), quantity in offer.items():
+            card = self.catalog.get(series, card_id)
+            lines.append(f"{card.title} [{card.shorthand}]{f' x{quantity}' if quantity > 1 else ''} "
+                         f"({owned.get((owner_id, series, card_id), 0)} owned)")
+        return '\n'.join(lines)
+
+    async def get_all_card_series(self, ctx: discord.AutocompleteContext):
+        return self.card_index.search_series(ctx.value)
 
     @cards.command(description="Trade cards with another member!", name="trade")
     async def trade_cards(self, ctx,
                           member: Option(discord.Member, "Member to trade with.", required=True),
                           your_cards: Option(str, "The cards you will trade. Enter card numbers, comma-separated, e.g. '1, 100, MH4'.", required=True),
-                          your_series: Option(str, "The series your cards are from.", required=True, autocomplete=get_all_series),
                           member_cards: Option(str, "The cards you will receive. Enter card numbers, comma-separated, e.g. '4, MH2, 39'.", required=True),
-                          member_series: Option(str, "The series the member's cards are from.", required=True, autocomplete=get_all_series)):
+                          your_series: Option(str, "The series your cards are from, unless given with a set code (e.g. 'XM-12').", required=False, default=None, autocomplete=get_all_card_series),
+                          member_series: Option(str, "The series the member's cards are from, unless given with a set code.", required=False, default=None, autocomplete=get_all_card_series)):
         if ctx.author == member:
             await ctx.respond("You can't trade with yourself.")
         elif member.bot:
             await ctx.respond("Bots can't trade cards.")
         else:
-            # Parse arguments and turn into lists
-            cards_give = [c.replace("#", "").strip() for c in your_cards.split(',')]
-            cards_take = [c.replace("#", "").strip() for c in member_cards.split(',')]
-
-            connection = sqlite3.connect(self.game_database)
-            cursor = connection.cursor()
-
-            parameters_give = self.setup_trade(cursor, cards_give, ctx.author.id, your_series)
-            parameters_take = self.setup_trade(cursor, cards_take, member.id, member_series)
-
-            if parameters_give and parameters_take:
-                cards_give_string = '\n'.join(parameters_give[0])
-                cards_take_string = '\n'.join(parameters_take[0])
-                embed = Embed(title=f"{ctx.author.display_name} wants to trade!", description="", colour=ctx.author.colour)
-                embed.add_field(name=f"{ctx.author.display_name} will trade...", value=f"{cards_give_string}")
-                embed.add_field(name=f"... for {member.display_name}'s...", value=f"{cards_take_string}")
-                view = views.CardsTradeView(ctx, allowed=member)
-                await ctx.respond(f"{member.mention}, do you accept the trade?", embed=embed, view=view)
-                await view.wait()
-                if view.value:
-                    for rowid in parameters_take[1]:
-                        cursor.execute("UPDATE collection SET player_id = ?, trade = ? WHERE rowid = ?;", (ctx.author.id, member.id, rowid))
-                    for rowid in parameters_give[1]:
-                        cursor.execute("UPDATE collection SET player_id = ?, trade = ? WHERE rowid = ?;", (member.id, ctx.author.id, rowid))
-                    connection.commit()
+            offer_give, unknown_give = self.parse_trade_cards(your_cards, your_series)
+            offer_take, unknown_take = self.parse_trade_cards(member_cards, member_series)
+            if unknown_give or unknown_take or not offer_give or not offer_take:
+                unknown = ', '.join(unknown_give + unknown_take) or f"{your_cards} and {member_cards}"
+                await ctx.respond(f"Sorry, I don't recognise the listed cards: **{unknown}**. Please check the card numbers and series, and try again.")
             else:
-                await ctx.respond(f"Sorry, I don't recognise the listed cards: **{your_cards}** and **{member_cards}**. Please check the card numbers and try again.")
-            connection.close()
-        print(f"{datetime.now()}: /cards trade called by {ctx.author.display_name}")
+                # Check both sides and reserve the cards; nothing is held open while waiting for an answer
+                now = time()
+                trade_id, owned = await self.bot.db.reserve_trade(ctx.author.id, member.id, offer_give, offer_take,
+                                                                  now, now + self.trade_timeout + 60)
+                if trade_id is None:
+                    await ctx.respond(f"Sorry, that trade isn't possible. Here's what's available for trading:\n"
+                                      f"**{ctx.author.display_name}**:\n{self.describe_offer(ctx.author.id, offer_give, owned)}\n"
+                                      f"**{member.display_name}**:\n{self.describe_offer(member.id, offer_take, owned)}")
+                else:
+                    embed = Embed(title=f"{ctx.author.display_name} wants to trade!", description="", colour=ctx.author.colour)
+                    embed.add_field(name=f"{ctx.author.display_name} will trade...", value=self.describe_offer(ctx.author.id, offer_give, owned))
+                    embed.add_field(name=f"... for {member.display_name}'s...", value=self.describe_offer(member.id, offer_take, owned))
+                    view = views.CardsTradeView(ctx, allowed=member, timeout=self.trade_timeout)
+                    await ctx.respond(f"{member.mention}, do you accept the trade?", embed=embed, view=view)
+                    await view.wait()
+                    if view.value:
+                        async with self.bot.collections.locked(ctx.author.id, member.id):
+                            moves = await self.bot.db.accept_trade(trade_id, time())
+                            if moves is not None:
+                                self.bot.collections.move(moves)
+                                self.holdings.move(moves)
+                        if moves is None:
+                            await ctx.respond("The trade couldn't be completed because some of the cards have changed hands.")
+                    else:  # Cancelled or timed out; release the reserved cards
+                        await self.bot.db.cancel_trade(trade_id, "cancelled" if view.value is False else "expired")
 
     @Cog.listener()
     async def on_message(self, message):
-        if not message.author.bot:
-            connection = sqlite3.connect(self.game_database)
-            cursor = connection.cursor()
-            try:
-                (current_points,) = cursor.execute("SELECT points FROM players WHERE player_id = ?;", (message.author.id,)).fetchone()
-            except TypeError:  # Add player if not in database
-                cursor.execute("INSERT INTO players (player_id, points, packs) VALUES (?, ?, ?);", (message.author.id, self.pack_cost, 0))
-                connection.commit()
-                (current_points,) = cursor.execute("SELECT points FROM players WHERE player_id = ?;", (message.author.id,)).fetchone()
-            cursor.execute("UPDATE players SET points = ? WHERE player_id = ?;", (current_points+self.message_reward, message.author.id))
-            connection.commit()
-            connection.close()
+        if not message.author.bot and not self.message_limiter.hit(message.author.id):
+            # Rewards are buffered in memory and written in batches by flush_message_rewards
+            self.pending_rewards[message.author.id] += self.message_reward
+            if len(self.pending_rewards) >= self.reward_flush_size and not self.reward_flush_task:
+                self.reward_flush_task = asyncio.create_task(self.flush_message_rewards())
+                self.reward_flush_task.add_done_callback(lambda task: setattr(self, "reward_flush_task", None))
 
     @Cog.listener()
     async def on_member_join(self, member):
-        if not member.bot:
-            connection = sqlite3.connect(self.game_database)
-            cursor = connection.cursor()
-            member_is_registered = cursor.execute("SELECT * FROM players WHERE player_id = ?;", (member.id,)).fetchone()
-            if not member_is_registered:  # If member is new, add them to database
-                cursor.execute("INSERT INTO players (player_id, points, packs) VALUES (?, ?, ?);", (member.id, 500, 0))
-            connection.commit()
-            connection.close()
+        if not member.bot:  # If member is new, add them to database
+            await self.bot.db.register_player(member.id, 500, time())
+
+    @Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        # Card images uploaded with a deleted message are deleted with it
+        await self.bot.attachments.evict_message(payload.message_id)
+
+    @Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload):
+        for message_id in payload.message_ids:
+            await self.bot.attachments.evict_message(message_id)
 
     @Cog.listener()
     async def on_ready(self):
         if not self.bot.ready:
             self.game_database = self.bot.game_database
 
-            # Create database and populate with cards if it doesn't already exist
-            connection = sqlite3.connect(self.game_database)
-            cursor = connection.cursor()
-            try:  # Add additional series if they don't exist
-                series = [s for (s,) in cursor.execute("SELECT DISTINCT series FROM cards;").fetchall()]
-                for s in range(len(self.card_series)):
-                    if self.card_series[s] not in series:
-                        add_cards_to_db(cursor, [self.card_series[s]], [self.card_directories[s]], [self.thumbnail_directories[s]])
-                        connection.commit()
-                    # Weight card draws by number of cards in each rarity and the probability of that rarity
-                    rarity = [int(r) for (r,) in cursor.execute("SELECT rarity FROM cards WHERE series = ?;", (self.card_series[s],)).fetchall()]
-                    counter = Counter(rarity)
-                    self.rarity_weights[self.card_series[s]] = {r: self.rarity[r] / counter[r] for r in self.rarity.keys()}
-                connection.close()
-            except sqlite3.OperationalError:
-                print("No database found!")
+            # Create database (or apply pending migrations) and populate with cards and sets
+            await self.bot.db.migrate()
+            await self.bot.attachments.load()
+            await self.bot.cooldowns.load()
+            await self.bot.db.add_sets([(series, info["prettify"], info["shorthand"]) for series, info in self.available_sets.items()])
+            # Add new or changed cards from the image directories
+            rows, _ = await CatalogSync(self.bot.db).sync(self.card_series)
+            if rows:
+                print(f"Added or updated {len(rows)} cards in the database.")
+            self.catalog = CardCatalog(await self.bot.db.get_sets(), await self.bot.db.get_cards())
+            self.card_index = CardIndex(self.catalog)
+            self.bot.metrics.add_summary("card_search_seconds", "Time taken by card and series autocomplete searches.",
+                                         lambda: self.card_index.latency())
+            self.holdings = HoldingsIndex(self.catalog, await self.bot.db.get_all_holdings())
+            print(f"Loaded {len(self.catalog)} cards into the catalog.")
+            num_derived = self.catalog.use_derivatives(derivatives.load_manifest(), self.card_image_variants)
+            print(f"Using image derivatives for {num_derived} of {len(self.catalog)} cards.")
+            self.build_card_samplers()
+
+            for s in range(len(self.card_series)):
+                try:
+                    # Loading may fall back to building the atlas (decoding every thumbnail), so keep it off the event loop
+                    self.thumbnail_atlases[self.card_series[s]] = await asyncio.to_thread(atlas.ThumbnailAtlas.load, self.card_series[s],
+                                                                                          self.thumbnail_directories[s])
+                except OSError as e:
+                    print(f"Thumbnail atlas unavailable for {self.card_series[s]}: {e}")
+
+            self.bot.scheduler.add_job(self.flush_message_rewards, "interval", seconds=self.reward_flush_interval)
+            self.bot.shutdown_hooks.append(self.flush_message_rewards)
+            self.bot.scheduler.add_job(self.compact_ledger, "interval", seconds=self.ledger_compact_interval)
+            self.bot.scheduler.add_job(self.bot.cooldowns.snapshot, "interval", seconds=self.cooldown_snapshot_interval)
+            self.bot.shutdown_hooks.append(self.bot.cooldowns.snapshot)
 
             self.bot.cogs_ready.ready_up('game')
 
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The bot runs from the repository root and imports utils/ modules by name
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "utils"))
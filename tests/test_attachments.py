@@ -0,0 +1,75 @@
+import asyncio
+from types import SimpleNamespace
+
+from attachments import AttachmentCache, MemoryAttachmentStore
+from catalog import CardCatalog
+import views
+
+
+SERIES = "1990-Impel-Marvel-Universe"
+KEY = (SERIES, "1")
+
+
+def upload(message_id, name="card.png"):
+    # A sent message carrying one uploaded file
+    return SimpleNamespace(id=message_id, embeds=[], attachments=[
+        SimpleNamespace(url=f"https://cdn.discordapp.com/attachments/1/{message_id}/{name}?ex=7fffffff&is=0")])
+
+
+def test_deleted_message_evicts_its_urls():
+    async def run():
+        store = MemoryAttachmentStore()
+        cache = AttachmentCache(store)
+        await cache.remember(KEY, upload(100))
+        await cache.remember((SERIES, "2"), upload(100, "other.png"))
+        await cache.remember((SERIES, "3"), upload(200))
+        assert cache.get(KEY).startswith("https://cdn.discordapp.com/attachments/1/100/")
+        assert store.urls[KEY][2] == 100
+
+        assert await cache.evict_message(100) == 2
+        assert cache.get(KEY) is None and cache.get((SERIES, "2")) is None
+        assert set(store.urls) == {(SERIES, "3")}
+        assert await cache.evict_message(100) == 0
+
+        # A reload only sees what is left in the store
+        reloaded = AttachmentCache(store)
+        await reloaded.load()
+        assert reloaded.get((SERIES, "3")) is not None and reloaded.get(KEY) is None
+
+        await cache.invalidate((SERIES, "3"))
+        assert cache.get((SERIES, "3")) is None and store.urls == {}
+    asyncio.run(run())
+
+
+class FakeDatabase(object):
+    async def get_card_counts(self, card_id, series, member_ids=None, player_id=None):
+        return {"num_cards": 1, "num_player": 1}
+
+
+def test_dropdown_doesnt_reuse_the_url_of_a_file_it_replaced(tmp_path):
+    # Picking the same card twice in a dropdown: the second edit drops the file the first one uploaded, so the
+    # card has to be uploaded again rather than linked to the deleted file
+    async def run():
+        image = tmp_path / "card.png"
+        image.write_bytes(b"png")
+        catalog = CardCatalog([(SERIES, "Marvel Universe (1990)", "MU")],
+                              [("1", SERIES, "1990_Impel_Marvel_Universe_#1_Card_1.png", None, 1)])
+        card = catalog.get(SERIES, "1")
+        card.upload_path = str(image)
+        cache = AttachmentCache(MemoryAttachmentStore())
+        dropdown = views.CardsDropdown([card], FakeDatabase(), attachments=cache)
+        dropdown._selected_values = ["0"]
+
+        edits = []
+        async def edit_message(**kwargs):
+            edits.append(kwargs)
+        async def original_response():
+            return upload(300)
+        interaction = SimpleNamespace(user=SimpleNamespace(id=1, display_name="Player"), message=SimpleNamespace(id=300),
+                                      response=SimpleNamespace(edit_message=edit_message), original_response=original_response)
+
+        await dropdown.callback(interaction)
+        await dropdown.callback(interaction)
+        assert ["file" in edit for edit in edits] == [True, True]
+        assert cache.get(card.key) is not None  # The second upload's URL
+    asyncio.run(run())
@@ -0,0 +1,60 @@
+import numpy as np
+
+from catalog import CardCatalog
+import lib.cogs.game as game
+from sampler import AliasSampler
+
+
+SERIES = "1990-Impel-Marvel-Universe"
+RARITY = {1: 0.70, 2: 0.2, 3: 0.08, 4: 0.012, 5: 0.008}
+# Card number -> rarity: three commons, two uncommons, and one card of each other rarity
+RARITIES = {"1": 1, "2": 1, "3": 1, "4": 2, "5": 2, "6": 3, "7": 4, "MH1": 5}
+
+
+class FakeGame(object):
+    # build_card_samplers only needs the catalog, the series and the rarity probabilities
+    build_card_samplers = game.Game.build_card_samplers
+
+    def __init__(self):
+        cards = [(card_id, SERIES, f"1990_Impel_Marvel_Universe_#{card_id}_Card.png", None, rarity)
+                 for card_id, rarity in RARITIES.items()]
+        self.catalog = CardCatalog([(SERIES, "Marvel Universe (1990)", "MU")], cards)
+        self.card_series = [SERIES]
+        self.rarity = RARITY
+        self.rarity_weights = {}
+        self.card_samplers = {}
+
+
+def expected_probabilities(sampler):
+    # Each card's rarity probability shared equally among the cards of that rarity, in the sampler's item order
+    counts = {rarity: list(RARITIES.values()).count(rarity) for rarity in RARITY}
+    weights = np.array([RARITY[RARITIES[card_id]] / counts[RARITIES[card_id]] for card_id in sampler.items])
+    return weights / weights.sum()
+
+
+def test_probabilities_match_rarity_weights():
+    fake = FakeGame()
+    fake.build_card_samplers()
+    sampler = fake.card_samplers[SERIES]
+    assert sorted(sampler.items.tolist()) == sorted(RARITIES)
+    np.testing.assert_allclose(sampler.probabilities(), expected_probabilities(sampler), rtol=0, atol=1e-12)
+
+
+def test_probabilities_of_uneven_weights():
+    sampler = AliasSampler(["a", "b", "c", "d"], [1, 2, 3, 10])
+    np.testing.assert_allclose(sampler.probabilities(), np.array([1, 2, 3, 10]) / 16, rtol=0, atol=1e-12)
+
+
+def test_seeded_draws_are_reproducible_and_follow_the_weights():
+    fake = FakeGame()
+    fake.build_card_samplers()
+    sampler = fake.card_samplers[SERIES]
+    first = sampler.sample_indices(200_000, np.random.default_rng(42))
+    second = sampler.sample_indices(200_000, np.random.default_rng(42))
+    np.testing.assert_array_equal(first, second)
+
+    frequencies = np.bincount(first, minlength=len(sampler)) / len(first)
+    expected = expected_probabilities(sampler)
+    # Within 5 standard errors of each card's probability
+    tolerance = 5*np.sqrt(expected*(1 - expected)/len(first))
+    assert np.all(np.abs(frequencies - expected) <= tolerance), (frequencies, expected)
@@ -0,0 +1,54 @@
+from collections import Counter
+
+import discord
+
+from catalog import CardCatalog
+import lib.cogs.game as game
+
+
+SETS = [("1990-Impel-Marvel-Universe", "Marvel Universe (1990)", "MU"),
+        ("1991-Impel-Marvel-Universe-II", "Marvel Universe II (1991)", "MU2"),
+        ("1992-Impel-X-Men", "X-Men (1992)", "XM")]
+
+
+class FakeGame(object):
+    # parse_trade_cards only needs the catalog
+    parse_trade_cards = game.Game.parse_trade_cards
+
+    def __init__(self):
+        cards = [(card_id, series, f"{series.replace('-', '_')}_#{card_id}_Card_{card_id}.png", None, 1)
+                 for (series, _, _) in SETS for card_id in ["1", "3", "12", "MH1"]]
+        self.catalog = CardCatalog(SETS, cards)
+
+
+def test_trade_by_set_code():
+    offer, unknown = FakeGame().parse_trade_cards("MU2-12, MU2-#3, mu2-12, XM-#1, MU-MH1", None)
+    assert offer == Counter({("1991-Impel-Marvel-Universe-II", "12"): 2, ("1991-Impel-Marvel-Universe-II", "3"): 1,
+                             ("1992-Impel-X-Men", "1"): 1, ("1990-Impel-Marvel-Universe", "MH1"): 1})
+    assert unknown == []
+
+
+def test_trade_default_series_and_unknown_entries():
+    offer, unknown = FakeGame().parse_trade_cards("12, #MH1, MU3-1, 99, zz", "Marvel Universe II (1991)")
+    assert offer == Counter({("1991-Impel-Marvel-Universe-II", "12"): 1, ("1991-Impel-Marvel-Universe-II", "MH1"): 1})
+    assert unknown == ["MU3-1", "99", "zz"]
+
+
+def test_trade_matches_embed_fits_discord_limits():
+    # Ten partners, each with spares of hundreds of the player's missing cards and missing hundreds of theirs
+    cards = [(str(n), "1991-Impel-Marvel-Universe-II", f"1991_Impel_Marvel_Universe_II_#{n}_Card_{n}.png", None, 1)
+             for n in range(1, 400)]
+    catalog = CardCatalog(SETS, cards)
+    series_cards = catalog.series_cards["1991-Impel-Marvel-Universe-II"]
+    names = {member_id: f"A member with a very long name {member_id}"[:32] for member_id in range(10)}
+    matches = [(member_id, series_cards[:200], series_cards[200:]) for member_id in names]
+    embed = game.Game.trade_matches_embed("A player with a very long name", discord.Colour.blue(), names, matches)
+    assert len(embed) <= 6000
+    assert all(len(field.value) <= 1024 and len(field.name) <= 256 for field in embed.fields)
+    assert 0 < len(embed.fields) < len(matches)
+    assert embed.footer.text.endswith(f"{len(matches) - len(embed.fields)} more matches not shown.")
+
+
+def test_trade_matches_embed_without_matches():
+    embed = game.Game.trade_matches_embed("player", discord.Colour.blue(), {}, [])
+    assert not embed.fields and embed.description
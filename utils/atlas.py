@@ -0,0 +1,103 @@
+from glob import glob
+from io import BytesIO
+import json
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+
+ATLAS_DIRECTORY = "./data/atlas"
+IMAGE_FORMATS = {"JPEG": "jpg", "WEBP": "webp", "PNG": "png"}
+
+
+def atlas_paths(series, atlas_directory=ATLAS_DIRECTORY):
+    # Returns (pixel data path, index path) for a series
+    return f"{atlas_directory}/{series}.atlas", f"{atlas_directory}/{series}.atlas.json"
+
+
+def build_atlas(series, thumbnail_directory, atlas_directory=ATLAS_DIRECTORY):
+    # Decode every thumbnail of a series once and store the pixels back-to-back in a single uint8 file.
+    # The index maps each thumbnail file name to [offset, height, width] within that file.
+    os.makedirs(atlas_directory, exist_ok=True)
+    data_path, index_path = atlas_paths(series, atlas_directory)
+    index = {}
+    offset = 0
+    with open(data_path, "wb") as f:
+        for path in sorted(glob(f"{thumbnail_directory}/*")):
+            with Image.open(path) as image:
+                pixels = np.asarray(image.convert("RGB"), dtype=np.uint8)
+            f.write(pixels.tobytes())
+            index[os.path.basename(path)] = [offset, pixels.shape[0], pixels.shape[1]]
+            offset += pixels.size
+    with open(index_path, "w") as f:
+        json.dump(index, f)
+    print(f"Built thumbnail atlas for {series} ({len(index)} thumbnails, {offset/1e6:.1f} MB).")
+
+
+class ThumbnailAtlas(object):
+    # Read-only, memory-mapped view of one series' thumbnail atlas
+    def __init__(self, series, atlas_directory=ATLAS_DIRECTORY):
+        data_path, index_path = atlas_paths(series, atlas_directory)
+        with open(index_path) as f:
+            self.index = {name: tuple(entry) for name, entry in json.load(f).items()}
+        self.data = np.memmap(data_path, dtype=np.uint8, mode="r")
+
+    @classmethod
+    def load(cls, series, thumbnail_directory, atlas_directory=ATLAS_DIRECTORY):
+        # Load the atlas, (re)building it first if it is missing or older than the thumbnail directory
+        data_path, index_path = atlas_paths(series, atlas_directory)
+        if not (os.path.exists(data_path) and os.path.exists(index_path)) or \
+                os.path.getmtime(index_path) < os.path.getmtime(thumbnail_directory):
+            build_atlas(series, thumbnail_directory, atlas_directory)
+        return cls(series, atlas_directory)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def get(self, name):
+        # Returns a (height, width, 3) view into the memory-mapped atlas; no copy or decode
+        offset, height, width = self.index[name]
+        return self.data[offset:offset + height*width*3].reshape(height, width, 3)
+
+
+def compose_grid(images, rows=3, columns=4, background=(0, 0, 0)):
+    # Lay images out on a fixed rows x columns grid (unused cells are left as background). Each column is as wide
+    # as its widest image and each row as tall as its tallest, so the canvas is allocated once and every image
+    # is a single slice assignment.
+    assert 0 < len(images) <= rows*columns, f"must have 1 to {rows*columns} images: {len(images)}"
+    heights = np.zeros(rows*columns, dtype=np.int64)
+    widths = np.zeros(rows*columns, dtype=np.int64)
+    heights[:len(images)] = [image.shape[0] for image in images]
+    widths[:len(images)] = [image.shape[1] for image in images]
+    heights, widths = heights.reshape(rows, columns), widths.reshape(rows, columns)
+    row_offsets = np.concatenate(([0], np.cumsum(heights.max(axis=1))))
+    column_offsets = np.concatenate(([0], np.cumsum(widths.max(axis=0))))
+
+    canvas = np.empty((row_offsets[-1], column_offsets[-1], 3), dtype=np.uint8)
+    canvas[:] = background
+    for n, image in enumerate(images):
+        i, j = divmod(n, columns)
+        y, x = row_offsets[i], column_offsets[j]
+        canvas[y:y + image.shape[0], x:x + image.shape[1]] = image
+    return canvas
+
+
+def encode_image(pixels, image_format="JPEG", quality=85):
+    # Encode an RGB array; returns (BytesIO positioned at 0, file extension)
+    image_format = image_format.upper()
+    image_binary = BytesIO()
+    if image_format == "PNG":
+        Image.fromarray(pixels).save(image_binary, image_format, compress_level=1)
+    else:
+        Image.fromarray(pixels).save(image_binary, image_format, quality=quality)
+    image_binary.seek(0)
+    return image_binary, IMAGE_FORMATS[image_format]
+
+
+if __name__ == "__main__":
+    # Build atlases for all card series: python utils/atlas.py [series ...]
+    all_series = sys.argv[1:] or sorted(os.path.basename(path) for path in glob("./data/cards/*") if os.path.isdir(path))
+    for s in all_series:
+        build_atlas(s, f"./data/cards/{s}/thumbnail")
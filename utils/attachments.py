@@ -0,0 +1,111 @@
+import time
+from urllib.parse import urlparse, parse_qs
+
+
+def attachment_url(message):
+    # The CDN URL Discord gave an uploaded card image, from the sent message's embed or attachments
+    for embed in getattr(message, "embeds", None) or []:
+        url = getattr(embed.image, "url", None)
+        if isinstance(url, str) and url.startswith("http"):
+            return url
+    attachments = getattr(message, "attachments", None) or []
+    return attachments[0].url if attachments else None
+
+
+def url_expiry(url):
+    # Signed Discord CDN URLs carry their expiry time as a hex timestamp in the 'ex' parameter
+    try:
+        return int(parse_qs(urlparse(url).query)["ex"][0], 16)
+    except (KeyError, IndexError, ValueError):
+        return None
+
+
+class MemoryAttachmentStore(object):
+    # Keeps URLs in a dict; stands in for the database store in tests and local runs
+    def __init__(self):
+        self.urls = {}
+
+    async def load(self):
+        return dict(self.urls)
+
+    async def save(self, key, url, expires, message_id):
+        self.urls[key] = (url, expires, message_id)
+
+    async def delete(self, key):
+        self.urls.pop(key, None)
+
+
+class DatabaseAttachmentStore(object):
+    # Persists URLs in the game database's 'attachments' table
+    def __init__(self, database):
+        self.database = database
+
+    async def load(self):
+        return {(series, card_id): (url, expires, message_id)
+                for (series, card_id, url, expires, message_id) in await self.database.get_attachments()}
+
+    async def save(self, key, url, expires, message_id):
+        await self.database.save_attachment(key[0], key[1], url, expires, message_id)
+
+    async def delete(self, key):
+        await self.database.delete_attachment(key[0], key[1])
+
+
+class AttachmentCache(object):
+    # Card key -> URL of an image Discord already hosts, so a card is uploaded once and later embeds link to it.
+    # Entries expire at the URL's own expiry (less a safety margin) or after ttl seconds, whichever is sooner;
+    # an expired entry is dropped and the caller falls back to uploading the file again.
+    # Discord deletes a file along with its message, or when an edit replaces the message's files, and doesn't
+    # report an embed image it can't fetch; so each entry keeps the id of the message the file was uploaded with,
+    # and evict_message drops a message's entries when it is deleted or its file is about to be replaced.
+    def __init__(self, store, ttl=20*3600, margin=3600, clock=time.time):
+        self.store = store
+        self.ttl = ttl
+        self.margin = margin
+        self.clock = clock
+        self.urls = {}  # {key: (url, expires, message_id)}
+        self.hits = 0
+        self.misses = 0
+
+    async def load(self):
+        now = self.clock()
+        self.urls = {key: entry for key, entry in (await self.store.load()).items() if entry[1] > now}
+
+    def get(self, key):
+        entry = self.urls.get(key)
+        if entry and entry[1] > self.clock():
+            self.hits += 1
+            return entry[0]
+        if entry:  # Stale; the next upload will replace it
+            del self.urls[key]
+        self.misses += 1
+        return None
+
+    async def put(self, key, url, message_id=None):
+        now = self.clock()
+        expires = now + self.ttl
+        signed_expiry = url_expiry(url)
+        if signed_expiry:
+            expires = min(expires, signed_expiry - self.margin)
+        if expires > now:
+            self.urls[key] = (url, expires, message_id)
+            await self.store.save(key, url, expires, message_id)
+        return url
+
+    async def remember(self, key, message):
+        # Record the URL of an image just uploaded with message; returns it, or None if there wasn't one
+        url = attachment_url(message)
+        if url:
+            await self.put(key, url, message.id)
+        return url
+
+    async def invalidate(self, key):
+        self.urls.pop(key, None)
+        await self.store.delete(key)
+
+    async def evict_message(self, message_id):
+        # Drop the URLs of files uploaded with message_id; returns how many were dropped
+        keys = [key for key, (_, _, entry_message_id) in self.urls.items() if entry_message_id == message_id]
+        for key in keys:
+            await self.invalidate(key)
+        return len(keys)
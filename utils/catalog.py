@@ -0,0 +1,109 @@
+import re
+import discord
+
+import derivatives
+
+
+# Card number and name, e.g. "1990_Impel_Marvel_Universe_#MH1_Spider-Man.gif" -> ("MH1", "Spider-Man")
+CARD_PATTERN = re.compile(r"_#(\d+|MH\d+|XH\d+)_(.+?)(?:_thumbnail)?\.(?:png|gif|jpg)$")
+
+RARITY_TEXT = {1: "🔹 (Common)", 2: "🔹🔹 (Uncommon)", 3: "🔹🔹🔹 (Rare)", 4: "🔸🔸🔸🔸 (Epic)", 5: "♦️♦️♦️♦️♦️ (Legendary!)"}
+
+
+def card_sort_key(card_id):
+    # Same order as "ORDER BY LENGTH(card_id), card_id"
+    return len(card_id), card_id
+
+
+class Card(object):
+    # Everything needed to display a card, computed once when the catalog is loaded
+    __slots__ = ("series", "card_id", "name", "rarity", "shorthand", "series_text", "image_path", "thumbnail_path",
+                 "image_type", "source_path", "upload_path", "upload_type", "code", "title", "label", "rarity_text", "colour")
+
+    def __init__(self, series, card_id, name, rarity, shorthand, series_text, image_path, thumbnail_path):
+        self.series = series
+        self.card_id = card_id
+        self.name = name
+        self.rarity = rarity
+        self.shorthand = shorthand
+        self.series_text = series_text
+        self.image_path = image_path
+        self.thumbnail_path = thumbnail_path
+        self.image_type = "gif" if image_path.endswith(".gif") else "png"
+        # File sent when the card is shown: the original merged image unless a smaller derivative is in use
+        self.source_path = f"./data/cards/{series}/merged/{image_path}"
+        self.upload_path = self.source_path
+        self.upload_type = self.image_type
+
+        # Prebuilt display strings and embed fields
+        self.code = f"{shorthand}-#{card_id}"  # e.g. MU-#12
+        self.title = f"Card #{card_id}: {name}"
+        self.label = f"{name} ({self.code})"
+        self.rarity_text = RARITY_TEXT[rarity]
+        if rarity <= 3:
+            self.colour = discord.Colour.blue()
+        elif rarity == 4:
+            self.colour = discord.Colour.orange()
+        else:
+            self.colour = discord.Colour.red()
+
+    @property
+    def key(self):
+        return self.series, self.card_id
+
+    def __repr__(self):
+        return f"<Card {self.series} #{self.card_id} {self.name}>"
+
+
+class CardCatalog(object):
+    # All cards and sets, loaded once from the 'cards' and 'sets' tables
+    __slots__ = ("cards", "series_cards", "series_text", "series_by_text", "shorthand", "series_by_shorthand")
+
+    def __init__(self, sets, cards):
+        # sets: [(series, prettify, shorthand)]
+        # cards: [(card_id, series, image_path, thumbnail_path, rarity)]
+        self.cards = {}  # {(series, card_id): Card}
+        self.series_cards = {}  # {series: [Card]} ordered by card number
+        self.series_text = {series: prettify for (series, prettify, _) in sets}
+        self.series_by_text = {prettify: series for (series, prettify, _) in sets}
+        self.shorthand = {series: shorthand for (series, _, shorthand) in sets}
+        self.series_by_shorthand = {shorthand.upper(): series for (series, _, shorthand) in sets}
+
+        for (card_id, series, image_path, thumbnail_path, rarity) in cards:
+            if series not in self.series_text:
+                continue
+            name = CARD_PATTERN.search(image_path).group(2).replace('_', ' ')
+            card = Card(series, card_id, name, int(rarity), self.shorthand[series], self.series_text[series],
+                        image_path, thumbnail_path)
+            self.cards[card.key] = card
+            self.series_cards.setdefault(series, []).append(card)
+        for series_cards in self.series_cards.values():
+            series_cards.sort(key=lambda c: card_sort_key(c.card_id))
+
+    def __len__(self):
+        return len(self.cards)
+
+    def __contains__(self, key):
+        return key in self.cards
+
+    def get(self, series, card_id):
+        return self.cards.get((series, card_id))
+
+    def series_from_text(self, series_text):
+        return self.series_by_text.get(series_text)
+
+    def find_series(self, name):
+        # Series from a series name ("1992-Impel-X-Men"), set name ("X-Men (1992)") or set code ("XM")
+        if name in self.series_cards or name in self.series_text:
+            return name
+        return self.series_by_text.get(name) or self.series_by_shorthand.get(name.upper())
+
+    def use_derivatives(self, manifest, variants):
+        # Send each card as its smallest image among the listed derivative variants (built by derivatives.py),
+        # keeping the original where there is none; returns the number of cards using a derivative
+        num_derived = 0
+        for card in self.cards.values():
+            card.upload_path = derivatives.best_variant(manifest.get(f"{card.series}/{card.image_path}"), card.source_path, variants)
+            card.upload_type = card.upload_path.rsplit(".", 1)[-1]
+            num_derived += card.upload_path != card.source_path
+        return num_derived
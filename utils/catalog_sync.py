@@ -0,0 +1,95 @@
+import asyncio
+import os
+
+from catalog import CARD_PATTERN
+
+
+CARD_DIRECTORY = "./data/cards"
+IMAGE_KINDS = ("merged", "thumbnail")
+
+
+def scan_directory(directory):
+    # Returns {file name: [size, mtime]} for the image files in a directory
+    files = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and CARD_PATTERN.search(entry.name):
+                stat = entry.stat()
+                files[entry.name] = [stat.st_size, stat.st_mtime]
+    return files
+
+
+def pair_cards(merged, thumbnails):
+    # Pair merged and thumbnail images by card number. Returns ({card_id: (merged name, thumbnail name)}, problems)
+    by_id = {kind: {} for kind in IMAGE_KINDS}
+    problems = []
+    for kind, names in zip(IMAGE_KINDS, (merged, thumbnails)):
+        for name in sorted(names):
+            card_id = CARD_PATTERN.search(name).group(1)
+            if card_id in by_id[kind]:
+                problems.append(f"#{card_id} has more than one {kind} image ({by_id[kind][card_id]}, {name})")
+            else:
+                by_id[kind][card_id] = name
+    pairs = {}
+    for card_id in sorted(set(by_id["merged"]) | set(by_id["thumbnail"])):
+        merged_name, thumbnail_name = by_id["merged"].get(card_id), by_id["thumbnail"].get(card_id)
+        if merged_name and thumbnail_name:
+            pairs[card_id] = (merged_name, thumbnail_name)
+        else:
+            problems.append(f"#{card_id} has a {'merged' if merged_name else 'thumbnail'} image "
+                            f"({merged_name or thumbnail_name}) but no {'thumbnail' if merged_name else 'merged'} image")
+    return pairs, problems
+
+
+class CatalogSync(object):
+    # Keeps the 'cards' table in step with the image directories (data/cards/<series>/{merged,thumbnail}).
+    # A manifest, stored in the database next to the cards it describes, records each directory's mtime and its
+    # files' sizes and mtimes. On startup a directory whose mtime hasn't changed is skipped after a single stat;
+    # otherwise it is rescanned and only cards whose files were added or changed are upserted, in the same
+    # transaction that saves the new manifest. Editing a file in place doesn't change its directory's mtime,
+    # so use force=True after doing that.
+    def __init__(self, database, card_directory=CARD_DIRECTORY):
+        self.database = database
+        self.card_directory = card_directory
+
+    def diff(self, all_series, manifest, force=False):
+        # manifest: {series: {kind: {"mtime": directory mtime, "files": {file name: [size, mtime]}}}}
+        # Returns (rows to upsert [(card_id, series, image_path, thumbnail_path)], {series: new manifest} for the
+        # series that changed, problems {series: [str]})
+        rows = []
+        problems = {}
+        changed = {}
+        for series in all_series:
+            old = manifest.get(series, {})
+            current = {}
+            for kind in IMAGE_KINDS:
+                directory = f"{self.card_directory}/{series}/{kind}"
+                mtime = os.stat(directory).st_mtime
+                if not force and old.get(kind, {}).get("mtime") == mtime:
+                    current[kind] = old[kind]
+                else:
+                    current[kind] = {"mtime": mtime, "files": scan_directory(directory)}
+            if not force and current == old:
+                continue
+
+            pairs, series_problems = pair_cards(current["merged"]["files"], current["thumbnail"]["files"])
+            old_files = {kind: old.get(kind, {}).get("files", {}) for kind in IMAGE_KINDS}
+            for card_id, names in pairs.items():
+                if force or any(old_files[kind].get(name) != current[kind]["files"][name] for kind, name in zip(IMAGE_KINDS, names)):
+                    rows.append((card_id, series, names[0], names[1]))
+            if series_problems:
+                problems[series] = series_problems
+            changed[series] = current
+        return rows, changed, problems
+
+    async def sync(self, all_series, force=False):
+        # Upsert added or changed cards and record the new manifest in one transaction. Returns (rows upserted, problems).
+        manifest = await self.database.get_catalog_manifest()
+        # diff stats every image directory and rescans the changed ones, so keep it off the event loop
+        rows, changed, problems = await asyncio.to_thread(self.diff, all_series, manifest, force)
+        if changed:
+            await self.database.sync_cards(rows, changed)
+        for series, series_problems in problems.items():
+            for problem in series_problems:
+                print(f"Card images in {series}: {problem}")
+        return rows, problems
@@ -0,0 +1,175 @@
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import sys
+import weakref
+
+
+# Rough memory cost of a cached collection and of each unique card in it, in bytes (a dict slot, a key tuple
+# and its counts; series and card_id strings are interned, so they are shared between players)
+COLLECTION_BYTES = 400
+CARD_BYTES = 200
+
+
+class PlayerCollection(object):
+    # Summary of one player's cards: how many of each they own, and how many of those came from trades
+    __slots__ = ("counts", "traded", "total", "total_traded")
+
+    def __init__(self, rows=()):
+        # rows: [(series, card_id, num_owned, num_traded)], as returned by Database.get_inventory
+        self.counts = {}  # {(series, card_id): num_owned}
+        self.traded = {}  # {(series, card_id): num_traded}, only for cards with traded copies
+        self.total = 0
+        self.total_traded = 0
+        for (series, card_id, num_owned, num_traded) in rows:
+            key = (sys.intern(series), sys.intern(card_id))
+            self.counts[key] = num_owned
+            self.total += num_owned
+            if num_traded:
+                self.traded[key] = num_traded
+                self.total_traded += num_traded
+
+    def count(self, key):
+        return self.counts.get(key, 0)
+
+    def add(self, keys, traded=False):
+        # keys: [(series, card_id)], one per copy gained
+        for key in keys:
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.total += 1
+            if traded:
+                self.traded[key] = self.traded.get(key, 0) + 1
+                self.total_traded += 1
+
+    def remove(self, key, quantity=1, traded=0):
+        # Lose quantity copies of a card, traded of which had come from trades
+        num_owned = self.counts.get(key, 0) - quantity
+        if num_owned > 0:
+            self.counts[key] = num_owned
+        else:
+            self.counts.pop(key, None)
+        self.total -= quantity
+        if traded:
+            num_traded = self.traded.get(key, 0) - traded
+            if num_traded > 0:
+                self.traded[key] = num_traded
+            else:
+                self.traded.pop(key, None)
+            self.total_traded -= traded
+
+    def rows(self):
+        # [(series, card_id, num_owned, num_traded)] in inventory order, like Database.get_inventory
+        return [(series, card_id, num_owned, self.traded.get((series, card_id), 0))
+                for (series, card_id), num_owned in sorted(self.counts.items(), key=lambda item: (item[0][0], len(item[0][1]), item[0][1]))]
+
+    def size(self):
+        return COLLECTION_BYTES + CARD_BYTES*len(self.counts)
+
+
+class CollectionCache(object):
+    # Least-recently-used cache of players' collection summaries, shared by the inventory, freebies, pack opening,
+    # trades and the card dropdowns. A player's summary is loaded from the database on first use and then kept
+    # up to date in place by whoever writes their cards ("write-through"), so those paths read counts from memory.
+    # Collections are evicted, least recently used first, once their approximate size passes max_bytes.
+    #
+    # Loads and writes for the same player are serialised with a per-player lock, so a load can't cache a
+    # collection that misses (or double counts) a write in flight: writers hold locked() (or update()) across
+    # the database write and the in-place update. Reading a cached collection takes no lock.
+    def __init__(self, database, max_bytes=16*2**20):
+        self.database = database
+        self.max_bytes = max_bytes
+        self.collections = OrderedDict()  # {player_id: PlayerCollection}, least recently used first
+        self.sizes = {}  # {player_id: approximate bytes}
+        self.bytes = 0
+        self.locks = weakref.WeakValueDictionary()  # {player_id: asyncio.Lock}, kept while in use
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @asynccontextmanager
+    async def locked(self, *player_ids):
+        # Locks are always taken in player_id order, so two trades between the same players can't deadlock
+        locks = []
+        for player_id in sorted(set(player_ids)):
+            lock = self.locks.get(player_id)
+            if lock is None:
+                lock = self.locks[player_id] = asyncio.Lock()
+            locks.append(lock)
+        for n, lock in enumerate(locks):
+            try:
+                await lock.acquire()
+            except BaseException:
+                for held in locks[:n]:
+                    held.release()
+                raise
+        try:
+            yield
+        finally:
+            for lock in locks:
+                lock.release()
+
+    async def load(self, player_id):
+        # The cached collection, or load it; the caller must hold the player's lock
+        collection = self.collections.get(player_id)
+        if collection is not None:
+            self.hits += 1
+            self.collections.move_to_end(player_id)
+            return collection
+        self.misses += 1
+        collection = PlayerCollection(await self.database.get_inventory(player_id))
+        self.collections[player_id] = collection
+        self.resize(player_id)
+        return collection
+
+    async def get(self, player_id):
+        collection = self.collections.get(player_id)
+        if collection is not None:
+            self.hits += 1
+            self.collections.move_to_end(player_id)
+            return collection
+        async with self.locked(player_id):
+            return await self.load(player_id)
+
+    @asynccontextmanager
+    async def update(self, player_id):
+        # Lock the player and yield their collection, to read counts before a write and update it in place after
+        async with self.locked(player_id):
+            yield await self.load(player_id)
+            if player_id in self.collections:
+                self.resize(player_id)
+
+    def move(self, moves):
+        # Apply cards that changed hands to the collections that are cached (the others load fresh next time).
+        # moves: [(from_id, to_id, series, card_id, quantity, traded)], e.g. from Database.accept_trade
+        for (from_id, to_id, series, card_id, quantity, traded) in moves:
+            key = (sys.intern(series), sys.intern(card_id))
+            if from_id in self.collections:
+                self.collections[from_id].remove(key, quantity, traded)
+            if to_id in self.collections:
+                self.collections[to_id].add([key]*quantity, traded=True)
+        for player_id in {player_id for move in moves for player_id in move[:2]}:
+            if player_id in self.collections:
+                self.resize(player_id)
+
+    def invalidate(self, player_id):
+        if self.collections.pop(player_id, None) is not None:
+            self.bytes -= self.sizes.pop(player_id)
+
+    def resize(self, player_id):
+        # Account for a collection's new size, then evict least recently used collections (never the newest) to fit
+        size = self.collections[player_id].size()
+        self.bytes += size - self.sizes.get(player_id, 0)
+        self.sizes[player_id] = size
+        while self.bytes > self.max_bytes and len(self.collections) > 1:
+            (evicted, _) = self.collections.popitem(last=False)
+            self.bytes -= self.sizes.pop(evicted)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"players": len(self.collections), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "hit_rate": self.hits/lookups if lookups else 0.0,
+                "evictions": self.evictions}
+
+    def __len__(self):
+        return len(self.collections)
@@ -0,0 +1,99 @@
+import time
+
+
+class RateLimiter(object):
+    # Token bucket per key, stored as a single float: the bucket's "theoretical arrival time" (GCRA).
+    # A key may act whenever its stored time is no more than (burst - 1) periods ahead of now; each action pushes it
+    # one period further. A key whose stored time has passed is indistinguishable from a new one, so it is dropped.
+    # With burst=1 this is a plain cooldown of one action per period.
+    __slots__ = ("name", "period", "burst", "tolerance", "clock", "until", "dirty")
+
+    def __init__(self, name, period, burst=1, clock=time.monotonic):
+        self.name = name
+        self.period = period  # Seconds for one token to refill
+        self.burst = burst  # Bucket size
+        self.tolerance = period*(burst - 1)
+        self.clock = clock
+        self.until = {}  # {key: monotonic time the bucket is full again}
+        self.dirty = set()  # Keys changed since the last snapshot
+
+    def retry_after(self, key):
+        # Seconds until key may act again (0 if it may act now)
+        return max(0, self.until.get(key, 0) - self.tolerance - self.clock())
+
+    def hit(self, key):
+        # Use one token; returns 0 if key may act (and records it), otherwise the seconds until it may act
+        now = self.clock()
+        until = max(self.until.get(key, now), now)
+        if until - now > self.tolerance:
+            return until - self.tolerance - now
+        self.until[key] = until + self.period
+        self.dirty.add(key)
+        return 0
+
+    def reset(self, key):
+        if self.until.pop(key, None) is not None:
+            self.dirty.add(key)
+
+    def prune(self):
+        # Drop expired keys, so memory is bounded by the number of keys active within the last burst*period seconds
+        now = self.clock()
+        expired = [key for key, until in self.until.items() if until <= now]
+        for key in expired:
+            del self.until[key]
+        return len(expired)
+
+    def __len__(self):
+        return len(self.until)
+
+
+class Cooldowns(object):
+    # Registry of named rate limiters, snapshotted to the 'cooldowns' table so they survive restarts.
+    # Limiters keep monotonic times; the database keeps wall-clock (unix) times, converted on save and load.
+    def __init__(self, database, clock=time.monotonic, wall_clock=time.time):
+        self.database = database
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.limiters = {}  # {name: RateLimiter}
+        self.loaded = {}  # {name: {key: unix time}} read at startup, for limiters registered later
+
+    def limiter(self, name, period, burst=1):
+        # Returns the named limiter, creating it (with any saved state) on first use
+        if name not in self.limiters:
+            limiter = RateLimiter(name, period, burst, clock=self.clock)
+            offset = self.clock() - self.wall_clock()
+            limiter.until = {key: until + offset for key, until in self.loaded.pop(name, {}).items()}
+            limiter.prune()
+            self.limiters[name] = limiter
+        return self.limiters[name]
+
+    async def load(self):
+        self.loaded = {}
+        for (name, key, until) in await self.database.get_cooldowns(self.wall_clock()):
+            self.loaded.setdefault(name, {})[key] = until
+        for name, limiter in self.limiters.items():  # Limiters registered before loading
+            offset = self.clock() - self.wall_clock()
+            limiter.until.update({key: until + offset for key, until in self.loaded.pop(name, {}).items()})
+
+    async def snapshot(self):
+        # Write keys changed since the last snapshot in one transaction, and forget expired ones.
+        # If the write fails, the keys stay dirty for the next snapshot.
+        offset = self.wall_clock() - self.clock()
+        rows, reset = [], []
+        saving = {}  # {name: keys being written}
+        for name, limiter in self.limiters.items():
+            saving[name], limiter.dirty = limiter.dirty, set()
+            for key in saving[name]:
+                if key in limiter.until:
+                    rows.append((name, key, limiter.until[key] + offset))
+                else:
+                    reset.append((name, key))
+        try:
+            await self.database.save_cooldowns(rows, reset, self.wall_clock())
+        except Exception:
+            for name, keys in saving.items():
+                self.limiters[name].dirty |= keys
+            raise
+        for limiter in self.limiters.values():
+            limiter.prune()
+        return len(rows) + len(reset)
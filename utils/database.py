@@ -0,0 +1,462 @@
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from datetime import datetime
+import json
+from queue import Queue, Empty
+from threading import Lock
+import sqlite3
+from time import perf_counter
+
+import metrics
+import schema
+
+
+class Database(object):
+    # Shared data-access layer for the game database, owned by the Bot.
+    # Keeps a small pool of long-lived connections and runs every query on a worker thread so the event loop
+    # (and the gateway heartbeat) never blocks on SQLite. Each connection keeps its own prepared statement cache,
+    # so the constant SQL strings used below are compiled once per connection and then reused.
+    # Give it an SqlTracer (see sqltrace.py) to trace every statement the connections run.
+    def __init__(self, path, pool_size=4, cached_statements=128, timeout=30, tracer=None):
+        self.path = path
+        self.pool_size = pool_size
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self.tracer = tracer
+
+        self.pool = Queue()  # Idle connections
+        self.num_connections = 0
+        self.lock = Lock()
+        # One worker per connection, so a worker never has to wait for a free connection
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="database")
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                                     cached_statements=self.cached_statements)
+        for pragma in schema.CONNECTION_PRAGMAS:
+            connection.execute(pragma)
+        if self.tracer is not None:
+            self.tracer.attach(connection)
+        return connection
+
+    def acquire(self):
+        # Reuse an idle connection, or open a new one until the pool is full
+        try:
+            return self.pool.get_nowait()
+        except Empty:
+            with self.lock:
+                if self.num_connections < self.pool_size:
+                    self.num_connections += 1
+                    return self.connect()
+            return self.pool.get()
+
+    def release(self, connection):
+        self.pool.put(connection)
+
+    def run_sync(self, func, *args):
+        # Run func(cursor, *args) in a single transaction: commit on success, roll back on error
+        connection = self.acquire()
+        try:
+            with connection:
+                return func(connection.cursor(), *args)
+        finally:
+            if self.tracer is not None:
+                self.tracer.finish(connection)
+            self.release(connection)
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        start = perf_counter()
+        try:
+            if self.tracer is not None:
+                # Run in a copy of this task's context, so the tracer can attribute statements to the current invocation
+                return await loop.run_in_executor(self.executor, contextvars.copy_context().run, self.run_sync, func, *args)
+            return await loop.run_in_executor(self.executor, self.run_sync, func, *args)
+        finally:
+            metrics.record_db_call(perf_counter() - start)
+
+    async def fetchone(self, sql, parameters=()):
+        return await self.run(lambda cursor: cursor.execute(sql, parameters).fetchone())
+
+    async def fetchall(self, sql, parameters=()):
+        return await self.run(lambda cursor: cursor.execute(sql, parameters).fetchall())
+
+    async def execute(self, sql, parameters=()):
+        return await self.run(lambda cursor: cursor.execute(sql, parameters).rowcount)
+
+    async def executemany(self, sql, parameters):
+        return await self.run(lambda cursor: cursor.executemany(sql, parameters).rowcount)
+
+    async def migrate(self):
+        # Create the tables if needed and apply any pending schema migrations
+        if sqlite3.sqlite_version_info < schema.MIN_SQLITE_VERSION:
+            raise RuntimeError(f"SQLite {sqlite3.sqlite_version} is too old for the game database; it needs "
+                               f"{'.'.join(map(str, schema.MIN_SQLITE_VERSION))} or later (UPDATE ... FROM and RETURNING)")
+        applied = await self.run(schema.migrate)
+        if applied:
+            print(f"Applied database migrations {applied} (schema version {schema.SCHEMA_VERSION}).")
+        return applied
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        while True:
+            try:
+                connection = self.pool.get_nowait()
+            except Empty:
+                break
+            if self.tracer is not None:
+                self.tracer.detach(connection)
+            connection.close()
+        self.num_connections = 0
+
+    # ---- Players and economy ----
+
+    # Every change to a player's points or packs is appended to the ledger and applied to their balance in the
+    # same transaction, so the balances in 'players' always equal the sums of their ledger entries.
+    # A ledger entry is written by one INSERT ... SELECT that checks the player's balance and works out the
+    # amounts from the row as it is once the write lock is held, and adds nothing if the change isn't allowed:
+    # concurrent interactions can't overdraw a balance or lose each other's updates.
+
+    # Applies the ledger entry just added (by rowid) to its player; returns their new (points, packs)
+    APPLY_ENTRY = "UPDATE players SET points = players.points + ledger.points, packs = players.packs + ledger.packs " \
+                  "FROM ledger WHERE ledger.entry_id = ? AND players.player_id = ledger.player_id RETURNING points, packs;"
+
+    @staticmethod
+    def _register_players(cursor, player_ids, starting_points, now):
+        # The starting points are recorded in the ledger as well, for players not registered yet
+        cursor.executemany("INSERT INTO ledger (player_id, points, packs, reason, created) SELECT ?, ?, 0, 'starting points', ? "
+                           "WHERE NOT EXISTS (SELECT 1 FROM players WHERE player_id = ?);",
+                           [(player_id, starting_points, now, player_id) for player_id in player_ids])
+        cursor.executemany("INSERT OR IGNORE INTO players (player_id, points, packs) VALUES (?, ?, 0);",
+                           [(player_id, starting_points) for player_id in player_ids])
+
+    @classmethod
+    def _post(cls, cursor, sql, parameters):
+        # Append a ledger entry with sql (adding no row if the change isn't allowed) and apply it.
+        # Returns the player's (points, packs) afterwards, or None if nothing was posted.
+        cursor.execute(sql, parameters)
+        if cursor.rowcount == 0:
+            return None
+        return cursor.execute(cls.APPLY_ENTRY, (cursor.lastrowid,)).fetchone()
+
+    @classmethod
+    def _credit(cls, cursor, player_id, amount, reason, now):
+        return cls._post(cursor, "INSERT INTO ledger (player_id, points, packs, reason, created) "
+                                 "SELECT player_id, ?, 0, ?, ? FROM players WHERE player_id = ?;",
+                         (amount, reason, now, player_id))
+
+    @classmethod
+    def _consume_packs(cls, cursor, player_id, num_packs, now):
+        # Only if the player has at least num_packs packs
+        return cls._post(cursor, "INSERT INTO ledger (player_id, points, packs, reason, created) "
+                                 "SELECT player_id, 0, -?, 'opened packs', ? FROM players WHERE player_id = ? AND packs >= ?;",
+                         (num_packs, now, player_id, num_packs))
+
+    @classmethod
+    def _get_player(cls, cursor, player_id, starting_points, now, credit=0):
+        for attempt in range(2):
+            if credit:  # Apply rewards that haven't been flushed yet
+                balance = cls._credit(cursor, player_id, credit, "message rewards", now)
+            else:
+                balance = cursor.execute("SELECT points, packs FROM players WHERE player_id = ?;", (player_id,)).fetchone()
+            if balance is not None or attempt:
+                return balance
+            cls._register_players(cursor, [player_id], starting_points, now)  # Add player if not in database
+
+    async def get_player(self, player_id, starting_points, now, credit=0):
+        # Returns (points, packs), registering the player first if needed.
+        # credit is added to the player's points in the same transaction.
+        return await self.run(self._get_player, player_id, starting_points, now, credit)
+
+    async def register_player(self, player_id, starting_points, now):
+        return await self.run(self._register_players, [player_id], starting_points, now)
+
+    async def get_packs(self, player_id):
+        row = await self.fetchone("SELECT packs FROM players WHERE player_id = ?;", (player_id,))
+        return row[0] if row else None
+
+    @classmethod
+    def _credit_many(cls, cursor, credits, reason, starting_points, now):
+        cls._register_players(cursor, credits.keys(), starting_points, now)
+        cursor.executemany("INSERT INTO ledger (player_id, points, packs, reason, created) VALUES (?, ?, 0, ?, ?);",
+                           [(player_id, amount, reason, now) for player_id, amount in credits.items()])
+        cursor.executemany("UPDATE players SET points = points + ? WHERE player_id = ?;",
+                           [(amount, player_id) for player_id, amount in credits.items()])
+
+    async def credit_many(self, credits, reason, starting_points, now):
+        # credits: {player_id: amount}, registering new players, in a single transaction
+        return await self.run(self._credit_many, credits, reason, starting_points, now)
+
+    @classmethod
+    def _buy_packs(cls, cursor, player_id, num_packs, pack_cost, starting_points, now, credit=0):
+        # Take the write lock before reading the balance, so the packs bought (the difference between the balances
+        # before and after) can't include packs another interaction posted in between
+        cursor.execute("BEGIN IMMEDIATE;")
+        balance = cls._get_player(cursor, player_id, starting_points, now, credit)
+        # num_packs None buys as many as the player can afford
+        after = cls._post(cursor, "INSERT INTO ledger (player_id, points, packs, reason, created) "
+                                  "SELECT player_id, -num*?, num, 'bought packs', ? FROM "
+                                  "(SELECT player_id, points, COALESCE(?, points / ?) AS num FROM players WHERE player_id = ?) "
+                                  "WHERE num > 0 AND points >= num*?;",
+                          (pack_cost, now, num_packs, pack_cost, player_id, pack_cost))
+        if after is None:
+            return (0, *balance)
+        return (after[1] - balance[1], *after)
+
+    async def buy_packs(self, player_id, num_packs, pack_cost, starting_points, now, credit=0):
+        # Returns (number of packs bought, points, packs) after the purchase attempt
+        return await self.run(self._buy_packs, player_id, num_packs, pack_cost, starting_points, now, credit)
+
+    @staticmethod
+    def _compact_ledger(cursor, before):
+        cursor.execute("BEGIN IMMEDIATE;")
+        (last,) = cursor.execute("SELECT MAX(entry_id) FROM ledger WHERE created < ?;", (before,)).fetchone()
+        if last is None:
+            return 0
+        compacted = "SELECT player_id FROM ledger WHERE entry_id <= ? GROUP BY player_id HAVING COUNT(*) > 1"
+        cursor.execute("INSERT INTO ledger (player_id, points, packs, reason, created) "
+                       "SELECT player_id, SUM(points), SUM(packs), 'compacted', MAX(created) FROM ledger "
+                       f"WHERE entry_id <= ? AND player_id IN ({compacted}) GROUP BY player_id;", (last, last))
+        # The new entries come after last, so this only removes the entries they replace
+        cursor.execute(f"DELETE FROM ledger WHERE entry_id <= ? AND player_id IN ({compacted});", (last, last))
+        return cursor.rowcount
+
+    async def compact_ledger(self, before):
+        # Replaces each player's ledger entries older than unix time before with one entry holding their sum.
+        # Balances are unchanged. Returns the number of entries removed.
+        return await self.run(self._compact_ledger, before)
+
+    async def get_ledger_mismatches(self):
+        # Returns [(player_id, points, packs, ledger points, ledger packs)] for balances that don't match the ledger
+        return await self.fetchall("SELECT player_id, points, packs, COALESCE(ledger_points, 0), COALESCE(ledger_packs, 0) "
+                                   "FROM players LEFT JOIN (SELECT player_id, SUM(points) AS ledger_points, SUM(packs) AS ledger_packs "
+                                   "FROM ledger GROUP BY player_id) USING (player_id) "
+                                   "WHERE points IS NOT COALESCE(ledger_points, 0) OR packs IS NOT COALESCE(ledger_packs, 0);")
+
+    # ---- Sets and cards ----
+
+    async def get_sets(self):
+        # Returns [(series, prettify, shorthand)]
+        return await self.fetchall("SELECT series, prettify, shorthand FROM sets;")
+
+    async def get_cards(self):
+        # Returns [(card_id, series, image_path, thumbnail_path, rarity)]
+        return await self.fetchall("SELECT card_id, series, image_path, thumbnail_path, rarity FROM cards;")
+
+    async def add_sets(self, sets):
+        # sets: [(series, prettify, shorthand)]; existing sets are left as they are
+        return await self.executemany("INSERT OR IGNORE INTO sets (series, prettify, shorthand) VALUES (?, ?, ?);", sets)
+
+    @staticmethod
+    def _sync_cards(cursor, rows, manifests):
+        cursor.executemany("INSERT INTO cards (card_id, series, image_path, thumbnail_path) VALUES (?, ?, ?, ?) "
+                           "ON CONFLICT (card_id, series) DO UPDATE SET "
+                           "image_path = excluded.image_path, thumbnail_path = excluded.thumbnail_path;", rows)
+        cursor.executemany("INSERT OR REPLACE INTO catalog_manifest (series, manifest) VALUES (?, ?);",
+                           [(series, json.dumps(manifest)) for series, manifest in manifests.items()])
+
+    async def sync_cards(self, rows, manifests):
+        # rows: [(card_id, series, image_path, thumbnail_path)] to add, or update keeping their rarity;
+        # manifests: {series: image directory manifest} (see catalog_sync.py). Written in one transaction.
+        return await self.run(self._sync_cards, rows, manifests)
+
+    async def get_catalog_manifest(self):
+        return {series: json.loads(manifest) for (series, manifest) in await self.fetchall("SELECT series, manifest FROM catalog_manifest;")}
+
+    @staticmethod
+    def _count_in_guild(cursor, card_id, series, member_ids):
+        # Returns {player_id: count} for guild members owning this card, from the card's index entries
+        rows = cursor.execute("SELECT player_id, quantity FROM collection WHERE series = ? AND card_id = ? "
+                              "ORDER BY quantity DESC;", (series, card_id)).fetchall()
+        return {player_id: count for (player_id, count) in rows if player_id in member_ids}
+
+    @classmethod
+    def _get_card_counts(cls, cursor, card_id, series, player_id, member_ids):
+        if member_ids is None:
+            (num_cards,) = cursor.execute("SELECT COALESCE(SUM(quantity), 0) FROM collection WHERE series = ? AND card_id = ?;",
+                                          (series, card_id)).fetchone()
+            owned_by = {}
+        else:
+            owned_by = cls._count_in_guild(cursor, card_id, series, member_ids)
+            num_cards = sum(owned_by.values())
+        num_player = 0
+        if player_id is not None:
+            row = cursor.execute("SELECT quantity FROM collection WHERE player_id = ? AND series = ? AND card_id = ?;",
+                                 (player_id, series, card_id)).fetchone()
+            num_player = row[0] if row else 0
+        return {"num_cards": num_cards, "num_player": num_player, "owned_by": owned_by}
+
+    async def get_card_counts(self, card_id, series, player_id=None, member_ids=None):
+        # Circulation counts for a card. If member_ids (a set) is given, counts are limited to those members.
+        return await self.run(self._get_card_counts, card_id, series, player_id, member_ids)
+
+    # ---- Collection ----
+    # collection holds how many of each card a player owns (and how many of those came from trades), one row per
+    # player and card. Every acquisition is also appended to card_history, which the game only ever writes.
+
+    # Add quantities (and traded quantities) of cards to players' rows; {values} is one "(?, ?, ?, ?, ?)" per row
+    ADD_CARDS = ("INSERT INTO collection (player_id, series, card_id, quantity, traded) VALUES {values} "
+                 "ON CONFLICT (player_id, series, card_id) DO UPDATE SET "
+                 "quantity = quantity + excluded.quantity, traded = traded + excluded.traded;")
+    RECORD_CARDS = ("INSERT INTO card_history (player_id, series, card_id, quantity, trade, trade_id, date_time) "
+                    "VALUES {values};")
+
+    @staticmethod
+    def _insert_rows(cursor, sql, rows):
+        # One multi-row statement rather than one per row
+        if rows:
+            values = ", ".join(["(" + ", ".join(["?"]*len(rows[0])) + ")"]*len(rows))
+            cursor.execute(sql.format(values=values), [x for row in rows for x in row])
+
+    @classmethod
+    def _add_cards(cls, cursor, player_id, series, card_ids, date_time):
+        # Cards drawn: card_ids has one entry per copy
+        added = Counter(card_ids)
+        cls._insert_rows(cursor, cls.ADD_CARDS, [(player_id, series, card_id, quantity, 0) for card_id, quantity in added.items()])
+        cls._insert_rows(cursor, cls.RECORD_CARDS, [(player_id, series, card_id, quantity, None, None, date_time)
+                                                    for card_id, quantity in added.items()])
+
+    @classmethod
+    def _add_free_card(cls, cursor, player_id, card_id, series, member_ids, date_time):
+        counts = cls._get_card_counts(cursor, card_id, series, None, member_ids)
+        cls._add_cards(cursor, player_id, series, [card_id], date_time)
+        return counts
+
+    async def add_free_card(self, player_id, card_id, series, member_ids, date_time):
+        # Returns the guild's card counts as they were before the card was added (the player's own count comes
+        # from their CollectionCache entry, so num_player isn't counted here)
+        return await self.run(self._add_free_card, player_id, card_id, series, member_ids, date_time)
+
+    @classmethod
+    def _open_packs(cls, cursor, player_id, series, card_ids, num_packs, date_time):
+        # Use up the packs only if the player still has enough of them
+        if cls._consume_packs(cursor, player_id, num_packs, date_time.timestamp()) is None:
+            return False
+        cls._add_cards(cursor, player_id, series, card_ids, date_time)
+        return True
+
+    async def open_packs(self, player_id, series, card_ids, num_packs, date_time):
+        # Adds the drawn cards and uses up num_packs packs in a single transaction.
+        # Returns False (adding nothing) if the player doesn't have enough packs.
+        return await self.run(self._open_packs, player_id, series, card_ids, num_packs, date_time)
+
+    async def get_inventory(self, player_id):
+        # Returns [(series, card_id, num_owned, num_traded)] for every unique card the player owns, from one range
+        # of the primary key
+        return await self.fetchall("SELECT series, card_id, quantity, traded FROM collection WHERE player_id = ? "
+                                   "ORDER BY series, LENGTH(card_id), card_id;", (player_id,))
+
+    async def get_all_holdings(self):
+        # Returns [(player_id, series, card_id, num_owned)] for every player, from one scan of the table
+        return await self.fetchall("SELECT player_id, series, card_id, quantity FROM collection;")
+
+    # ---- Trades ----
+
+    # Quantities of each player's cards reserved by pending trades that haven't expired
+    RESERVED = ("SELECT from_id, series, card_id, SUM(quantity) AS reserved FROM trades JOIN trade_items USING (trade_id) "
+                "WHERE status = 'pending' AND expires > ? GROUP BY from_id, series, card_id")
+
+    @classmethod
+    def _reserve_trade(cls, cursor, player_id, member_id, give, take, now, expires):
+        # Take the write lock first, so no other trade can reserve the same cards between the check and the insert
+        cursor.execute("BEGIN IMMEDIATE;")
+        wanted = [(player_id, series, card_id) for (series, card_id) in give] + \
+                 [(member_id, series, card_id) for (series, card_id) in take]
+        values = ", ".join(["(?, ?, ?)"]*len(wanted))
+        rows = cursor.execute(f"WITH wanted (player_id, series, card_id) AS (VALUES {values}), reserved AS ({cls.RESERVED}) "
+                              "SELECT player_id, collection.series, collection.card_id, quantity - COALESCE(reserved, 0) FROM wanted "
+                              "JOIN collection USING (player_id, series, card_id) "
+                              "LEFT JOIN reserved ON from_id = player_id AND reserved.series = collection.series "
+                              "AND reserved.card_id = collection.card_id;",
+                              [x for row in wanted for x in row] + [now]).fetchall()
+        owned = {(owner, series, card_id): available for (owner, series, card_id, available) in rows}
+
+        items = [(from_id, to_id, series, card_id, quantity)
+                 for (from_id, to_id, offer) in [(player_id, member_id, give), (member_id, player_id, take)]
+                 for (series, card_id), quantity in offer.items()]
+        if any(owned.get((from_id, series, card_id), 0) < quantity for (from_id, _, series, card_id, quantity) in items):
+            return None, owned
+
+        cursor.execute("INSERT INTO trades (player_id, member_id, status, created, expires) VALUES (?, ?, 'pending', ?, ?);",
+                       (player_id, member_id, now, expires))
+        trade_id = cursor.lastrowid
+        cursor.executemany("INSERT INTO trade_items (trade_id, from_id, to_id, series, card_id, quantity) VALUES (?, ?, ?, ?, ?, ?);",
+                           [(trade_id,) + item for item in items])
+        return trade_id, owned
+
+    async def reserve_trade(self, player_id, member_id, give, take, now, expires):
+        # give, take: {(series, card_id): quantity} offered by player_id and member_id respectively.
+        # Checks both sides with one query, counting only copies not already reserved by another pending trade,
+        # and if every card is available records a pending trade reserving the quantities until expires.
+        # Returns (trade_id or None if something is missing, {(player_id, series, card_id): number available}).
+        return await self.run(self._reserve_trade, player_id, member_id, give, take, now, expires)
+
+    @classmethod
+    def _accept_trade(cls, cursor, trade_id, now):
+        cursor.execute("BEGIN IMMEDIATE;")
+        cursor.execute("UPDATE trades SET status = 'accepted' WHERE trade_id = ? AND status = 'pending' AND expires > ?;", (trade_id, now))
+        if cursor.rowcount == 0:
+            return None
+        items = cursor.execute("SELECT from_id, to_id, trade_items.series, trade_items.card_id, trade_items.quantity, "
+                               "collection.quantity, traded FROM trade_items LEFT JOIN collection "
+                               "ON player_id = from_id AND collection.series = trade_items.series AND collection.card_id = trade_items.card_id "
+                               "WHERE trade_id = ?;", (trade_id,)).fetchall()
+        # The trade only goes ahead if every giver still owns the quantities reserved
+        if any(owned is None or owned < quantity for (_, _, _, _, quantity, owned, _) in items):
+            cursor.execute("ROLLBACK;")
+            cursor.execute("UPDATE trades SET status = 'failed' WHERE trade_id = ?;", (trade_id,))
+            return None
+        # Givers part with the copies they drew before any that came from trades
+        moves = [(from_id, to_id, series, card_id, quantity, traded - min(traded, owned - quantity))
+                 for (from_id, to_id, series, card_id, quantity, owned, traded) in items]
+        cursor.executemany("UPDATE collection SET quantity = quantity - ?, traded = traded - ? "
+                           "WHERE player_id = ? AND series = ? AND card_id = ?;",
+                           [(quantity, traded, from_id, series, card_id) for (from_id, _, series, card_id, quantity, traded) in moves])
+        cursor.executemany("DELETE FROM collection WHERE player_id = ? AND series = ? AND card_id = ? AND quantity = 0;",
+                           [(from_id, series, card_id) for (from_id, _, series, card_id, _, _) in moves])
+        cls._insert_rows(cursor, cls.ADD_CARDS, [(to_id, series, card_id, quantity, quantity) for (_, to_id, series, card_id, quantity, _) in moves])
+        date_time = datetime.fromtimestamp(now)
+        cls._insert_rows(cursor, cls.RECORD_CARDS, [(to_id, series, card_id, quantity, from_id, trade_id, date_time)
+                                                    for (from_id, to_id, series, card_id, quantity, _) in moves])
+        return moves
+
+    async def accept_trade(self, trade_id, now):
+        # Moves every reserved quantity in one transaction. Returns the cards moved [(from_id, to_id, series,
+        # card_id, quantity, how many of those the giver had got from earlier trades)], or None (changing nothing)
+        # if the trade is no longer pending or a giver no longer has the cards reserved
+        return await self.run(self._accept_trade, trade_id, now)
+
+    async def cancel_trade(self, trade_id, status="cancelled"):
+        # Releases the trade's reserved cards
+        return await self.execute("UPDATE trades SET status = ? WHERE trade_id = ? AND status = 'pending';", (status, trade_id))
+
+    # ---- Attachments ----
+
+    async def get_attachments(self):
+        # Returns [(series, card_id, url, expires, message_id)]
+        return await self.fetchall("SELECT series, card_id, url, expires, message_id FROM attachments;")
+
+    async def save_attachment(self, series, card_id, url, expires, message_id):
+        return await self.execute("INSERT OR REPLACE INTO attachments (series, card_id, url, expires, message_id) "
+                                  "VALUES (?, ?, ?, ?, ?);", (series, card_id, url, expires, message_id))
+
+    async def delete_attachment(self, series, card_id):
+        return await self.execute("DELETE FROM attachments WHERE series = ? AND card_id = ?;", (series, card_id))
+
+    # ---- Cooldowns ----
+
+    async def get_cooldowns(self, now):
+        # Returns [(name, key, until)] for cooldowns still running at unix time now
+        return await self.fetchall("SELECT name, key, until FROM cooldowns WHERE until > ?;", (now,))
+
+    @staticmethod
+    def _save_cooldowns(cursor, rows, reset, now):
+        cursor.executemany("INSERT OR REPLACE INTO cooldowns (name, key, until) VALUES (?, ?, ?);", rows)
+        cursor.executemany("DELETE FROM cooldowns WHERE name = ? AND key = ?;", reset)
+        cursor.execute("DELETE FROM cooldowns WHERE until <= ?;", (now,))
+
+    async def save_cooldowns(self, rows, reset, now):
+        # rows: [(name, key, until)] to write, reset: [(name, key)] to remove; expired rows are removed as well
+        return await self.run(self._save_cooldowns, rows, reset, now)
@@ -0,0 +1,143 @@
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+import argparse
+import hashlib
+from io import BytesIO
+import json
+import os
+
+from PIL import Image
+
+
+CARD_DIRECTORY = "./data/cards"
+DERIVATIVE_DIRECTORY = "./data/derivatives"
+MANIFEST_PATH = f"{DERIVATIVE_DIRECTORY}/manifest.json"
+DISPLAY_WIDTH = 400  # Discord shows embed images at most about this wide
+BACKGROUND = (49, 51, 56)  # Discord's dark theme, behind transparent corners in formats without alpha
+
+# Derivative variants: name -> (format, file extension, max width or None, starting quality, size budget in bytes).
+# Quality is stepped down until the file fits the budget (or MIN_QUALITY is reached).
+VARIANTS = {"webp": ("WEBP", "webp", None, 90, 150_000),
+            "jpg": ("JPEG", "jpg", None, 90, 150_000),
+            "display": ("WEBP", "webp", DISPLAY_WIDTH, 85, 60_000)}
+MIN_QUALITY = 50
+QUALITY_STEP = 10
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def encode_variant(image, variant):
+    # Returns the encoded bytes of one variant, stepping quality down to fit its size budget
+    image_format, _, max_width, quality, budget = VARIANTS[variant]
+    if max_width and image.width > max_width:
+        image = image.resize((max_width, round(image.height*max_width/image.width)), Image.LANCZOS)
+    if image_format == "JPEG" and image.mode == "RGBA":
+        flat = Image.new("RGB", image.size, BACKGROUND)
+        flat.paste(image, mask=image.getchannel("A"))
+        image = flat
+    while True:
+        image_binary = BytesIO()
+        if image_format == "JPEG":
+            image.save(image_binary, image_format, quality=quality, optimize=True)
+        else:
+            image.save(image_binary, image_format, quality=quality)
+        if image_binary.tell() <= budget or quality - QUALITY_STEP < MIN_QUALITY:
+            return image_binary.getvalue()
+        quality -= QUALITY_STEP
+
+
+def build_derivatives(task):
+    # Worker: (series, file name, previous manifest entry or None) -> (key, manifest entry, whether it was rebuilt)
+    series, image_path, previous = task
+    key = f"{series}/{image_path}"
+    source = f"{CARD_DIRECTORY}/{series}/merged/{image_path}"
+    digest = file_hash(source)
+    if previous and previous["hash"] == digest and \
+            all(os.path.exists(f"{DERIVATIVE_DIRECTORY}/{path}") for (path, _) in previous["variants"].values()):
+        return key, dict(previous, size=os.path.getsize(source)), False
+
+    entry = {"hash": digest, "size": os.path.getsize(source), "variants": {}}
+    with Image.open(source) as image:
+        if getattr(image, "n_frames", 1) > 1:
+            return key, entry, True  # Animated (holographic) cards are always sent as the original GIF
+        image = image.convert("RGBA")
+        os.makedirs(f"{DERIVATIVE_DIRECTORY}/{series}", exist_ok=True)
+        for variant, (_, extension, _, _, _) in VARIANTS.items():
+            data = encode_variant(image, variant)
+            # Named by content hash, so a changed source never overwrites a file a running bot may be sending
+            path = f"{series}/{digest[:16]}.{variant}.{extension}"
+            with open(f"{DERIVATIVE_DIRECTORY}/{path}", "wb") as f:
+                f.write(data)
+            entry["variants"][variant] = [path, len(data)]
+    return key, entry, True
+
+
+def load_manifest(path=MANIFEST_PATH):
+    # Returns {"series/file name": {"hash", "size", "variants": {variant: [path, bytes]}}}, or {} if not built yet
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def build(all_series, workers=None):
+    manifest = load_manifest()
+    tasks = [(series, os.path.basename(path), manifest.get(f"{series}/{os.path.basename(path)}"))
+             for series in all_series for path in sorted(glob(f"{CARD_DIRECTORY}/{series}/merged/*"))]
+    num_built = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for key, entry, rebuilt in executor.map(build_derivatives, tasks, chunksize=8):
+            manifest[key] = entry
+            num_built += rebuilt
+
+    # Drop entries for source files that no longer exist, then any derivative file no entry refers to
+    manifest = {key: entry for key, entry in manifest.items() if os.path.exists(f"{CARD_DIRECTORY}/{key.replace('/', '/merged/', 1)}")}
+    referenced = {path for entry in manifest.values() for (path, _) in entry["variants"].values()}
+    for path in glob(f"{DERIVATIVE_DIRECTORY}/*/*"):
+        if os.path.relpath(path, DERIVATIVE_DIRECTORY) not in referenced:
+            os.remove(path)
+
+    os.makedirs(DERIVATIVE_DIRECTORY, exist_ok=True)
+    with open(f"{MANIFEST_PATH}.tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(f"{MANIFEST_PATH}.tmp", MANIFEST_PATH)
+
+    source_bytes = sum(entry["size"] for entry in manifest.values())
+    smallest_bytes = sum(min([entry["size"]] + [size for (_, size) in entry["variants"].values()]) for entry in manifest.values())
+    print(f"Built derivatives for {num_built} of {len(tasks)} images ({len(tasks) - num_built} unchanged). "
+          f"Smallest files total {smallest_bytes/1e6:.1f} MB, originals {source_bytes/1e6:.1f} MB.")
+    return manifest
+
+
+def best_variant(entry, source_path, variants):
+    # Path of the smallest usable file for a card: one of the listed variants, or the original if it is smaller,
+    # has no derivatives, or has changed since the manifest was built
+    try:
+        if entry is None or os.path.getsize(source_path) != entry["size"]:
+            return source_path
+    except OSError:
+        return source_path
+    best_path, best_size = source_path, entry["size"]
+    for variant in variants:
+        if variant in entry["variants"]:
+            path, size = entry["variants"][variant]
+            if size < best_size and os.path.exists(f"{DERIVATIVE_DIRECTORY}/{path}"):
+                best_path, best_size = f"{DERIVATIVE_DIRECTORY}/{path}", size
+    return best_path
+
+
+if __name__ == "__main__":
+    # Build image derivatives for all card series: python utils/derivatives.py [--workers N] [series ...]
+    parser = argparse.ArgumentParser(description="Build size-budgeted derivatives of the merged card images.")
+    parser.add_argument("series", nargs="*", help="card series to process (default: all)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: CPU count)")
+    args = parser.parse_args()
+    build(args.series or sorted(os.path.basename(path) for path in glob(f"{CARD_DIRECTORY}/*") if os.path.isdir(path)),
+          args.workers)
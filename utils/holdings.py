@@ -0,0 +1,111 @@
+import numpy as np
+
+
+class HoldingsIndex(object):
+    # Every player's card counts in one numpy matrix: a row per player and a column per catalog card, with each
+    # series' cards in a contiguous block of columns in catalog order. Set questions across all players (who has
+    # spares of the cards I'm missing, and who is missing my spares) are then a few vectorised comparisons over
+    # the rows of the guild's members, instead of queries over the whole collection table.
+    # Loaded once from the collection table, then updated incrementally by the same writes that update the
+    # CollectionCache (add for freebies and packs, move for trades).
+    def __init__(self, catalog, rows=(), dtype=np.uint16):
+        self.cards = []  # Column -> Card
+        self.columns = {}  # {(series, card_id): column}
+        self.series_columns = {}  # {series: slice of columns}
+        for series, cards in catalog.series_cards.items():
+            start = len(self.cards)
+            for card in cards:
+                self.columns[card.key] = len(self.cards)
+                self.cards.append(card)
+            self.series_columns[series] = slice(start, len(self.cards))
+
+        self.rows = {}  # {player_id: row}
+        self.counts = np.zeros((0, len(self.cards)), dtype=dtype)  # Grown by doubling; rows past len(self.rows) are unused
+        self.load(rows)
+
+    def load(self, rows):
+        # rows: [(player_id, series, card_id, count)], as returned by Database.get_all_holdings
+        entries = [(self.row(player_id), self.columns[(series, card_id)], count) for (player_id, series, card_id, count) in rows
+                   if (series, card_id) in self.columns]
+        if entries:
+            (player_rows, columns, counts) = zip(*entries)
+            self.counts[list(player_rows), list(columns)] = counts
+
+    def row(self, player_id):
+        # The player's row, adding an empty one if they have none yet
+        row = self.rows.get(player_id)
+        if row is None:
+            row = self.rows[player_id] = len(self.rows)
+            if row == len(self.counts):
+                grown = np.zeros((max(16, 2*len(self.counts)), len(self.cards)), dtype=self.counts.dtype)
+                grown[:len(self.counts)] = self.counts
+                self.counts = grown
+        return row
+
+    def add(self, player_id, keys):
+        # keys: [(series, card_id)], one per copy gained
+        row = self.row(player_id)  # Before indexing self.counts, which this may grow
+        np.add.at(self.counts[row], [self.columns[key] for key in keys if key in self.columns], 1)
+
+    def move(self, moves):
+        # moves: [(from_id, to_id, series, card_id, quantity, traded)], as returned by Database.accept_trade
+        for (from_id, to_id, series, card_id, quantity, _) in moves:
+            column = self.columns.get((series, card_id))
+            if column is not None:
+                (from_row, to_row) = (self.row(from_id), self.row(to_id))
+                self.counts[from_row, column] -= min(quantity, self.counts[from_row, column])
+                self.counts[to_row, column] += quantity
+
+    def count(self, player_id, key):
+        row = self.rows.get(player_id)
+        return int(self.counts[row, self.columns[key]]) if row is not None and key in self.columns else 0
+
+    def _select(self, player_id, series, member_ids):
+        # (first column, the player's counts over the columns, other members' player_ids, and their counts)
+        columns = self.series_columns[series] if series else slice(None)
+        row = self.rows.get(player_id)
+        mine = self.counts[row, columns] if row is not None else np.zeros(len(self.cards), dtype=self.counts.dtype)[columns]
+        others = [member_id for member_id in member_ids if member_id != player_id and member_id in self.rows]
+        theirs = self.counts[np.array([self.rows[member_id] for member_id in others], dtype=np.int64), columns]
+        offset = columns.start or 0
+        return offset, mine, others, theirs
+
+    def missing(self, player_id, member_ids, series=None, num_holders=3):
+        # Cards the player doesn't own (in one series, or all), each with up to num_holders members holding spares
+        # of it, most spares first. Returns [(Card, [(member_id, spares)])] in catalog order.
+        offset, mine, others, theirs = self._select(player_id, series, member_ids)
+        missing = np.flatnonzero(mine == 0)
+        # Copies beyond the first, per missing card and member
+        spares = theirs.T[missing].astype(np.int32) - 1
+        # Best holders of each missing card, most spares first: num_holders passes of argmax, each removing the best
+        card_rows = np.arange(len(missing))
+        best = []
+        for _ in range(min(num_holders, len(others))):
+            holder = spares.argmax(axis=1)
+            best.append((holder, spares[card_rows, holder]))
+            spares[card_rows, holder] = 0
+        result = []
+        for j, column in enumerate(missing):
+            holders = [(others[holder[j]], int(num[j])) for (holder, num) in best if num[j] > 0]
+            result.append((self.cards[offset + column], holders))
+        return result
+
+    def matches(self, player_id, member_ids, series=None, limit=10):
+        # Members to trade with: the cards they have spares of that the player is missing, and the player's spares
+        # that they are missing. Ranked by mutual benefit: the number of one-for-one swaps possible, then the
+        # total number of cards either side could gain. Returns [(member_id, [Card they can give], [Card you can give])].
+        offset, mine, others, theirs = self._select(player_id, series, member_ids)
+        they_give = (theirs >= 2) & (mine == 0)
+        you_give = (theirs == 0) & (mine >= 2)
+        (num_get, num_give) = (they_give.sum(axis=1), you_give.sum(axis=1))
+        order = np.lexsort((-(num_get + num_give), -np.minimum(num_get, num_give)))
+        result = []
+        for i in order[:limit]:
+            if num_get[i] + num_give[i] == 0:
+                break
+            result.append((others[i], [self.cards[offset + column] for column in np.flatnonzero(they_give[i])],
+                           [self.cards[offset + column] for column in np.flatnonzero(you_give[i])]))
+        return result
+
+    def __len__(self):
+        return len(self.rows)
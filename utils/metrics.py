@@ -0,0 +1,168 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+import os
+from time import perf_counter
+
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# The invocation being tracked in the current task, so database calls can be attributed to it
+_current = ContextVar("current_invocation", default=None)
+
+
+def record_db_call(seconds):
+    # Called by Database for every round trip to its worker threads
+    invocation = _current.get()
+    if invocation is not None:
+        invocation.db_calls += 1
+        invocation.db_time += seconds
+
+
+def count_statement():
+    # Called by the SQL tracer for every statement, on a database worker thread running in a copy of the caller's
+    # context. Returns the (kind, name) of the invocation the statement belongs to, or None.
+    invocation = _current.get()
+    if invocation is None:
+        return None
+    invocation.statements += 1
+    return invocation.key
+
+
+class Series(object):
+    # Latency histogram and counters for one command, view callback, listener or render
+    __slots__ = ("buckets", "count", "total", "errors", "db_calls", "db_time", "statements")
+
+    def __init__(self):
+        self.buckets = [0]*(len(BUCKETS) + 1)  # Last bucket is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.db_calls = 0
+        self.db_time = 0.0
+        self.statements = 0  # Only counted while SQL tracing is on
+
+    def quantile(self, q):
+        # Upper bound of the bucket containing the q-th quantile (None past the last bound)
+        rank = q*self.count
+        cumulative = 0
+        for bound, n in zip(BUCKETS, self.buckets):
+            cumulative += n
+            if cumulative >= rank:
+                return bound
+        return None
+
+
+class Invocation(object):
+    # Context manager timing one invocation; an exception escaping it counts as an error.
+    # Nested invocations (e.g. an image render inside a command) also add their database use to the outer one.
+    __slots__ = ("metrics", "key", "start", "token", "parent", "db_calls", "db_time", "statements")
+
+    def __init__(self, metrics, key):
+        self.metrics = metrics
+        self.key = key
+        self.db_calls = 0
+        self.db_time = 0.0
+        self.statements = 0
+
+    def __enter__(self):
+        self.parent = _current.get()
+        self.token = _current.set(self)
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = perf_counter() - self.start
+        _current.reset(self.token)
+        self.metrics.record(self.key, elapsed, exc_type is not None and issubclass(exc_type, Exception),
+                            self.db_calls, self.db_time, self.statements)
+        if self.parent is not None:
+            self.parent.db_calls += self.db_calls
+            self.parent.db_time += self.db_time
+            self.parent.statements += self.statements
+        return False
+
+
+class Metrics(object):
+    # In-process metrics for the bot: {(kind, name): Series}, where kind is "command", "view", "listener" or "render".
+    # Recording is a dict lookup, a bisect and a few additions, so it is cheap enough for on_message.
+    def __init__(self):
+        self.series = {}
+        self.summaries = {}  # {metric name: (description, source)}, kept by other components
+
+    def track(self, kind, name):
+        return Invocation(self, (kind, name))
+
+    def add_summary(self, name, description, source):
+        # Export counters kept elsewhere: source() returns (count, total seconds, max seconds)
+        self.summaries[name] = (description, source)
+
+    def record(self, key, seconds, error=False, db_calls=0, db_time=0.0, statements=0):
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = Series()
+        series.buckets[bisect_left(BUCKETS, seconds)] += 1
+        series.count += 1
+        series.total += seconds
+        series.errors += error
+        series.db_calls += db_calls
+        series.db_time += db_time
+        series.statements += statements
+
+    def count_error(self, kind, name):
+        # For errors that are handled before they reach the invocation's context manager
+        key = (kind, name)
+        if key not in self.series:
+            self.series[key] = Series()
+        self.series[key].errors += 1
+
+    def summary(self, kind=None, limit=25):
+        # Plain-text table of the busiest series, for the /metrics command
+        rows = sorted([(key, series) for key, series in self.series.items() if kind is None or key[0] == kind],
+                      key=lambda row: -row[1].count)[:limit]
+        lines = [f"{'name':<30}{'calls':>7}{'err':>5}{'mean':>8}{'p95':>7}{'db/call':>8}{'db ms':>7}{'sql/call':>9}"]
+        for (series_kind, name), series in rows:
+            mean = series.total/series.count*1000 if series.count else 0
+            p95 = series.quantile(0.95)
+            p95 = f"<{p95*1000:g}" if p95 is not None else f">{BUCKETS[-1]:g}s"
+            db_per_call = series.db_calls/series.count if series.count else 0
+            db_ms = series.db_time/series.count*1000 if series.count else 0
+            sql_per_call = series.statements/series.count if series.count else 0
+            lines.append(f"{(series_kind[0] + ' ' + name)[:29]:<30}{series.count:>7}{series.errors:>5}{mean:>8.1f}{p95:>7}"
+                         f"{db_per_call:>8.1f}{db_ms:>7.1f}{sql_per_call:>9.1f}")
+        return '\n'.join(lines)
+
+    def prometheus(self):
+        # Prometheus text exposition format
+        def labels(kind, name, **extra):
+            pairs = {"kind": kind, "name": name, **extra}
+            escaped = {k: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for k, v in pairs.items()}
+            return '{' + ','.join([f'{k}="{v}"' for k, v in escaped.items()]) + '}'
+
+        lines = ["# HELP bot_invocation_seconds Time taken by commands, view callbacks, listeners and renders.",
+                 "# TYPE bot_invocation_seconds histogram"]
+        for (kind, name), series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ("+Inf",), series.buckets):
+                cumulative += n
+                lines.append(f"bot_invocation_seconds_bucket{labels(kind, name, le=bound)} {cumulative}")
+            lines.append(f"bot_invocation_seconds_sum{labels(kind, name)} {series.total}")
+            lines.append(f"bot_invocation_seconds_count{labels(kind, name)} {series.count}")
+        for metric, attribute, description in [("bot_invocation_errors_total", "errors", "Invocations that raised an error."),
+                                               ("bot_db_calls_total", "db_calls", "Database round trips made by invocations."),
+                                               ("bot_db_seconds_total", "db_time", "Time invocations spent waiting on the database."),
+                                               ("bot_db_statements_total", "statements", "SQL statements run by invocations (while tracing).")]:
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} counter"]
+            lines += [f"{metric}{labels(kind, name)} {getattr(series, attribute)}" for (kind, name), series in sorted(self.series.items())]
+        for metric, (description, source) in sorted(self.summaries.items()):
+            (count, total, longest) = source()
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} summary",
+                      f"{metric}_sum {total}", f"{metric}_count {count}",
+                      f"# HELP {metric}_max Longest of {metric}.", f"# TYPE {metric}_max gauge", f"{metric}_max {longest}"]
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        # Written to a temporary file and renamed, so a scraper never reads a partial file
+        with open(f"{path}.tmp", "w") as f:
+            f.write(self.prometheus())
+        os.replace(f"{path}.tmp", path)
@@ -0,0 +1,47 @@
+import numpy as np
+
+
+class AliasSampler(object):
+    # Weighted sampling with Walker's alias method (Vose's construction).
+    # Building the table is O(n) and happens once; each draw is then one uniform index and one coin flip,
+    # so k draws cost O(k) regardless of the number of items, and bulk draws are fully vectorized.
+    __slots__ = ("items", "prob", "alias")
+
+    def __init__(self, items, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        assert len(items) == len(weights) > 0, "need one positive weight per item"
+        n = len(weights)
+        scaled = weights * n / weights.sum()
+
+        self.items = np.asarray(items, dtype=object)
+        self.prob = np.ones(n, dtype=np.float64)
+        self.alias = np.arange(n, dtype=np.int64)
+
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        # Whatever is left is 1 up to rounding error; prob and alias already default to that
+
+    def __len__(self):
+        return len(self.prob)
+
+    def sample_indices(self, k, rng):
+        # Returns an array of k item indices
+        columns = rng.integers(0, len(self.prob), size=k)
+        return np.where(rng.random(k) < self.prob[columns], columns, self.alias[columns])
+
+    def sample(self, k, rng):
+        # Returns a list of k items
+        return self.items[self.sample_indices(k, rng)].tolist()
+
+    def probabilities(self):
+        # Exact probability of drawing each item, recovered from the table (useful for checking draw distributions)
+        n = len(self.prob)
+        p = self.prob / n
+        np.add.at(p, self.alias, (1 - self.prob) / n)
+        return p
@@ -0,0 +1,188 @@
+# Schema for the game database (./data/trading_cards.sqlite).
+# The schema version is kept in PRAGMA user_version; each migration below runs once, in order, in its own
+# transaction. To change the schema, append a new migration rather than editing an old one.
+
+# The ledger's queries use UPDATE ... FROM and RETURNING
+MIN_SQLITE_VERSION = (3, 35)
+
+# Applied to every pooled connection
+CONNECTION_PRAGMAS = ["PRAGMA journal_mode = WAL;",  # Readers don't block the writer (persists in the file)
+                      "PRAGMA synchronous = NORMAL;",  # With WAL, only checkpoints fsync
+                      "PRAGMA cache_size = -8000;",  # ~8 MB page cache per connection
+                      "PRAGMA temp_store = MEMORY;"]
+
+MIGRATIONS = [
+    # 1: Base tables, matching the layout of the original database
+    ["""CREATE TABLE IF NOT EXISTS "players" (
+            "player_id" INTEGER,
+            "points" INTEGER,
+            "packs" INTEGER,
+            PRIMARY KEY("player_id")
+        );""",
+     """CREATE TABLE IF NOT EXISTS "cards" (
+            "card_id" TEXT,
+            "series" TEXT,
+            "image_path" TEXT,
+            "thumbnail_path" TEXT,
+            "rarity" INTEGER DEFAULT 1,
+            UNIQUE("card_id", "series")
+        );""",
+     """CREATE TABLE IF NOT EXISTS "sets" (
+            "series" TEXT,
+            "prettify" TEXT,
+            "shorthand" TEXT
+        );""",
+     """CREATE TABLE IF NOT EXISTS "collection" (
+            "player_id" INTEGER,
+            "card_id" TEXT,
+            "series" TEXT,
+            "date_time" TEXT,
+            "trade" INTEGER
+        );"""],
+
+    # 2: Indexes for the collection query shapes
+    #  - a player's cards, grouped by (series, card_id), with trade for COUNT(trade) (inventory, trades, pack opening)
+    #  - a card's owners, grouped by player_id (circulation counts, search)
+    ["CREATE INDEX IF NOT EXISTS collection_player ON collection (player_id, series, card_id, trade);",
+     "CREATE INDEX IF NOT EXISTS collection_card ON collection (series, card_id, player_id);",
+     "CREATE UNIQUE INDEX IF NOT EXISTS sets_series ON sets (series);",
+     "ANALYZE;"],
+
+    # 3: Discord CDN URLs of card images already uploaded, with their expiry (unix time)
+    ["""CREATE TABLE IF NOT EXISTS "attachments" (
+            "series" TEXT,
+            "card_id" TEXT,
+            "url" TEXT,
+            "expires" REAL,
+            PRIMARY KEY("series", "card_id")
+        );"""],
+
+    # 4: Cooldowns and rate limits (see cooldowns.py); "until" is the unix time the key's bucket is full again
+    ["""CREATE TABLE IF NOT EXISTS "cooldowns" (
+            "name" TEXT,
+            "key" INTEGER,
+            "until" REAL,
+            PRIMARY KEY("name", "key")
+        ) WITHOUT ROWID;"""],
+
+    # 5: Escrowed trades. A pending trade reserves the collection rows it lists until it is resolved or expires;
+    # "expires" is a unix time
+    ["""CREATE TABLE IF NOT EXISTS "trades" (
+            "trade_id" INTEGER PRIMARY KEY,
+            "player_id" INTEGER,
+            "member_id" INTEGER,
+            "status" TEXT,
+            "created" REAL,
+            "expires" REAL
+        );""",
+     """CREATE TABLE IF NOT EXISTS "trade_items" (
+            "trade_id" INTEGER,
+            "card_rowid" INTEGER,
+            "from_id" INTEGER,
+            "to_id" INTEGER
+        );""",
+     "CREATE INDEX IF NOT EXISTS trade_items_trade ON trade_items (trade_id);",
+     "CREATE INDEX IF NOT EXISTS trade_items_card ON trade_items (card_rowid);",
+     "CREATE INDEX IF NOT EXISTS trades_pending ON trades (status, expires);"],
+
+    # 6: State of each series' image directories when its cards were last synced (JSON, see catalog_sync.py)
+    ["""CREATE TABLE IF NOT EXISTS "catalog_manifest" (
+            "series" TEXT,
+            "manifest" TEXT,
+            PRIMARY KEY("series")
+        );"""],
+
+    # 7: Append-only ledger of changes to players' points and packs (see Database, "Players and economy");
+    # "created" is a unix time. Existing balances become each player's opening entry.
+    ["""CREATE TABLE IF NOT EXISTS "ledger" (
+            "entry_id" INTEGER PRIMARY KEY,
+            "player_id" INTEGER,
+            "points" INTEGER,
+            "packs" INTEGER,
+            "reason" TEXT,
+            "created" REAL
+        );""",
+     "CREATE INDEX IF NOT EXISTS ledger_created ON ledger (created);",
+     "UPDATE players SET points = COALESCE(points, 0), packs = COALESCE(packs, 0) WHERE points IS NULL OR packs IS NULL;",
+     """INSERT INTO ledger (player_id, points, packs, reason, created)
+        SELECT player_id, COALESCE(points, 0), COALESCE(packs, 0), 'opening balance', CAST(strftime('%s', 'now') AS REAL)
+        FROM players;"""],
+
+    # 8: Holdings as quantities. "collection" becomes one row per (player, card) with the number owned and how many
+    # of those came from trades; each acquisition (the old per-card date_time and trade columns) moves to the
+    # append-only "card_history", which only records and is never read by the game. Trade items reserve and move
+    # quantities of a card instead of collection rowids.
+    ["ALTER TABLE collection RENAME TO collection_rows;",
+     """CREATE TABLE "collection" (
+            "player_id" INTEGER,
+            "series" TEXT,
+            "card_id" TEXT,
+            "quantity" INTEGER,
+            "traded" INTEGER DEFAULT 0,
+            PRIMARY KEY("player_id", "series", "card_id")
+        ) WITHOUT ROWID;""",
+     """INSERT INTO collection (player_id, series, card_id, quantity, traded)
+        SELECT player_id, series, card_id, COUNT(*), COUNT(trade) FROM collection_rows GROUP BY player_id, series, card_id;""",
+     "DROP INDEX IF EXISTS collection_card;",  # Index names move with a renamed table
+     "CREATE INDEX collection_card ON collection (series, card_id, player_id, quantity);",
+     # "trade" is the player_id of the player the cards came from, or NULL for cards drawn
+     """CREATE TABLE IF NOT EXISTS "card_history" (
+            "entry_id" INTEGER PRIMARY KEY,
+            "player_id" INTEGER,
+            "series" TEXT,
+            "card_id" TEXT,
+            "quantity" INTEGER,
+            "trade" INTEGER,
+            "trade_id" INTEGER,
+            "date_time" TEXT
+        );""",
+     """INSERT INTO card_history (player_id, series, card_id, quantity, trade, date_time)
+        SELECT player_id, series, card_id, 1, trade, date_time FROM collection_rows ORDER BY rowid;""",
+     "ALTER TABLE trade_items RENAME TO trade_rows;",
+     """CREATE TABLE "trade_items" (
+            "trade_id" INTEGER,
+            "from_id" INTEGER,
+            "to_id" INTEGER,
+            "series" TEXT,
+            "card_id" TEXT,
+            "quantity" INTEGER
+        );""",
+     """INSERT INTO trade_items (trade_id, from_id, to_id, series, card_id, quantity)
+        SELECT trade_id, from_id, to_id, series, card_id, COUNT(*) FROM trade_rows
+        JOIN collection_rows ON collection_rows.rowid = card_rowid GROUP BY trade_id, from_id, to_id, series, card_id;""",
+     "DROP INDEX IF EXISTS trade_items_trade;",
+     "CREATE INDEX trade_items_trade ON trade_items (trade_id);",
+     "DROP TABLE trade_rows;",
+     "DROP TABLE collection_rows;",
+     "ANALYZE;"],
+
+    # 9: The message each cached attachment URL was uploaded with, so the URL can be dropped when that message is
+    # deleted or its file replaced (NULL for URLs cached before this migration)
+    ["ALTER TABLE attachments ADD COLUMN message_id INTEGER;"],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_version(cursor):
+    (version,) = cursor.execute("PRAGMA user_version;").fetchone()
+    return version
+
+
+def migrate(cursor, target=SCHEMA_VERSION):
+    # Bring the database up to target (by default SCHEMA_VERSION); returns the list of migrations applied.
+    # On an up-to-date database this is a single PRAGMA read.
+    version = get_version(cursor)
+    applied = []
+    for n in range(version, target):
+        cursor.execute("BEGIN;")
+        try:
+            for statement in MIGRATIONS[n]:
+                cursor.execute(statement)
+            cursor.execute(f"PRAGMA user_version = {n + 1};")
+            cursor.execute("COMMIT;")
+        except Exception:
+            cursor.execute("ROLLBACK;")
+            raise
+        applied.append(n + 1)
+    return applied
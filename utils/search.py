@@ -0,0 +1,102 @@
+import re
+from time import perf_counter
+
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+MAX_RESULTS = 25  # Discord shows at most 25 autocomplete choices
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SeriesIndex(object):
+    # Token and trigram index over the cards of one series.
+    # Entries are stored in card number order, so an entry's position doubles as its rank within a match group.
+    __slots__ = ("labels", "texts", "tokens", "trigrams")
+
+    def __init__(self, cards):
+        self.labels = []  # Autocomplete choice shown to the user, e.g. "#12: Wolverine"
+        self.texts = []  # Lowercase searchable text: label, set code and shorthand
+        self.tokens = []  # Words of each entry, for prefix matching
+        self.trigrams = {}  # {trigram: set of entry positions}
+        for n, card in enumerate(cards):
+            label = f"#{card.card_id}: {card.name}"
+            text = f"{label} {card.code} {card.shorthand}".lower()
+            self.labels.append(label)
+            self.texts.append(text)
+            self.tokens.append(tuple(TOKEN_PATTERN.findall(text)))
+            for trigram in trigrams(text):
+                self.trigrams.setdefault(trigram, set()).add(n)
+
+    def candidates(self, query):
+        if len(query) < 3:
+            return range(len(self.labels))
+        postings = [self.trigrams.get(trigram) for trigram in trigrams(query)]
+        if not all(postings):
+            return []
+        return sorted(set.intersection(*sorted(postings, key=len)))
+
+    def search(self, query, limit=MAX_RESULTS):
+        # Substring search ranked by prefix matches first (a word or the card number starts with the query),
+        # then everything else, each group in card number order
+        query = query.strip().lower()
+        if not query:
+            return self.labels[:limit]
+        query_tokens = TOKEN_PATTERN.findall(query)
+        prefix, other = [], []
+        for n in self.candidates(query):
+            if query not in self.texts[n]:
+                continue
+            if query_tokens and any(token.startswith(query_tokens[0]) for token in self.tokens[n]):
+                prefix.append(n)
+            else:
+                other.append(n)
+            if len(prefix) >= limit:
+                break
+        return [self.labels[n] for n in (prefix + other)[:limit]]
+
+
+class CardIndex(object):
+    # Prebuilt autocomplete index for card and series lookups; never touches the database
+    def __init__(self, catalog):
+        self.series = {series: SeriesIndex(cards) for series, cards in catalog.series_cards.items()}
+        self.series_by_text = dict(catalog.series_by_text)
+        # Set names (e.g. "X-Men (1992)") and series names (e.g. "1992-Impel-X-Men") with their lowercase forms
+        self.series_texts = [(text, text.lower()) for text in sorted(catalog.series_by_text.keys())]
+        self.series_names = [(series, series.lower()) for series in sorted(catalog.series_cards.keys())]
+
+        # Latency counters, exported as the card_search_seconds summary (see /metrics)
+        self.num_queries = 0
+        self.total_time = 0
+        self.max_time = 0
+
+    def timed(self, func, *args):
+        start = perf_counter()
+        result = func(*args)
+        elapsed = perf_counter() - start
+        self.num_queries += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        return result
+
+    def search_cards(self, series_text, query, limit=MAX_RESULTS):
+        series = self.series_by_text.get(series_text, series_text)
+        if series not in self.series:
+            return []
+        return self.timed(self.series[series].search, query, limit)
+
+    @staticmethod
+    def _match(names, query, limit):
+        query = query.strip().lower()
+        return [name for name, lower in names if query in lower][:limit]
+
+    def search_series_text(self, query, limit=MAX_RESULTS):
+        return self.timed(self._match, self.series_texts, query, limit)
+
+    def search_series(self, query, limit=MAX_RESULTS):
+        return self.timed(self._match, self.series_names, query, limit)
+
+    def latency(self):
+        # Returns (number of queries, total seconds, max seconds), for Metrics.add_summary
+        return self.num_queries, self.total_time, self.max_time
@@ -0,0 +1,180 @@
+import argparse
+from datetime import datetime
+import io
+import json
+import os
+import sqlite3
+from time import perf_counter
+import zipfile
+
+import numpy as np
+
+import schema
+
+
+DATABASE_PATH = "./data/trading_cards.sqlite"
+BACKUP_DIRECTORY = "./data/backups"
+TABLES = ["players", "ledger", "collection", "card_history", "sets", "cards"]  # Game state; caches and pending trades aren't kept
+CHUNK_ROWS = 50_000
+FORMAT_VERSION = 1
+COMPRESS_LEVEL = 1  # zlib's fastest level; higher levels cost several times the export time for ~15% smaller snapshots
+
+# A snapshot is a zip file holding manifest.json and, for every table, chunks of CHUNK_ROWS rows stored column by
+# column ("<table>/<chunk>/<column>.npy" for integer and real columns, ".json" for text and mixed columns, and
+# "<column>.null.npy" marking the NULLs of a numeric column). Repetitive columns (series, card_id, date_time)
+# compress well this way, numeric columns load straight into numpy, and both export and restore only ever hold
+# one chunk in memory.
+
+
+def table_columns(connection, table):
+    # Column names, with "rowid" first for tables without a primary key, where the rowid is a row's only identity
+    # (so rowids survive a restore); None if the table doesn't exist (yet) in this database's schema version
+    info = connection.execute(f'PRAGMA table_info("{table}");').fetchall()
+    if not info:
+        return None
+    columns = [name for (_, name, _, _, _, _) in info]
+    return columns if any(pk for (_, _, _, _, _, pk) in info) else ["rowid"] + columns
+
+
+def encode_column(values):
+    # Returns {suffix: bytes} for one chunk of one column
+    types = set(map(type, values))
+    has_nulls = type(None) in types
+    types.discard(type(None))
+    if types == {int} or types == {float}:
+        dtype = np.int64 if types == {int} else np.float64
+        encoded = {".npy": np.array([0 if value is None else value for value in values] if has_nulls else values, dtype=dtype)}
+        if has_nulls:
+            encoded[".null.npy"] = np.array([value is None for value in values])
+        files = {}
+        for suffix, array in encoded.items():
+            buffer = io.BytesIO()
+            np.save(buffer, array, allow_pickle=False)
+            files[suffix] = buffer.getvalue()
+        return files
+    return {".json": json.dumps(values, separators=(",", ":")).encode()}
+
+
+def decode_column(archive, names, prefix):
+    # names: the set of the archive's file names
+    if f"{prefix}.json" in names:
+        return json.loads(archive.read(f"{prefix}.json"))
+    values = np.load(io.BytesIO(archive.read(f"{prefix}.npy")), allow_pickle=False).tolist()
+    if f"{prefix}.null.npy" in names:
+        nulls = np.load(io.BytesIO(archive.read(f"{prefix}.null.npy")), allow_pickle=False)
+        for i in np.flatnonzero(nulls):
+            values[i] = None
+    return values
+
+
+def export_snapshot(database_path, path, tables=TABLES, chunk_rows=CHUNK_ROWS):
+    # Write a snapshot of the tables as they were at one instant. Reads run in a single read transaction, which
+    # under WAL doesn't block the bot's writers and doesn't see their later commits. Returns the manifest.
+    start = perf_counter()
+    connection = sqlite3.connect(f"file:{database_path}?mode=ro", uri=True, isolation_level=None)
+    try:
+        connection.execute("BEGIN;")
+        manifest = {"format": FORMAT_VERSION, "schema_version": schema.get_version(connection),
+                    "created": datetime.now().isoformat(timespec="seconds"), "tables": {}}
+        with zipfile.ZipFile(f"{path}.tmp", "w", compression=zipfile.ZIP_DEFLATED, compresslevel=COMPRESS_LEVEL) as archive:
+            for table in tables:
+                columns = table_columns(connection, table)
+                if columns is None:
+                    continue
+                cursor = connection.execute(f'SELECT {", ".join(columns)} FROM "{table}";')
+                num_rows = num_chunks = 0
+                while True:
+                    rows = cursor.fetchmany(chunk_rows)
+                    if not rows:
+                        break
+                    for column, values in zip(columns, zip(*rows)):
+                        for suffix, data in encode_column(list(values)).items():
+                            archive.writestr(f"{table}/{num_chunks:05d}/{column}{suffix}", data)
+                    num_rows += len(rows)
+                    num_chunks += 1
+                manifest["tables"][table] = {"columns": columns, "rows": num_rows, "chunks": num_chunks}
+            manifest["seconds"] = round(perf_counter() - start, 3)
+            archive.writestr("manifest.json", json.dumps(manifest, indent=1))
+        connection.execute("COMMIT;")
+    finally:
+        connection.close()
+    os.replace(f"{path}.tmp", path)  # A snapshot file only appears once it is complete
+    return manifest
+
+
+def restore_snapshot(path, database_path):
+    # Build a new database from a snapshot: create the schema the snapshot was taken at, drop the restored tables'
+    # indexes, bulk insert every chunk in one transaction without a journal, then rebuild the indexes and
+    # statistics and apply any later migrations to the restored data.
+    # Refuses to overwrite an existing file; stop the bot and swap the restored file in by hand. Pending trades
+    # aren't snapshotted, so they are gone after a restore (their cards stay with their owners).
+    if os.path.exists(database_path):
+        raise FileExistsError(f"{database_path} already exists")
+    start = perf_counter()
+    with zipfile.ZipFile(path) as archive:
+        manifest = json.loads(archive.read("manifest.json"))
+        names = set(archive.namelist())
+        if manifest["format"] > FORMAT_VERSION or manifest["schema_version"] > schema.SCHEMA_VERSION:
+            raise ValueError(f"{path} was written by a newer version of the bot")
+        connection = sqlite3.connect(database_path, isolation_level=None)
+        try:
+            schema.migrate(connection.cursor(), manifest["schema_version"])
+            tables = manifest["tables"]
+            indexes = connection.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+                                         f"AND tbl_name IN ({', '.join(['?']*len(tables))});", list(tables)).fetchall()
+            connection.execute("PRAGMA journal_mode = OFF;")
+            connection.execute("PRAGMA synchronous = OFF;")
+            connection.execute("BEGIN;")
+            for name, _ in indexes:
+                connection.execute(f'DROP INDEX "{name}";')
+            for table, info in tables.items():
+                columns = info["columns"]
+                insert = f'INSERT INTO "{table}" ({", ".join(columns)}) VALUES ({", ".join(["?"]*len(columns))});'
+                for chunk in range(info["chunks"]):
+                    values = [decode_column(archive, names, f"{table}/{chunk:05d}/{column}") for column in columns]
+                    connection.executemany(insert, zip(*values))
+            for _, sql in indexes:
+                connection.execute(sql)
+            connection.execute("ANALYZE;")
+            connection.execute("COMMIT;")
+            counts = {table: connection.execute(f'SELECT COUNT(*) FROM "{table}";').fetchone()[0] for table in tables}
+            connection.execute("PRAGMA journal_mode = WAL;")
+            schema.migrate(connection.cursor())
+        finally:
+            connection.close()
+    mismatched = {table: (counts[table], info["rows"]) for table, info in tables.items() if counts[table] != info["rows"]}
+    if mismatched:
+        raise ValueError(f"Restored row counts don't match the snapshot: {mismatched}")
+    return counts, perf_counter() - start
+
+
+def backup_path(directory=BACKUP_DIRECTORY):
+    os.makedirs(directory, exist_ok=True)
+    return f"{directory}/snapshot-{datetime.now().strftime('%Y%m%d-%H%M%S')}.zip"
+
+
+if __name__ == "__main__":
+    # Run from the repository root, e.g.
+    #   python utils/snapshot.py export
+    #   python utils/snapshot.py restore data/backups/snapshot-20240101-120000.zip restored.sqlite
+    parser = argparse.ArgumentParser(description="Export or restore snapshots of the game database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="write a snapshot of the live database")
+    export_parser.add_argument("--database", default=DATABASE_PATH, help=f"database to read (default: {DATABASE_PATH})")
+    export_parser.add_argument("--output", default=None, help=f"snapshot file (default: a new file in {BACKUP_DIRECTORY})")
+    restore_parser = commands.add_parser("restore", help="build a new database file from a snapshot")
+    restore_parser.add_argument("snapshot", help="snapshot file")
+    restore_parser.add_argument("database", help="database file to create (must not exist)")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        output = args.output or backup_path()
+        manifest = export_snapshot(args.database, output)
+        print(f"Wrote {output} ({os.path.getsize(output)/2**20:.1f} MB) in {manifest['seconds']} s: " +
+              ", ".join([f"{table} {info['rows']}" for table, info in manifest["tables"].items()]))
+    else:
+        try:
+            counts, seconds = restore_snapshot(args.snapshot, args.database)
+        except (FileExistsError, ValueError) as error:
+            parser.error(str(error))
+        print(f"Restored {args.database} in {seconds:.2f} s: " + ", ".join([f"{table} {n}" for table, n in counts.items()]))
@@ -0,0 +1,169 @@
+from collections import Counter
+import re
+import sqlite3
+from threading import Lock
+from time import perf_counter
+
+import metrics
+
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+BLOB_LITERAL = re.compile(r"\b[xX]\?")  # X'...' once its string has been replaced
+NUMBER_LITERAL = re.compile(r"(?<![\w.\"])\d+(?:\.\d+)?(?:[eE][+-]?\d+)?(?![\w\"])")
+WHITESPACE = re.compile(r"\s+")
+PARAMETER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")  # IN (?, ?, ?) -> IN (?)
+ROW_LIST = re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+")  # VALUES (?), (?), (?) -> VALUES (?), ...
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+FULL_SCAN = re.compile(r"^SCAN (\w+)")
+
+
+def normalize(statement):
+    # Statement shape: the SQL with its literals (and so the bound parameters, which the trace callback sees
+    # expanded) replaced by ?, lists of them collapsed, and whitespace squeezed
+    shape = STRING_LITERAL.sub("?", statement)
+    shape = BLOB_LITERAL.sub("?", shape)
+    shape = NUMBER_LITERAL.sub("?", shape)
+    shape = WHITESPACE.sub(" ", shape).strip()
+    shape = PARAMETER_LIST.sub("(?)", shape)
+    return ROW_LIST.sub("(?), ...", shape)
+
+
+class Shape(object):
+    # Executions of one statement shape
+    __slots__ = ("count", "total", "max", "slowest", "plan", "full_scans")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slowest = None  # Expanded SQL of the slowest execution
+        self.plan = None  # EXPLAIN QUERY PLAN details, once captured
+        self.full_scans = []  # Tables the plan scans in full
+
+
+class ConnectionTrace(object):
+    # The statement running on one connection, and the new shapes it has seen that still need a query plan
+    __slots__ = ("statement", "start", "key", "to_explain")
+
+    def __init__(self):
+        self.statement = None
+        self.start = 0.0
+        self.key = None
+        self.to_explain = []
+
+
+class SqlTracer(object):
+    # Optional tracing of every statement run by the Database's pooled connections (see Bot.sql_trace).
+    # sqlite3's trace callback only reports when a statement starts, so a statement is timed until the next one
+    # starts on the same connection, or until the Database call that ran it returns; this includes fetching its
+    # rows and any Python work in between, which is what the caller waited for anyway.
+    # Statements are grouped by shape (see normalize) and counted per command/view/listener invocation (see metrics).
+    # Statements slower than slow_threshold seconds are printed, and the first time a shape is seen its
+    # EXPLAIN QUERY PLAN is captured, so a full table scan shows up in the log as soon as the query runs.
+    def __init__(self, slow_threshold=0.02, clock=perf_counter):
+        self.slow_threshold = slow_threshold
+        self.clock = clock
+        self.shapes = {}  # {shape: Shape}
+        self.invocations = {}  # {(kind, name) or None: Counter({shape: executions})}
+        self.tables = None
+        self.lock = Lock()
+        self.connections = {}  # {connection: ConnectionTrace}
+
+    def attach(self, connection):
+        trace = self.connections[connection] = ConnectionTrace()
+        connection.set_trace_callback(lambda statement: self.statement(trace, statement))
+
+    def detach(self, connection):
+        connection.set_trace_callback(None)
+        self.connections.pop(connection, None)
+
+    def statement(self, trace, statement):
+        # Trace callback, on the database worker thread running the statement
+        now = self.clock()
+        if trace.statement is not None:
+            self.record(trace, now)
+        trace.statement = statement
+        trace.start = now
+        trace.key = metrics.count_statement()
+
+    def finish(self, connection):
+        # Called by the Database once a call's transaction is over: times its last statement and explains new shapes
+        trace = self.connections.get(connection)
+        if trace is None:
+            return
+        if trace.statement is not None:
+            self.record(trace, self.clock())
+            trace.statement = None
+        if trace.to_explain:
+            to_explain, trace.to_explain = trace.to_explain, []
+            connection.set_trace_callback(None)  # Don't trace the EXPLAINs themselves
+            try:
+                for shape, statement in to_explain:
+                    self.explain(connection, shape, statement)
+            finally:
+                connection.set_trace_callback(lambda statement: self.statement(trace, statement))
+
+    def record(self, trace, now):
+        elapsed = now - trace.start
+        shape = normalize(trace.statement)
+        with self.lock:
+            stats = self.shapes.get(shape)
+            if stats is None:
+                stats = self.shapes[shape] = Shape()
+                if shape.upper().startswith(EXPLAINABLE):
+                    trace.to_explain.append((shape, trace.statement))
+            stats.count += 1
+            stats.total += elapsed
+            if elapsed >= stats.max:
+                stats.max = elapsed
+                stats.slowest = trace.statement
+            invocation = self.invocations.get(trace.key)
+            if invocation is None:
+                invocation = self.invocations[trace.key] = Counter()
+            invocation[shape] += 1
+        if elapsed >= self.slow_threshold:
+            name = trace.key[1] if trace.key else "outside commands"
+            print(f"Slow query ({elapsed*1000:.1f} ms, {name}): {WHITESPACE.sub(' ', trace.statement)[:500]}")
+
+    def explain(self, connection, shape, statement):
+        try:
+            if self.tables is None:
+                self.tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table';")}
+            plan = [row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN {statement}")]
+        except sqlite3.Error as error:  # e.g. the expanded SQL was too long and still has its ? placeholders
+            plan = [f"(no plan: {error})"]
+        full_scans = [match.group(1) for match in map(FULL_SCAN.match, plan) if match and match.group(1) in self.tables]
+        with self.lock:
+            self.shapes[shape].plan = plan
+            self.shapes[shape].full_scans = full_scans
+        for table in full_scans:
+            print(f"Full scan of {table}: {shape[:500]}")
+
+    def report(self, limit=10, bot_metrics=None):
+        # Plain-text report: the slowest shapes by total time with their query plans, full scans, and the
+        # statements run per invocation (per call, if the bot's Metrics are given)
+        with self.lock:
+            shapes = sorted(self.shapes.items(), key=lambda item: -item[1].total)
+            invocations = {key: Counter(counter) for key, counter in self.invocations.items()}
+
+        lines = [f"Slowest statement shapes (of {len(shapes)}), by total time:"]
+        for shape, stats in shapes[:limit]:
+            lines.append(f"\n{stats.total*1000:.1f} ms total, {stats.count} runs, {stats.total/stats.count*1000:.2f} ms mean, "
+                         f"{stats.max*1000:.2f} ms max")
+            lines.append(f"  {shape}")
+            lines.append(f"    slowest run: {WHITESPACE.sub(' ', stats.slowest)[:300]}")
+            plan = ["(not captured)"] if stats.plan is None else stats.plan or ["(no table access)"]
+            lines += [f"    plan: {detail}" for detail in plan]
+
+        scans = [(shape, stats) for shape, stats in shapes if stats.full_scans]
+        lines.append(f"\nFull table scans ({len(scans)} shapes):")
+        lines += [f"  {', '.join(stats.full_scans)} ({stats.count} runs): {shape}" for shape, stats in scans]
+
+        lines.append("\nStatements per invocation:")
+        for key, counter in sorted(invocations.items(), key=lambda item: -sum(item[1].values())):
+            total = sum(counter.values())
+            calls = bot_metrics.series[key].count if bot_metrics and key in bot_metrics.series else 0
+            per_call = f", {total/calls:.1f} per call" if calls else ""
+            lines.append(f"  {' '.join(key) if key else 'outside commands'}: {total} statements{per_call}")
+            lines += [f"    {count:>6}  {shape[:200]}" for shape, count in counter.most_common(5)]
+        return '\n'.join(lines)
@@ -0,0 +1,51 @@
+from datetime import datetime
+
+import pytz
+
+
+def zone_offsets(tz, year):
+    # Standard and daylight saving UTC offsets of a zone in a given year, in seconds (one value if it has no DST)
+    return {int(tz.localize(datetime(year, month, 1)).utcoffset().total_seconds()) for month in (1, 7)}
+
+
+class TimezoneService(object):
+    # Timezone lookups for the /time commands, built once at startup.
+    # Keeps one tzinfo per configured zone and an index of every zone by the UTC offsets it uses this year,
+    # so requests never construct tz objects or scan the zone database.
+    def __init__(self, timezones, year=None):
+        # timezones: {label shown to users: zone name}, e.g. {"UTC+9 (Japan, ...)": "Asia/Tokyo"}
+        self.labels = dict(timezones)
+        self.zones = {name: pytz.timezone(name) for name in set(timezones.values()) | {"UTC"}}
+        self.year = year or datetime.now().year
+
+        self.offsets = {}  # {offset in seconds: [zone names]}, standard and DST offsets, over all zones
+        for name in pytz.all_timezones:
+            tz = self.zones[name] if name in self.zones else pytz.timezone(name)
+            for offset in zone_offsets(tz, self.year):
+                self.offsets.setdefault(offset, []).append(name)
+
+    def get(self, timezone):
+        # tzinfo for a configured label or a zone name; None if unknown
+        name = self.labels.get(timezone, timezone)
+        if name not in self.zones:
+            if name not in pytz.all_timezones_set:
+                return None
+            self.zones[name] = pytz.timezone(name)
+        return self.zones[name]
+
+    def possible_timezones(self, tz_offset, common_only=True):
+        # Zone names that use the offset (in hours, e.g. -5 or 5.5) as their standard or DST offset this year
+        names = self.offsets.get(int(round(tz_offset*3600)), [])
+        if common_only:
+            configured = set(self.labels.values())
+            names = [name for name in names if name in configured]
+        return names
+
+    def localize(self, dt, timezone):
+        # Attach a timezone to a naive datetime, with the right DST offset for that date
+        tz = self.get(timezone)
+        return tz.localize(dt) if dt.tzinfo is None else dt
+
+    def convert(self, dt, timezones=None):
+        # Returns [(label, converted datetime)] for the given labels or zone names (default: every configured zone)
+        return [(timezone, dt.astimezone(self.get(timezone))) for timezone in (timezones or self.labels.keys())]
@@ -1,35 +1,31 @@
 import discord
-import re
 
 
 def get_key_from_value(d, val):
     return [k for k, v in d.items() if v == val]
 
 
-def trading_card_embed_standard(series, image_path, rarity_rank, num_cards, series_text):
+def trading_card_embed_standard(card, num_cards, attachments=None):
     # Creates standard template for viewing trading card
-    rarity = {1: "🔹 (Common)", 2: "🔹🔹 (Uncommon)", 3: "🔹🔹🔹 (Rare)", 4: "🔸🔸🔸🔸 (Epic)", 5: "♦️♦️♦️♦️♦️ (Legendary!)"}
-
-    if ".gif" in image_path:
-        image_type = "gif"
-    else:
-        image_type = "png"
-    image = discord.File(f"./data/cards/{series}/merged/{image_path}", filename=f"card.{image_type}")
-    pattern = rf"_#(\d+|MH\d+|XH\d+)_(.+?).{image_type}"
-    regex_result = re.search(pattern, image_path)
-
-    if rarity_rank <= 3:
-        colour = discord.Colour.blue()
-    elif rarity_rank == 4:
-        colour = discord.Colour.orange()
+    # card is a catalog.Card, so the title, colour and rarity text are already built.
+    # If the card's image is already hosted by Discord (attachments is an AttachmentCache), the embed links to it and
+    # image is None; otherwise image is the file to upload with the embed.
+    url = attachments.get(card.key) if attachments else None
+    if url:
+        image = None
     else:
-        colour = discord.Colour.red()
+        image = discord.File(card.upload_path, filename=f"card.{card.upload_type}")
+        url = f"attachment://card.{card.upload_type}"
 
-    embed = discord.Embed(title=f"Card #{regex_result.group(1)}: {regex_result.group(2).replace('_', ' ')}",
-                          colour=colour)
-    embed.add_field(name=f"Set", value=f"{series_text}", inline=False)
-    embed.add_field(name=f"Rarity: {rarity[rarity_rank]}",
+    embed = discord.Embed(title=card.title, colour=card.colour)
+    embed.add_field(name=f"Set", value=f"{card.series_text}", inline=False)
+    embed.add_field(name=f"Rarity: {card.rarity_text}",
                     value=f"There {'is' if num_cards == 1 else 'are'} currently {num_cards} of this card in circulation.")
-    embed.set_image(url=f"attachment://card.{image_type}")
+    embed.set_image(url=url)
 
     return embed, image
+
+
+def file_kwargs(image):
+    # Keyword arguments for sending an embed with an optional file, since discord.py rejects file=None
+    return {"file": image} if image else {}
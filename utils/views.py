@@ -1,13 +1,31 @@
 import discord
-import re
-import sqlite3
+from collections.abc import Sequence
 import sys
-from datetime import datetime
 sys.path.append("./utils")
 import tools
 
 
-class YesNoView(discord.ui.View):
+class TrackedView(discord.ui.View):
+    # Base for the bot's views: times each item callback in the bot's metrics as "<View>.<Item>".
+    # Overrides View._scheduled_task, which is where discord.py runs item callbacks (and hands errors to on_error).
+    async def _scheduled_task(self, item, interaction):
+        metrics = getattr(interaction.client, "metrics", None)
+        if metrics is None:
+            return await super()._scheduled_task(item, interaction)
+        with metrics.track("view", self.metrics_name(item)):
+            await super()._scheduled_task(item, interaction)
+
+    async def on_error(self, error, item, interaction):
+        metrics = getattr(interaction.client, "metrics", None)
+        if metrics is not None:
+            metrics.count_error("view", self.metrics_name(item))
+        await super().on_error(error, item, interaction)
+
+    def metrics_name(self, item):
+        return f"{type(self).__name__}.{type(item).__name__}"
+
+
+class YesNoView(TrackedView):
     # A simple view with two buttons, Yes and No. Choosing one will disable both bottoms.
     # Buttons disappear after 10 minutes.
     # Currently used for:
@@ -50,7 +68,7 @@ class CustomButton(discord.ui.Button):
         super().__init__(label=label, url=url, style=style, disabled=disabled)
 
 
-class OpenCardPack(discord.ui.View):
+class OpenCardPack(TrackedView):
     def __init__(self, ctx, bot, num_packs, series, series_text):
         super().__init__(timeout=600)
         self.num_packs = num_packs
@@ -61,8 +79,21 @@ class OpenCardPack(discord.ui.View):
         self.add_buttons()
 
     def add_buttons(self):
+        # One row per set: open a single pack, or open all remaining packs at once
         for i, series in enumerate(self.series):
-            self.add_item(OpenCardPackButton(self.ctx, self.bot, series, label=f"{self.series_text[i].split('(')[0]} ({self.num_packs} packs)"))
+            self.add_item(OpenCardPackButton(self.ctx, self.bot, series, self.series_text[i].split('(')[0].strip(), row=i))
+            self.add_item(OpenCardPackButton(self.ctx, self.bot, series, self.series_text[i].split('(')[0].strip(), open_all=True,
+                                             style=discord.ButtonStyle.grey, row=i))
+        self.update_buttons()
+
+    def update_buttons(self):
+        for x in self.children:
+            if x.open_all:
+                x.label = f"Open all {x.series_text} ({self.num_packs} packs)"
+            else:
+                x.label = f"Open {x.series_text} ({self.num_packs} packs)"
+            if self.num_packs < 1:
+                x.disabled = True
 
     async def on_timeout(self):
         await self.ctx.interaction.edit_original_response(view=None)
@@ -70,46 +101,53 @@ class OpenCardPack(discord.ui.View):
 
 class OpenCardPackButton(discord.ui.Button):
     def __init__(self,
-                 ctx, bot, series,
-                 label: str = None,
+                 ctx, bot, series, series_text,
+                 open_all: bool = False,
                  style: discord.ButtonStyle = discord.ButtonStyle.blurple,
-                 disabled: bool = False):
+                 disabled: bool = False,
+                 row: int = None):
         self.ctx = ctx
         self.bot = bot
         self.series = series
-        super().__init__(label=label, style=style, disabled=disabled)
+        self.series_text = series_text
+        self.open_all = open_all  # Open every remaining pack in one go
+        super().__init__(label=series_text, style=style, disabled=disabled, row=row)
 
     async def callback(self, interaction: discord.Interaction):
         if self.ctx.author.id == interaction.user.id:
             await interaction.response.defer()
-            connection = sqlite3.connect(self.bot.game_database)
-            cursor = connection.cursor()
-            (self.view.num_packs,) = cursor.execute("SELECT packs FROM players WHERE player_id = ?;",
-                                                    (self.ctx.author.id,)).fetchone()
-            connection.close()
-            if self.view.num_packs > 0:
-                image, embed, view_dropdown = await self.bot.get_cog("Game").open_card_pack(self.ctx, series=self.series)
-                self.view.num_packs -= 1
-                for i, x in enumerate(self.view.children):
-                    x.label = f"Open {self.view.series_text[i]} ({self.view.num_packs} packs)"
-                    if self.view.num_packs < 1:
-                        x.disabled = True
-                await interaction.edit_original_response(view=self.view)
-                view_dropdown.message = await interaction.followup.send(file=image, embed=embed, view=view_dropdown)
+            self.view.num_packs = await self.bot.db.get_packs(self.ctx.author.id)
+            if self.view.num_packs:
+                game = self.bot.get_cog("Game")
+                num_packs = self.view.num_packs if self.open_all else 1
+                if num_packs > 1:
+                    image, embed, view_dropdown = await game.open_card_packs(self.ctx, self.series, num_packs)
+                else:
+                    image, embed, view_dropdown = await game.open_card_pack(self.ctx, series=self.series)
+                if embed:
+                    self.view.num_packs -= num_packs
+                    self.view.update_buttons()
+                    await interaction.edit_original_response(view=self.view)
+                    view_dropdown.message = await interaction.followup.send(file=image, embed=embed, view=view_dropdown)
+                else:
+                    await interaction.followup.send("Whoops! You don't have enough packs left.")
             else:
                 await interaction.followup.send("Whoops! You don't have any available packs.")
         else:
             await interaction.response.send_message("Can't open other members' card packs.", ephemeral=True)
-        print(f"{datetime.now()}: /cards open (button) called by {interaction.user.display_name}")
 
 
 class CardsDropdown(discord.ui.Select):
-    def __init__(self, cards, series, sqlite_database):
+    def __init__(self, cards, database, labels=None, attachments=None, collections=None):
+        # cards is a list of catalog.Card; labels default to "Name (SET-#number)"
+        # attachments is an AttachmentCache, so cards already uploaded are shown by URL instead of re-uploaded
+        # collections is a CollectionCache, so the viewer's own count is read from memory
         self.cards = cards
-        self.series = {cards[i]: series[i] for i in range(len(cards))}
-        self.sqlite_database = sqlite_database
+        self.database = database
+        self.attachments = attachments
+        self.collections = collections
 
-        options = [discord.SelectOption(label=f"{card}") for card in self.cards]
+        options = [discord.SelectOption(label=f"{labels[i] if labels else card.label}", value=str(i)) for i, card in enumerate(self.cards)]
 
         super().__init__(placeholder="Choose a card for a closer look",
                          min_values=0,
@@ -117,29 +155,36 @@ class CardsDropdown(discord.ui.Select):
                          options=options)
 
     async def callback(self, interaction: discord.Interaction):
-        card_id = re.search(r"-#(\d+|MH\d+|XH\d+)", self.values[0]).group(1)
-        series = self.series[self.values[0]]
-        connection = sqlite3.connect(self.sqlite_database)
-        cursor = connection.cursor()
-        (image_path, series, rarity) = cursor.execute("SELECT image_path, series, rarity FROM cards WHERE card_id = ? AND series = ?;", (card_id, series)).fetchone()
-        (num_cards,) = cursor.execute("SELECT COUNT(*) FROM collection WHERE card_id = ? AND series = ?;", (card_id, series)).fetchone()
-        (num_cards_players,) = cursor.execute("SELECT COUNT(*) FROM collection WHERE card_id = ? AND player_id = ? AND series = ?;", (card_id, interaction.user.id, series)).fetchone()
-        (series_text,) = cursor.execute("SELECT prettify FROM sets WHERE series = ?;", (series,)).fetchone()
-        connection.close()
+        if not self.values:
+            await interaction.response.defer()
+            return
+        card = self.cards[int(self.values[0])]
+        if self.collections is not None:
+            counts = await self.database.get_card_counts(card.card_id, card.series)
+            num_player = (await self.collections.get(interaction.user.id)).count(card.key)
+        else:
+            counts = await self.database.get_card_counts(card.card_id, card.series, player_id=interaction.user.id)
+            num_player = counts["num_player"]
 
-        embed, image = tools.trading_card_embed_standard(series, image_path, rarity, num_cards, series_text)
-        embed.set_footer(text=f"{interaction.user.display_name} owns {num_cards_players} of this card.")
+        # The edit below drops the previously shown card's file (attachments=[]), and Discord deletes that file, so
+        # its URL can't be linked to any more (including by this embed, if the same card is picked again)
+        if self.attachments is not None:
+            await self.attachments.evict_message(interaction.message.id)
+        embed, image = tools.trading_card_embed_standard(card, counts["num_cards"], self.attachments)
+        embed.set_footer(text=f"{interaction.user.display_name} owns {num_player} of this card.")
 
-        await interaction.response.edit_message(embed=embed, file=image)
+        await interaction.response.edit_message(embed=embed, attachments=[], **tools.file_kwargs(image))
+        if image and self.attachments is not None:
+            await self.attachments.remember(card.key, await interaction.original_response())
 
 
-class CardsDropdownView(discord.ui.View):
-    def __init__(self, cards, series, sqlite_database):
+class CardsDropdownView(TrackedView):
+    def __init__(self, cards, database, labels=None, attachments=None, collections=None):
         self.cards = cards
-        self.series = series
-        self.sqlite_database = sqlite_database
+        self.database = database
 
-        super().__init__(CardsDropdown(self.cards, self.series, self.sqlite_database), disable_on_timeout=True, timeout=600)
+        super().__init__(CardsDropdown(self.cards, self.database, labels=labels, attachments=attachments, collections=collections),
+                         disable_on_timeout=True, timeout=600)
 
     async def on_timeout(self):
         for x in self.children:
@@ -151,9 +196,9 @@ class CardsDropdownView(discord.ui.View):
             pass
 
 
-class CardsTradeView(discord.ui.View):
-    def __init__(self, ctx, allowed):
-        super().__init__(timeout=600)
+class CardsTradeView(TrackedView):
+    def __init__(self, ctx, allowed, timeout=600):
+        super().__init__(timeout=timeout)
         self.value = None
         self.user = None
         self.ctx = ctx
@@ -187,3 +232,24 @@ class CardsTradeView(discord.ui.View):
 
     async def on_timeout(self):
         await self.ctx.interaction.edit_original_response(view=None)
+
+
+class LazyPages(Sequence):
+    # Page list for pages.Paginator that builds each page the first time it is shown.
+    # build_page(n) returns the pages.Page for page n; built pages are kept so going back doesn't rebuild them.
+    def __init__(self, num_pages, build_page):
+        self.num_pages = num_pages
+        self.build_page = build_page
+        self.built = {}
+
+    def __len__(self):
+        return self.num_pages
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += self.num_pages
+        if not 0 <= n < self.num_pages:
+            raise IndexError("page index out of range")
+        if n not in self.built:
+            self.built[n] = self.build_page(n)
+        return self.built[n]